@@ -2,53 +2,76 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import requests
 import concurrent.futures
-from urllib.parse import urlparse, parse_qs
+import asyncio
+from urllib.parse import urlparse, urljoin
 import os
 import socket
 import time
 import re
-from bs4 import BeautifulSoup
+import threading
 from datetime import datetime
-from collections import Counter
-import warnings
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-def check_network_capabilities():
-    """检查当前网络环境的能力"""
-    capabilities = {
-        'ipv4': {'available': False, 'speed': 0},
-        'ipv6': {'available': False, 'speed': 0}
-    }
-    
-    # 检查IPv4连接和速度
-    try:
-        start_time = time.time()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        sock.connect(('8.8.8.8', 53))
-        capabilities['ipv4']['available'] = True
-        capabilities['ipv4']['speed'] = 1 / (time.time() - start_time)
-    except:
-        pass
-    finally:
-        sock.close()
-    
-    # 检查IPv6连接和速度
+from collections import Counter, OrderedDict
+
+_requests_ready = False
+
+def _requests():
+    """按需导入requests(导入较慢, 异步引擎检测本地列表时用不到), 并关闭verify=False的警告"""
+    global _requests_ready
+    import requests
+    if not _requests_ready:
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        _requests_ready = True
+    return requests
+
+# 网络环境检测配置
+NETWORK_PROBE_TARGETS = {'ipv4': ('8.8.8.8', 53), 'ipv6': ('2001:4860:4860::8888', 53)}
+NETWORK_PROBE_TIMEOUT = 2
+NETWORK_CACHE_FILE = 'network_cache.json'
+NETWORK_CACHE_TTL = 300            # 检测结果的有效期(秒)
+
+def _probe_network_family(family, target, timeout):
+    """连接目标地址, 返回速度评分(耗时的倒数), 连接失败时返回0"""
+    sock = socket.socket(socket.AF_INET6 if family == 'ipv6' else socket.AF_INET, socket.SOCK_STREAM)
     try:
-        start_time = time.time()
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        sock.connect(('2001:4860:4860::8888', 53))
-        capabilities['ipv6']['available'] = True
-        capabilities['ipv6']['speed'] = 1 / (time.time() - start_time)
-    except:
-        pass
+        sock.settimeout(timeout)
+        start_time = time.monotonic()
+        sock.connect(target)
+        return 1 / max(time.monotonic() - start_time, 1e-6)
+    except OSError:
+        return 0
     finally:
         sock.close()
-    
+
+def check_network_capabilities(targets=None, timeout=NETWORK_PROBE_TIMEOUT, use_cache=True):
+    """检查当前网络环境的能力
+
+    IPv4和IPv6同时检测, 总耗时取决于较慢的一个。结果在 NETWORK_CACHE_TTL 秒内
+    保存在 network_cache.json 中, 目标地址相同时直接使用
+    """
+    import json
+    targets = targets or NETWORK_PROBE_TARGETS
+    cache_key = {family: list(target) for family, target in targets.items()}
+    if use_cache:
+        try:
+            with open(NETWORK_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached['targets'] == cache_key and time.time() - cached['checked_at'] < NETWORK_CACHE_TTL:
+                return cached['capabilities']
+        except Exception:
+            pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {family: executor.submit(_probe_network_family, family, tuple(target), timeout)
+                   for family, target in targets.items()}
+        capabilities = {}
+        for family, future in futures.items():
+            speed = future.result()
+            capabilities[family] = {'available': speed > 0, 'speed': speed}
+    capabilities.setdefault('ipv4', {'available': False, 'speed': 0})
+    capabilities.setdefault('ipv6', {'available': False, 'speed': 0})
+
     # 自动决定IP偏好
     if capabilities['ipv4']['available'] and capabilities['ipv6']['available']:
         if capabilities['ipv4']['speed'] > capabilities['ipv6']['speed']:
@@ -61,9 +84,37 @@ def check_network_capabilities():
         capabilities['preference'] = 'ipv6'
     else:
         capabilities['preference'] = None
-        
+
+    if use_cache:
+        try:
+            with open(NETWORK_CACHE_FILE, 'w', encoding='utf-8') as f:
+                json.dump({'targets': cache_key, 'checked_at': time.time(), 'capabilities': capabilities}, f)
+        except OSError:
+            pass
     return capabilities
 
+def start_network_check(**kwargs):
+    """在后台线程中检查网络环境, 返回Future, 以便与加载EPG等操作同时进行"""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(check_network_capabilities, **kwargs)
+    executor.shutdown(wait=False)
+    return future
+
+def report_network_check(network_check):
+    """打印后台网络环境检测的结果, 尚未完成时等待"""
+    if not network_check.done():
+        print("正在检查网络环境...")
+    network_info = network_check.result()
+    if network_info['ipv4']['available']:
+        print(f"√ IPv4 网络可用 (速度评分: {network_info['ipv4']['speed']:.2f})")
+    if network_info['ipv6']['available']:
+        print(f"√ IPv6 网络可用 (速度评分: {network_info['ipv6']['speed']:.2f})")
+    if network_info['preference']:
+        print(f"将优先使用 {network_info['preference'].upper()} 网络")
+    else:
+        print("× 未检测到可用的网络, 检测结果可能全部失败")
+    return network_info
+
 def is_valid_url(url):
     """检查是否是有效的URL"""
     try:
@@ -72,6 +123,290 @@ def is_valid_url(url):
     except:
         return False
 
+# EPG配置
+EPG_SOURCES = [
+    'https://epg.112114.xyz/pp.xml',
+    'https://epg.112114.xyz/e.xml',
+    'http://epg.51zmt.top:8000/api/diyp/',
+    'http://epg.51zmt.top:8000/e.xml'
+]
+EPG_CACHE_FILE = 'epg_cache.json'
+EPG_META_FILE = 'epg_cache_meta.json'   # 缓存来源及其ETag/Last-Modified
+EPG_TIMEOUT = (5, 30)                   # (连接超时, 读取超时)
+
+def _load_epg_cache():
+    """读取本地缓存的EPG数据, 失败时返回None"""
+    if not os.path.exists(EPG_CACHE_FILE):
+        return None
+    try:
+        import json
+        with open(EPG_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _load_epg_meta():
+    try:
+        import json
+        with open(EPG_META_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_epg_cache(channels, meta):
+    """保存EPG数据和来源信息"""
+    import json
+    with open(EPG_CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(channels, f, ensure_ascii=False, indent=2)
+    with open(EPG_META_FILE, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+EPG_SNIFF_SIZE = 512                    # 判断EPG格式时查看的开头字节数
+
+class EpgSourceAborted(Exception):
+    """其他EPG源已经成功, 停止解析当前源"""
+
+class EpgFormatError(Exception):
+    """EPG源的内容既不是XMLTV也不是DIYP格式"""
+
+class EpgDownloads:
+    """记录正在进行的EPG下载, 某个源成功后中断其余源的连接"""
+
+    def __init__(self):
+        self.stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = set()
+
+    def register(self, response):
+        with self._lock:
+            if not self.stopped.is_set():
+                self._responses.add(response)
+                return
+        _abort_response(response)
+        raise EpgSourceAborted()
+
+    def unregister(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def stop(self):
+        """通知其他源停止, 并关闭它们的连接, 使阻塞中的读取立即返回"""
+        with self._lock:
+            self.stopped.set()
+            responses, self._responses = self._responses, set()
+        for response in responses:
+            _abort_response(response)
+
+def _abort_response(response):
+    """从其他线程中断一个requests响应"""
+    try:
+        shutdown = getattr(response.raw, 'shutdown', None)
+        if shutdown is not None:
+            # urllib3 2.3+ 可以关闭底层socket, 唤醒阻塞在recv上的线程
+            shutdown()
+        response.close()
+    except Exception:
+        pass
+
+def _detect_epg_format(head):
+    """根据内容开头判断EPG格式: 'xmltv'、'json'、'text', 都不是时返回None"""
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    lowered = head.lower()
+    if lowered.startswith((b'<tv', b'<!doctype tv')):
+        return 'xmltv'
+    if lowered.startswith(b'<?xml') and (b'<tv' in lowered or b'<!doctype tv' in lowered):
+        return 'xmltv'
+    if head.startswith((b'{', b'[')):
+        return 'json'
+    # DIYP文本格式: 每行 "频道ID,频道名"
+    first_line = head.split(b'\n', 1)[0]
+    if b',' in first_line and not head.startswith(b'<'):
+        return 'text'
+    return None
+
+def _parse_xmltv_stream(stream, stop_event):
+    """用iterparse流式解析XMLTV, 只保留频道信息, 解析过的元素立即清除"""
+    import xml.etree.ElementTree as ET
+    channels = {}
+    root = None
+    count = 0
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == 'channel':
+            channel_id = elem.get('id', '')
+            name_elem = elem.find('display-name')
+            if name_elem is not None and name_elem.text and channel_id:
+                name = name_elem.text.strip()
+                channels[name] = {
+                    'id': channel_id,
+                    'name': name
+                }
+        elif elem.tag != 'programme':
+            continue
+        # 释放已处理的channel/programme元素
+        elem.clear()
+        count += 1
+        if count % 1000 == 0:
+            root.clear()
+            if stop_event.is_set():
+                raise EpgSourceAborted()
+    return channels
+
+def _parse_diyp_json(stream, stop_event):
+    """解析DIYP接口的JSON频道列表: 频道对象的数组, 或包含该数组的对象"""
+    import io
+    import json
+    data = json.load(io.TextIOWrapper(stream, encoding='utf-8', errors='replace'))
+    if stop_event.is_set():
+        raise EpgSourceAborted()
+    if isinstance(data, dict):
+        data = next((data[key] for key in ('channels', 'data', 'list') if isinstance(data.get(key), list)), [])
+    channels = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        channel_id = str(item.get('id') or item.get('channel_id') or '').strip()
+        name = str(item.get('name') or item.get('channel_name') or '').strip()
+        if channel_id and name:
+            channels[name] = {
+                'id': channel_id,
+                'name': name
+            }
+    return channels
+
+def _parse_diyp_lines(stream, stop_event):
+    """解析 "频道ID,频道名" 格式的文本EPG"""
+    import io
+    channels = {}
+    for count, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8', errors='replace')):
+        if count % 1000 == 0 and stop_event.is_set():
+            raise EpgSourceAborted()
+        if ',' in line:
+            parts = line.split(',')
+            if len(parts) >= 2:
+                channel_id = parts[0].strip()
+                name = parts[1].strip()
+                channels[name] = {
+                    'id': channel_id,
+                    'name': name
+                }
+    return channels
+
+def fetch_epg_source(url, meta, downloads):
+    """下载并流式解析一个EPG源
+
+    .xml.gz 等gzip压缩内容边下载边解压; 本地缓存来自该源时带上
+    ETag/Last-Modified做条件请求。返回 (channels, 新的meta), 服务器返回304时
+    channels为None表示缓存仍然有效。内容不是XMLTV或DIYP格式时抛出
+    EpgFormatError; downloads 停止后抛出 EpgSourceAborted
+    """
+    import gzip
+    import io
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Accept-Encoding': 'gzip, deflate'
+    }
+    if meta.get('source') == url:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    if downloads.stopped.is_set():
+        raise EpgSourceAborted()
+    response = _requests().get(url, timeout=EPG_TIMEOUT, verify=False, headers=headers, stream=True)
+    downloads.register(response)
+    try:
+        new_meta = {
+            'source': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time()
+        }
+        if response.status_code == 304:
+            return None, dict(meta, fetched_at=time.time())
+        response.raise_for_status()
+
+        response.raw.decode_content = True
+        # 读完后不自动关闭, 以便包装成BufferedReader
+        response.raw.auto_close = False
+        stream = io.BufferedReader(response.raw, 64 * 1024)
+        if stream.peek(2)[:2] == b'\x1f\x8b':
+            stream = io.BufferedReader(gzip.GzipFile(fileobj=stream), 64 * 1024)
+        # 根据内容判断格式, 不依赖URL后缀
+        epg_format = _detect_epg_format(stream.peek(EPG_SNIFF_SIZE)[:EPG_SNIFF_SIZE])
+        if epg_format is None:
+            raise EpgFormatError("内容不是XMLTV或DIYP格式")
+        parse = {'xmltv': _parse_xmltv_stream, 'json': _parse_diyp_json, 'text': _parse_diyp_lines}[epg_format]
+        channels = parse(stream, downloads.stopped)
+        return channels, new_meta
+    except EpgFormatError:
+        raise
+    except Exception:
+        # 连接被其他源成功后中断, 读取时的错误不再报告
+        if downloads.stopped.is_set():
+            raise EpgSourceAborted()
+        raise
+    finally:
+        downloads.unregister(response)
+        response.close()
+
+def load_epg_sources(urls):
+    """并行请求所有EPG源, 采用最先成功的一个
+
+    本地缓存对应的源返回304时直接使用缓存, 格式无法识别的源被跳过。
+    采用某个源后中断其余源的下载。全部失败时返回None
+    """
+    meta = _load_epg_meta()
+    if _load_epg_cache() is None:
+        meta = {}
+    downloads = EpgDownloads()
+    print(f"\n正在并行获取 {len(urls)} 个EPG源...")
+    requests = _requests()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(urls))
+    futures = {executor.submit(fetch_epg_source, url, meta, downloads): url for url in urls}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            url = futures[future]
+            try:
+                channels, new_meta = future.result()
+            except EpgSourceAborted:
+                continue
+            except EpgFormatError as e:
+                print(f"跳过EPG源 ({url}): {e}")
+                continue
+            except requests.RequestException as e:
+                print(f"获取EPG数据失败 ({url}): {e}")
+                continue
+            except Exception as e:
+                print(f"处理EPG数据时出错 ({url}): {e}")
+                continue
+
+            if channels is None:
+                channels = _load_epg_cache()
+                if channels:
+                    print(f"EPG源未更新 ({url}), 使用本地缓存 ({len(channels)} 个频道)")
+                    _save_epg_cache(channels, new_meta)
+                    return channels
+                continue
+            if channels:
+                print(f"成功获取 {len(channels)} 个频道的EPG信息 ({url})")
+                try:
+                    _save_epg_cache(channels, new_meta)
+                    print("EPG数据已保存到本地缓存")
+                except Exception:
+                    print("保存本地缓存失败")
+                return channels
+        return None
+    finally:
+        # 中断其他仍在下载的源
+        downloads.stop()
+        executor.shutdown(wait=False, cancel_futures=True)
+
 def get_epg_data():
     """从EPG网站获取频道信息"""
     try:
@@ -89,110 +424,31 @@ def get_epg_data():
                 return {}
                 
             if choice == '4':
-                cache_file = 'epg_cache.json'
-                if os.path.exists(cache_file):
-                    try:
-                        import json
-                        with open(cache_file, 'r', encoding='utf-8') as f:
-                            channels = json.load(f)
-                        print(f"成功加载本地缓存的EPG数据 ({len(channels)} 个频道)")
-                        return channels
-                    except:
-                        print("本地缓存数据加载失败")
-                else:
+                if not os.path.exists(EPG_CACHE_FILE):
                     print("未找到本地缓存数据")
-                return {}
+                    return {}
+                channels = _load_epg_cache()
+                if channels is None:
+                    print("本地缓存数据加载失败")
+                    return {}
+                print(f"成功加载本地缓存的EPG数据 ({len(channels)} 个频道)")
+                return channels
                 
             if choice == '1':
-                # 添加多个备用EPG源
-                urls = [
-                    'https://epg.112114.xyz/pp.xml',
-                    'https://epg.112114.xyz/e.xml',
-                    'http://epg.51zmt.top:8000/api/diyp/',
-                    'http://epg.51zmt.top:8000/e.xml'
-                ]
-                
-                for url in urls:
-                    try:
-                        print(f"\n正在尝试获取EPG数据 ({url})...")
-                        headers = {
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                        }
-                        response = requests.get(url, 
-                                             timeout=15,  # 增加超时时间
-                                             verify=False,  # 禁用SSL验证
-                                             headers=headers)  # 添加请求头
-                        response.raise_for_status()
-                        response.encoding = 'utf-8'
-                        content = response.text
-                        
-                        channels = {}
-                        # 根据不同格式解析数据
-                        if url.endswith('.txt') or url.endswith('/diyp/'):
-                            # 解析txt格式
-                            for line in content.splitlines():
-                                if ',' in line:
-                                    parts = line.split(',')
-                                    if len(parts) >= 2:
-                                        channel_id = parts[0].strip()
-                                        name = parts[1].strip()
-                                        channels[name] = {
-                                            'id': channel_id,
-                                            'name': name
-                                        }
-                        elif url.endswith('.xml'):
-                            # 解析xml格式
-                            try:
-                                import xml.etree.ElementTree as ET
-                                from io import StringIO
-                                tree = ET.parse(StringIO(content))
-                                root = tree.getroot()
-                                for channel in root.findall('.//channel'):
-                                    channel_id = channel.get('id', '')
-                                    name_elem = channel.find('display-name')
-                                    if name_elem is not None and channel_id:
-                                        name = name_elem.text.strip()
-                                        channels[name] = {
-                                            'id': channel_id,
-                                            'name': name
-                                        }
-                            except ET.ParseError as e:
-                                print(f"XML解析错误: {e}")
-                                continue
-                        
-                        if channels:
-                            print(f"成功获取 {len(channels)} 个频道的EPG信息")
-                            # 保存到本地缓存
-                            try:
-                                import json
-                                with open('epg_cache.json', 'w', encoding='utf-8') as f:
-                                    json.dump(channels, f, ensure_ascii=False, indent=2)
-                                print("EPG数据已保存到本地缓存")
-                            except:
-                                print("保存本地缓存失败")
-                            return channels
-                            
-                    except requests.RequestException as e:
-                        print(f"获取EPG数据失败: {e}")
-                        continue
-                    except Exception as e:
-                        print(f"处理EPG数据时出错: {e}")
-                        continue
+                channels = load_epg_sources(EPG_SOURCES)
+                if channels:
+                    return channels
                 
                 print("所有EPG源都无法访问")
                 print("尝试使用本地缓存...")
                 
                 # 尝试使用本地缓存
-                cache_file = 'epg_cache.json'
-                if os.path.exists(cache_file):
-                    try:
-                        import json
-                        with open(cache_file, 'r', encoding='utf-8') as f:
-                            channels = json.load(f)
-                        print(f"成功加载本地缓存的EPG数据 ({len(channels)} 个频道)")
-                        return channels
-                    except:
-                        print("本地缓存数据加载失败")
+                channels = _load_epg_cache()
+                if channels is not None:
+                    print(f"成功加载本地缓存的EPG数据 ({len(channels)} 个频道)")
+                    return channels
+                elif os.path.exists(EPG_CACHE_FILE):
+                    print("本地缓存数据加载失败")
                 
                 return {}
                     
@@ -207,348 +463,3868 @@ def get_epg_data():
         print("将不使用EPG数据")
         return {}
 
-def check_stream(url):
-    """检查流媒体链接是否可用"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': '*/*',
-            'Range': 'bytes=0-4095'  # 请求前4KB数据
-        }
+# EPG频道匹配配置
+EPG_INDEX_FILE = 'epg_index.json'   # 与EPG缓存一起保存的频道名索引
+EPG_INDEX_VERSION = 1               # 规范化规则变化时递增, 使旧索引失效
+EPG_MATCH_THRESHOLD = 0.6           # 三元组相似度(Dice系数)低于该值不算匹配
+EPG_MAX_POSTING = 2000              # 出现在过多频道名中的三元组不参与候选查找
+
+# 画质/格式等与频道本身无关的后缀
+_EPG_QUALITY_TOKENS = ('高清', '超清', '标清', '蓝光', '频道', 'fhd', 'hd', 'sd', 'hevc', 'h265', 'h264',
+                       '2160p', '1080p', '1080i', '720p', '576p', '480p', '50fps', '60fps', '25fps')
+_EPG_QUALITY_SUFFIX_RE = re.compile('(?:%s)+$' % '|'.join(_EPG_QUALITY_TOKENS))
+_EPG_BRACKET_RE = re.compile(r'[(\[【《][^)\]】》]*[)\]】》]')
+_EPG_SEPARATOR_RE = re.compile(r'[\s\-_|·.:,]+')
+_CN_NUMERAL_RE = re.compile('[零〇一二三四五六七八九十]+')
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+def _cn_numeral_to_int(text):
+    """把 一/十一/二十五 这类中文数字转换为阿拉伯数字"""
+    if '十' not in text:
+        return ''.join(str(_CN_DIGITS[ch]) for ch in text)
+    tens, _, ones = text.partition('十')
+    if '十' in ones or len(tens) > 1 or len(ones) > 1:
+        return text
+    return str((_CN_DIGITS[tens] if tens else 1) * 10 + (_CN_DIGITS[ones] if ones else 0))
+
+def _strip_epg_name(name):
+    """去掉分隔符和画质后缀, 中文数字转为阿拉伯数字"""
+    name = _CN_NUMERAL_RE.sub(lambda m: _cn_numeral_to_int(m.group()), name)
+    tokens = [token for token in _EPG_SEPARATOR_RE.split(name) if token and token not in _EPG_QUALITY_TOKENS]
+    name = ''.join(tokens)
+    return _EPG_QUALITY_SUFFIX_RE.sub('', name) or name
+
+def normalize_epg_name(name):
+    """规范化用于匹配EPG的频道名
+
+    全角转半角、忽略大小写, 去掉括号内的备注、分隔符和画质后缀,
+    中文数字转为阿拉伯数字, 如 "CCTV-1 综合 HD" -> "cctv1综合"
+    """
+    import unicodedata
+    name = unicodedata.normalize('NFKC', name or '').casefold()
+    # 频道名本身写在括号里时只去掉括号
+    return (_strip_epg_name(_EPG_BRACKET_RE.sub(' ', name))
+            or _strip_epg_name(re.sub(r'[()\[\]【】《》]', ' ', name)))
+
+def _name_grams(key):
+    """频道名的三元组集合, 不足3个字符时使用整个名称"""
+    if len(key) <= 3:
+        return {key}
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+def _name_signature(key):
+    """名称中的数字和+号, 如 CCTV5+ -> "5+", 相似的名称也必须一致"""
+    return ','.join(re.findall(r'\d+', key)) + '+' * key.count('+')
+
+def _indexed_grams(key):
+    """倒排索引的键: 三元组加上数字签名, 只在签名相同的名称中查找候选"""
+    signature = _name_signature(key)
+    return [f"{signature}|{gram}" for gram in _name_grams(key)]
+
+def _epg_digest(channels):
+    """EPG频道数据的摘要, 用于判断保存的索引是否仍然对应当前数据"""
+    import hashlib
+    digest = hashlib.sha1()
+    for name in sorted(channels):
+        digest.update(f"{name}\t{channels[name].get('id', '')}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+class EpgIndex:
+    """EPG频道名索引: 先按规范化名称精确匹配, 再用三元组倒排索引查找相似名称
+
+    每个播放列表名称只需查询几个三元组的倒排列表, 不需要与所有EPG频道逐一比较
+    """
+
+    def __init__(self, keys, ids, grams, digest=''):
+        self.keys = keys        # 规范化名称列表
+        self.ids = ids          # 与keys对应的EPG频道ID
+        self.grams = grams      # 数字签名|三元组 -> keys中的下标列表
+        self.digest = digest
+        self.exact = {key: i for i, key in enumerate(keys)}
+        self.matched = 0
+        self._memo = {}
+
+    @classmethod
+    def build(cls, channels):
+        keys = []
+        ids = []
+        exact = {}
+        grams = {}
+        for name, info in channels.items():
+            key = normalize_epg_name(name)
+            if not key or key in exact or not info.get('id'):
+                continue
+            exact[key] = len(keys)
+            for gram in _indexed_grams(key):
+                grams.setdefault(gram, []).append(len(keys))
+            keys.append(key)
+            ids.append(info['id'])
+        return cls(keys, ids, grams, _epg_digest(channels))
+
+    def to_dict(self):
+        return {'version': EPG_INDEX_VERSION, 'digest': self.digest,
+                'keys': self.keys, 'ids': self.ids, 'grams': self.grams}
+
+    def _lookup(self, key):
+        if not key:
+            return None
+        i = self.exact.get(key)
+        if i is not None:
+            return self.ids[i]
+
+        query = _indexed_grams(key)
+        overlap = Counter()
+        for gram in query:
+            posting = self.grams.get(gram)
+            if posting and len(posting) <= EPG_MAX_POSTING:
+                overlap.update(posting)
+
+        best, best_score = None, EPG_MATCH_THRESHOLD
+        for i, common in overlap.most_common():
+            # 按重叠数降序遍历, 之后的候选分数不可能超过当前最佳
+            if 2 * common / (len(query) + common) < best_score:
+                break
+            candidate = self.keys[i]
+            score = 2 * common / (len(query) + len(_name_grams(candidate)))
+            if score > best_score or (score == best_score and (best is None or len(candidate) < len(self.keys[best]))):
+                best, best_score = i, score
+        return self.ids[best] if best is not None else None
+
+    def match(self, name):
+        """返回频道名对应的EPG频道ID, 没有足够相似的频道时返回None"""
+        if name not in self._memo:
+            self._memo[name] = self._lookup(normalize_epg_name(name))
+        return self._memo[name]
+
+    def annotate(self, entry):
+        """为没有tvg-id的条目补上匹配到的tvg-id, 返回EXTINF行"""
+        extinf = entry.extinf
+        if not extinf or entry.tvg_id:
+            return extinf
+        tvg_id = self.match(entry.name)
+        if tvg_id is None:
+            return extinf
+        self.matched += 1
+        attr = f'tvg-id="{tvg_id}"'
+        if 'tvg-id=""' in extinf:
+            return extinf.replace('tvg-id=""', attr, 1)
+        return re.sub(r'^#EXTINF:\s*-?[\d.]*', lambda m: f"{m.group()} {attr}", extinf, count=1)
+
+def get_epg_index(channels):
+    """加载与EPG数据对应的索引, 数据有变化时重新建立并保存"""
+    import json
+    digest = _epg_digest(channels)
+    try:
+        with open(EPG_INDEX_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == EPG_INDEX_VERSION and data.get('digest') == digest:
+            return EpgIndex(data['keys'], data['ids'], data['grams'], digest)
+    except Exception:
+        pass
+
+    start_time = time.time()
+    index = EpgIndex.build(channels)
+    print(f"已建立EPG频道索引 ({len(index.keys)} 个名称, 耗时 {time.time() - start_time:.2f} 秒)")
+    try:
+        with open(EPG_INDEX_FILE, 'w', encoding='utf-8') as f:
+            json.dump(index.to_dict(), f, ensure_ascii=False)
+    except Exception:
+        print("保存EPG索引失败")
+    return index
+
+# 连接池配置
+POOL_MAX_HOSTS = 512          # 保留连接池的主机数量
+POOL_PER_HOST = 20            # 每个主机保留的空闲连接数量
+POOL_IDLE_TIMEOUT = 30        # 空闲连接的最长保留时间(秒)
+POOL_DRAIN_LIMIT = 64 * 1024  # 剩余响应体不超过该大小时读完并复用连接
+
+class PoolStats:
+    """连接池复用统计(线程安全)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, reused):
+        with self.lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def reset(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"连接复用 {self.hits} 次, 新建连接 {self.misses} 次 (复用率 {rate:.1f}%)"
+
+pool_stats = PoolStats()
+
+# 线程引擎中当前探测的分阶段耗时, 由连接建立过程中的钩子填写
+_probe_local = threading.local()
+
+_pooled_adapter_class = None
+
+def _get_pooled_adapter_class():
+    """创建按主机保留keep-alive连接池的HTTPAdapter类(首次用到线程引擎时才导入requests)"""
+    global _pooled_adapter_class
+    if _pooled_adapter_class is not None:
+        return _pooled_adapter_class
+    requests = _requests()
+    import urllib3
+
+    class _TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+        """记录TLS握手耗时的HTTPS连接(总耗时减去其中的DNS和TCP连接耗时)"""
+
+        def connect(self):
+            timings = getattr(_probe_local, 'timings', None)
+            if timings is None:
+                return super().connect()
+            before = (timings['dns'] or 0) + (timings['connect'] or 0)
+            start = time.monotonic()
+            try:
+                super().connect()
+            finally:
+                spent = time.monotonic() - start - ((timings['dns'] or 0) + (timings['connect'] or 0) - before)
+                _add_timing(timings, 'tls', max(0.0, spent))
+
+    class _CountingPoolMixin:
+        """取连接时记录是否复用了已建立的连接"""
+
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            pool_stats.record(getattr(conn, 'sock', None) is not None)
+            return conn
+
+    class _CountingHTTPConnectionPool(_CountingPoolMixin, urllib3.HTTPConnectionPool):
+        pass
+
+    class _CountingHTTPSConnectionPool(_CountingPoolMixin, urllib3.HTTPSConnectionPool):
+        ConnectionCls = _TimedHTTPSConnection
+
+    class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+        """按主机保留keep-alive连接池并统计复用情况的HTTPAdapter"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _CountingHTTPConnectionPool,
+                'https': _CountingHTTPSConnectionPool,
+            }
+
+    _pooled_adapter_class = PooledHTTPAdapter
+    return PooledHTTPAdapter
+
+_probe_session = None
+_probe_session_lock = threading.Lock()
+
+def get_probe_session():
+    """获取所有探测线程共用的requests会话"""
+    global _probe_session
+    with _probe_session_lock:
+        if _probe_session is None:
+            session = _requests().Session()
+            adapter = _get_pooled_adapter_class()(pool_connections=POOL_MAX_HOSTS, pool_maxsize=POOL_PER_HOST)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _install_resolver_hook()
+            _probe_session = session
+        return _probe_session
+
+def _release_response(response):
+    """剩余响应体较小时读完, 使连接回到连接池复用; 否则直接关闭连接"""
+    remaining = getattr(response.raw, 'length_remaining', None)
+    if remaining is not None and remaining <= POOL_DRAIN_LIMIT:
+        try:
+            response.raw.drain_conn()
+        except Exception:
+            pass
+    response.close()
+
+# 域名预解析配置
+DNS_WORKERS = 64             # 并发解析域名的线程数
+DNS_CACHE_SIZE = 20000       # 解析缓存最多保存的域名数量
+DNS_POSITIVE_TTL = 600       # 解析成功结果的缓存时间(秒)
+DNS_NEGATIVE_TTL = 120       # 解析失败结果的缓存时间(秒)
+
+def _ip_literal_family(host):
+    """主机是IP地址时返回其地址族, 否则返回None"""
+    import ipaddress
+    try:
+        return socket.AF_INET6 if ipaddress.ip_address(host).version == 6 else socket.AF_INET
+    except ValueError:
+        return None
+
+class DnsResolver:
+    """并发解析域名的A/AAAA记录, 结果保存在有容量上限的内存缓存中
+
+    解析失败(如NXDOMAIN)同样缓存一段时间, 避免重复等待不存在的域名。
+    解析结果是 [(地址族, IP), ...] 列表, 顺序与系统getaddrinfo的优先顺序一致,
+    解析失败时为空列表
+    """
+
+    def __init__(self, workers=DNS_WORKERS, max_size=DNS_CACHE_SIZE,
+                 ttl=DNS_POSITIVE_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self.workers = workers
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.executor = None
+        self.cache = OrderedDict()  # host -> (过期时间, 地址列表)
+        self.pending = {}           # host -> 正在解析的Future
+        self.lock = threading.Lock()
+        self.resolved = 0
+        self.failed = 0
+
+    def _cached(self, host):
+        """在锁内查询未过期的缓存"""
+        item = self.cache.get(host)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self.cache[host]
+            return None
+        self.cache.move_to_end(host)
+        return item[1]
+
+    def cached_addresses(self, host):
+        """返回已缓存的解析结果, 尚未解析时返回None"""
+        family = _ip_literal_family(host)
+        if family is not None:
+            return [(family, host)]
+        with self.lock:
+            return self._cached(host)
+
+    def submit(self, host):
+        """开始解析域名(已缓存或正在解析时直接复用), 返回concurrent.futures.Future"""
+        family = _ip_literal_family(host)
+        with self.lock:
+            addrs = [(family, host)] if family is not None else self._cached(host)
+            if addrs is None:
+                future = self.pending.get(host)
+                if future is None:
+                    if self.executor is None:
+                        self.executor = concurrent.futures.ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix='dns')
+                    future = self.executor.submit(self._resolve, host)
+                    self.pending[host] = future
+                return future
+        future = concurrent.futures.Future()
+        future.set_result(addrs)
+        return future
+
+    def resolve(self, host):
+        """阻塞直到域名解析完成"""
+        return self.submit(host).result()
+
+    def _resolve(self, host):
+        try:
+            infos = socket.getaddrinfo(host, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
+            addrs = []
+            for family, _, _, _, sockaddr in infos:
+                if (family, sockaddr[0]) not in addrs:
+                    addrs.append((family, sockaddr[0]))
+        except (socket.gaierror, UnicodeError, ValueError):
+            addrs = []
+
+        with self.lock:
+            ttl = self.ttl if addrs else self.negative_ttl
+            self.cache[host] = (time.monotonic() + ttl, addrs)
+            self.cache.move_to_end(host)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+            self.pending.pop(host, None)
+            if addrs:
+                self.resolved += 1
+            else:
+                self.failed += 1
+        return addrs
+
+    def reset_stats(self):
+        with self.lock:
+            self.resolved = 0
+            self.failed = 0
+
+dns_resolver = DnsResolver()
+
+def is_ipv6_addresses(addrs):
+    """按实际会连接的第一个地址判断是否走IPv6"""
+    return bool(addrs) and addrs[0][0] == socket.AF_INET6
+
+_original_create_connection = None
+
+def _install_resolver_hook():
+    """让urllib3建立连接时直接使用DnsResolver中已解析的地址"""
+    global _original_create_connection
+    import urllib3.util.connection as urllib3_connection
+    if _original_create_connection is not None:
+        return
+    _original_create_connection = urllib3_connection.create_connection
+
+    def create_connection(address, *args, **kwargs):
+        host, port = address
+        timings = getattr(_probe_local, 'timings', None)
+        addrs = dns_resolver.cached_addresses(host)
+        if addrs is None:
+            start = time.monotonic()
+            addrs = dns_resolver.resolve(host)
+            _add_timing(timings, 'dns', time.monotonic() - start)
+        if not addrs:
+            return _original_create_connection(address, *args, **kwargs)
+        error = None
+        start = time.monotonic()
+        try:
+            for _, ip in addrs:
+                try:
+                    return _original_create_connection((ip, port), *args, **kwargs)
+                except OSError as e:
+                    error = e
+            raise error
+        finally:
+            _add_timing(timings, 'connect', time.monotonic() - start)
+
+    urllib3_connection.create_connection = create_connection
+
+# 探测请求使用的默认参数
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+PROBE_TIMEOUT = 5          # 单次连接/读取超时(秒)
+PROBE_READ_SIZE = 4096     # 读取用于判断格式的数据量
+
+VALID_CONTENT_TYPES = ['video/', 'audio/', 'application/octet-stream', 'application/vnd.apple.mpegurl']
+
+# 探测的分阶段耗时(秒): DNS解析、TCP连接、TLS握手、发出请求到响应头(TTFB)、
+# 响应头到第一段数据、整个探测; 没有经历的阶段(如复用连接时的TCP连接)为None
+TIMING_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'first_byte', 'total')
+
+def _new_timings():
+    timings = dict.fromkeys(TIMING_PHASES)
+    timings['bytes'] = 0
+    return timings
+
+def _add_timing(timings, phase, seconds):
+    """累加一个阶段的耗时, 重定向等多次经历同一阶段时取总和"""
+    if timings is not None:
+        timings[phase] = (timings[phase] or 0) + seconds
+
+# 封装格式识别
+TS_PACKET_SIZES = (188, 192, 204)   # 普通TS / M2TS(带4字节时间戳) / 带RS校验的TS
+TS_SYNC_COUNT = 3                   # 连续几个包的同步字节正确才认定为TS
+ISO_BMFF_BOXES = frozenset((b'ftyp', b'styp', b'moov', b'moof', b'sidx', b'mdat',
+                            b'free', b'skip', b'emsg', b'prft', b'pdin', b'uuid'))
+ISO_BMFF_LEADING_BOXES = frozenset((b'ftyp', b'styp', b'moof', b'sidx', b'moov'))
+
+def _ts_layout(view):
+    """按188/192/204字节步长检查TS同步字节, 返回 (第一个同步字节的位置, 包长, 是否需要更多数据)"""
+    n = len(view)
+    need_more = False
+    for packet_size in TS_PACKET_SIZES:
+        # M2TS的同步字节位于每个包的第5个字节
+        first = 4 if packet_size == 192 else 0
+        for offset in range(first, min(n, packet_size + first)):
+            if view[offset] != 0x47:
+                continue
+            last = offset + packet_size * (TS_SYNC_COUNT - 1)
+            if last >= n:
+                need_more = True
+                break
+            if all(view[offset + packet_size * i] == 0x47 for i in range(1, TS_SYNC_COUNT)):
+                return offset, packet_size, False
+        if n < packet_size + first:
+            need_more = True
+    return None, None, need_more
+
+def _sniff_ts(view):
+    """检查TS同步字节, 返回 (容器名, 是否需要更多数据)"""
+    _, packet_size, need_more = _ts_layout(view)
+    if packet_size is None:
+        return None, need_more
+    return ('m2ts' if packet_size == 192 else 'mpegts'), False
+
+def _sniff_iso_bmff(view):
+    """检查ISO BMFF(fMP4/MP4)的box结构"""
+    if len(view) < 8:
+        return None, True
+    if bytes(view[4:8]) not in ISO_BMFF_LEADING_BOXES:
+        return None, False
+    # 依次检查后续box的类型, 数据不足时以第一个box为准
+    offset = 0
+    while offset + 8 <= len(view):
+        size = int.from_bytes(view[offset:offset + 4], 'big')
+        box_type = bytes(view[offset + 4:offset + 8])
+        if box_type not in ISO_BMFF_BOXES and offset > 0:
+            return None, False
+        if size == 1 and offset + 16 <= len(view):
+            size = int.from_bytes(view[offset + 8:offset + 16], 'big')
+        if size < 8:
+            return ('mp4', False) if size == 0 else (None, False)
+        offset += size
+    return 'mp4', False
+
+def _sniff_adts(view):
+    """检查ADTS(AAC)帧头, 数据足够时确认下一帧的同步字"""
+    if len(view) < 7:
+        return None, True
+    if view[0] != 0xFF or (view[1] & 0xF6) != 0xF0:
+        return None, False
+    frame_length = ((view[3] & 0x03) << 11) | (view[4] << 3) | (view[5] >> 5)
+    if frame_length < 7:
+        return None, False
+    if len(view) < frame_length + 2:
+        return None, True
+    if view[frame_length] == 0xFF and (view[frame_length + 1] & 0xF6) == 0xF0:
+        return 'adts', False
+    return None, False
+
+def sniff_container(data):
+    """用尽可能少的字节识别流的封装格式
+
+    data 可以是 bytes/bytearray/memoryview, 内部只通过memoryview访问不复制数据。
+    返回 (容器名, 是否需要更多数据): 识别成功时容器名为 'mpegts'/'m2ts'/'flv'/
+    'mp4'/'adts'/'id3'/'hls'/'mpeg-ps'/'h264'/'riff', 确定无法识别时为 (None, False)
+    """
+    with memoryview(data) as view:
+        return _sniff_view(view)
+
+def _sniff_view(view):
+    n = len(view)
+    if n == 0:
+        return None, True
+
+    # 固定魔数的格式
+    head = bytes(view[:16])
+    stripped = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if stripped.startswith(b'#EXTM3U'):
+        return 'hls', False
+    if head.startswith(b'FLV\x01'):
+        return 'flv', False
+    if head.startswith(b'ID3') and n >= 4 and view[3] < 0xFF:
+        return 'id3', False
+    if head.startswith(b'RIFF'):
+        return 'riff', False
+    if head.startswith(b'\x00\x00\x01\xba'):
+        return 'mpeg-ps', False
+    if head.startswith(b'\x00\x00\x00\x01') and n >= 5 and not view[4] & 0x80:
+        # 使用64位大小的MP4 box同样以 00 00 00 01 开头, 按box类型区分
+        if n < 8:
+            return None, True
+        if bytes(view[4:8]) not in ISO_BMFF_LEADING_BOXES:
+            return 'h264', False
+
+    need_more = False
+    magic_prefixes = (b'#EXTM3U', b'FLV\x01', b'ID3', b'RIFF', b'\x00\x00\x01\xba', b'\x00\x00\x00\x01')
+    if any(len(stripped) < len(prefix) and prefix.startswith(stripped) for prefix in magic_prefixes):
+        need_more = True
+
+    for sniffer in (_sniff_iso_bmff, _sniff_adts, _sniff_ts):
+        container, more = sniffer(view)
+        if container:
+            return container, False
+        need_more = need_more or more
+    return None, need_more
+
+# 码流参数解析配置
+TS_STREAM_TYPES = {0x01: 'mpeg1', 0x02: 'mpeg2', 0x10: 'mpeg4', 0x1B: 'h264', 0x24: 'hevc',
+                   0x42: 'avs', 0xD2: 'avs2'}                   # PMT中的视频流类型
+TS_AUDIO_TYPES = {0x03: 'mp2', 0x04: 'mp2', 0x0F: 'aac', 0x11: 'aac', 0x81: 'ac3', 0x87: 'eac3'}
+FLV_VIDEO_CODECS = {7: 'h264', 12: 'hevc'}                     # FLV视频标签中的codec id(12为国内常用的HEVC扩展)
+FLV_FOURCC_CODECS = {b'avc1': 'h264', b'hvc1': 'hevc', b'av01': 'av1'}   # Enhanced RTMP/FLV
+FLV_AUDIO_CODECS = {2: 'mp3', 10: 'aac'}
+INSPECT_CONTAINERS = frozenset(('mpegts', 'm2ts', 'flv', 'h264'))   # 可以解析出视频参数的封装格式
+INSPECT_WAIT = 0.5           # 识别出封装格式后为取得视频参数继续等待数据的最长时间(秒)
+INSPECT_READ_SIZE = 192 * 1024  # 可解析的格式为取得视频参数最多读取的数据量; 遵守Range的服务器只返回前4KB
+INSPECT_SPS_LIMIT = 256      # SPS最多解析的字节数
+H264_PROFILES = {66: 'Baseline', 77: 'Main', 88: 'Extended', 100: 'High', 110: 'High 10',
+                 122: 'High 4:2:2', 244: 'High 4:4:4'}
+H264_CHROMA_PROFILES = frozenset((100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135))
+HEVC_PROFILES = {1: 'Main', 2: 'Main 10', 3: 'Main Still Picture', 4: 'Range Extensions'}
+
+class _BitReader:
+    """按位读取去掉防竞争字节后的RBSP, 支持指数哥伦布编码"""
+
+    __slots__ = ('value', 'left')
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.left = len(data) * 8
+
+    def u(self, bits):
+        if bits > self.left:
+            raise ValueError('SPS数据不完整')
+        self.left -= bits
+        return (self.value >> self.left) & ((1 << bits) - 1)
+
+    def ue(self):
+        rest = self.value & ((1 << self.left) - 1)
+        zeros = self.left - rest.bit_length()
+        if rest == 0 or zeros > 31:
+            raise ValueError('SPS数据不完整')
+        return self.u(2 * zeros + 1) - 1
+
+    def se(self):
+        k = self.ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+def _rbsp(nal, header_size):
+    """去掉NAL头和防竞争字节(00 00 03), 只保留解析SPS所需的部分"""
+    return bytes(nal[header_size:header_size + INSPECT_SPS_LIMIT]).replace(b'\x00\x00\x03', b'\x00\x00')
+
+def _parse_h264_sps(nal):
+    """解析H.264 SPS, 返回宽高、profile和level"""
+    r = _BitReader(_rbsp(nal, 1))
+    profile_idc = r.u(8)
+    constraints = r.u(8)
+    level_idc = r.u(8)
+    r.ue()                                   # seq_parameter_set_id
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in H264_CHROMA_PROFILES:
+        chroma_format_idc = r.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = r.u(1)
+        r.ue()                               # bit_depth_luma_minus8
+        r.ue()                               # bit_depth_chroma_minus8
+        r.u(1)                               # qpprime_y_zero_transform_bypass_flag
+        if r.u(1):                           # seq_scaling_matrix_present_flag
+            for i in range(12 if chroma_format_idc == 3 else 8):
+                if r.u(1):
+                    last = next_scale = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale:
+                            next_scale = (last + r.se() + 256) % 256
+                        last = next_scale or last
+    r.ue()                                   # log2_max_frame_num_minus4
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()                               # log2_max_pic_order_cnt_lsb_minus4
+    elif poc_type == 1:
+        r.u(1)
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()                                   # max_num_ref_frames
+    r.u(1)                                   # gaps_in_frame_num_value_allowed_flag
+    width_mbs = r.ue() + 1
+    height_units = r.ue() + 1
+    frame_mbs_only = r.u(1)
+    if not frame_mbs_only:
+        r.u(1)                               # mb_adaptive_frame_field_flag
+    r.u(1)                                   # direct_8x8_inference_flag
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_units * 16
+    if r.u(1):                               # frame_cropping_flag
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        if chroma_format_idc == 0 or separate_colour_plane:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 1 if chroma_format_idc == 3 else 2
+            crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    profile = H264_PROFILES.get(profile_idc, str(profile_idc))
+    if profile_idc == 66 and constraints & 0x40:
+        profile = 'Constrained Baseline'
+    return {'codec': 'h264', 'width': width, 'height': height, 'profile': profile,
+            'level': f"{level_idc // 10}.{level_idc % 10}", 'interlaced': not frame_mbs_only}
+
+def _parse_hevc_sps(nal):
+    """解析H.265 SPS, 返回宽高、profile和level"""
+    r = _BitReader(_rbsp(nal, 2))
+    r.u(4)                                   # sps_video_parameter_set_id
+    max_sub_layers_minus1 = r.u(3)
+    r.u(1)                                   # sps_temporal_id_nesting_flag
+    # profile_tier_level
+    r.u(3)                                   # general_profile_space, general_tier_flag
+    profile_idc = r.u(5)
+    r.u(32)                                  # general_profile_compatibility_flags
+    r.u(48)                                  # 各种约束标志
+    level_idc = r.u(8)
+    present = [(r.u(1), r.u(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1:
+        r.u(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in present:
+        r.u(88 * profile_present + 8 * level_present)
+    r.ue()                                   # sps_seq_parameter_set_id
+    chroma_format_idc = r.ue()
+    separate_colour_plane = r.u(1) if chroma_format_idc == 3 else 0
+    width = r.ue()
+    height = r.ue()
+    if r.u(1):                               # conformance_window_flag
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        if separate_colour_plane:
+            sub_width = sub_height = 1
+        else:
+            sub_width = 2 if chroma_format_idc in (1, 2) else 1
+            sub_height = 2 if chroma_format_idc == 1 else 1
+        width -= sub_width * (left + right)
+        height -= sub_height * (top + bottom)
+    return {'codec': 'hevc', 'width': width, 'height': height,
+            'profile': HEVC_PROFILES.get(profile_idc, str(profile_idc)),
+            'level': f"{level_idc // 30}.{level_idc % 30 // 3}"}
+
+def _parse_mpeg2_sequence(es):
+    """从MPEG-1/2视频序列头中取宽高"""
+    i = es.find(b'\x00\x00\x01\xb3')
+    if i < 0 or i + 7 > len(es):
+        return None
+    width = (es[i + 4] << 4) | (es[i + 5] >> 4)
+    height = ((es[i + 5] & 0x0F) << 8) | es[i + 6]
+    return {'width': width, 'height': height}
+
+def _find_sps(es, codec):
+    """在Annex B格式的视频数据中查找SPS并解析, codec为None时同时尝试H.264和H.265"""
+    n = len(es)
+    i = es.find(b'\x00\x00\x01')
+    while 0 <= i < n - 4:
+        header = es[i + 3]
+        if not header & 0x80:
+            if codec != 'hevc' and header & 0x1F == 7:
+                parser = _parse_h264_sps
+            elif codec != 'h264' and (header >> 1) & 0x3F == 33:
+                parser = _parse_hevc_sps
+            else:
+                parser = None
+            if parser is not None:
+                end = es.find(b'\x00\x00\x01', i + 3)
+                try:
+                    return parser(memoryview(es)[i + 3:end if end > 0 else n])
+                except ValueError:
+                    pass
+        i = es.find(b'\x00\x00\x01', i + 3)
+    return None
+
+def _video_from_es(es, codec):
+    """从视频基本流中解析出参数, 没有找到参数集时只返回编码"""
+    if codec in ('mpeg1', 'mpeg2'):
+        info = _parse_mpeg2_sequence(es)
+    elif codec in ('h264', 'hevc', None):
+        info = _find_sps(es, codec)
+    else:
+        info = None
+    if info is None:
+        return {'codec': codec} if codec else {}
+    if codec and 'codec' not in info:
+        info['codec'] = codec
+    return info
+
+def _inspect_ts(view):
+    """遍历TS包: 由PAT找到PMT, 由PMT确定音视频编码, 再从视频PES中取SPS"""
+    offset, packet_size, _ = _ts_layout(view)
+    if packet_size is None:
+        return None
+    n = len(view)
+    pmt_pids = set()
+    video_pid = None
+    codec = audio = None
+    es = bytearray()
+    collecting = False
+    pos = offset
+    while pos + 188 <= n and view[pos] == 0x47:
+        b1 = view[pos + 1]
+        pid = ((b1 & 0x1F) << 8) | view[pos + 2]
+        control = view[pos + 3] >> 4
+        start = pos + 4 + (1 + view[pos + 4] if control & 0x2 else 0)
+        end = pos + 188
+        pos += packet_size
+        if not control & 0x1 or start >= end:
+            continue
+        unit_start = b1 & 0x40
+        if unit_start and (pid == 0 or pid in pmt_pids):
+            # PSI表: pointer_field之后是表头, 只解析第一个包内的部分
+            p = start + 1 + view[start]
+            if p + 12 > end:
+                continue
+            section_end = min(p + 3 + (((view[p + 1] & 0x0F) << 8) | view[p + 2]) - 4, end)
+            if pid == 0 and view[p] == 0x00:
+                for i in range(p + 8, section_end - 3, 4):
+                    if (view[i] << 8) | view[i + 1]:
+                        pmt_pids.add(((view[i + 2] & 0x1F) << 8) | view[i + 3])
+            elif view[p] == 0x02:
+                i = p + 12 + (((view[p + 10] & 0x0F) << 8) | view[p + 11])
+                while i + 5 <= section_end:
+                    stream_type = view[i]
+                    es_pid = ((view[i + 1] & 0x1F) << 8) | view[i + 2]
+                    if stream_type in TS_STREAM_TYPES and codec is None:
+                        codec = TS_STREAM_TYPES[stream_type]
+                        if es_pid != video_pid:
+                            video_pid, collecting = es_pid, False
+                            es.clear()
+                    elif stream_type in TS_AUDIO_TYPES and audio is None:
+                        audio = TS_AUDIO_TYPES[stream_type]
+                    i += 5 + (((view[i + 3] & 0x0F) << 8) | view[i + 4])
+            continue
+        if unit_start and start + 9 <= end and view[start] == 0 and view[start + 1] == 0 and view[start + 2] == 1:
+            # 还没有PMT时按PES的stream_id(0xE0-0xEF)认出视频
+            if video_pid is None and 0xE0 <= view[start + 3] <= 0xEF:
+                video_pid = pid
+            if pid == video_pid:
+                collecting = True
+                start += 9 + view[start + 8]
+        if collecting and pid == video_pid and start < end:
+            es += view[start:end]
+    if codec is None and video_pid is None and audio is None:
+        return None
+    info = _video_from_es(es, codec) if video_pid is not None else {}
+    if audio:
+        info['audio'] = audio
+    return info
+
+def _inspect_flv(view):
+    """遍历FLV标签, 从AVC/HEVC序列头(解码器配置记录)中取SPS"""
+    n = len(view)
+    if n < 9:
+        return None
+    pos = int.from_bytes(view[5:9], 'big') + 4
+    info = {}
+    while pos + 12 <= n:
+        tag_type = view[pos] & 0x1F
+        end = pos + 11 + int.from_bytes(view[pos + 1:pos + 4], 'big')
+        data = pos + 11
+        if tag_type == 9 and 'width' not in info and data + 5 <= n:
+            flags = view[data]
+            record = None
+            if flags & 0x80:
+                codec = FLV_FOURCC_CODECS.get(bytes(view[data + 1:data + 5]))
+                if flags & 0x0F == 0:         # SequenceStart
+                    record = data + 5
+            else:
+                codec = FLV_VIDEO_CODECS.get(flags & 0x0F)
+                if view[data + 1] == 0:       # AVC/HEVC sequence header
+                    record = data + 5
+            if codec:
+                info['codec'] = codec
+                if record is not None and end <= n:
+                    info.update(_parse_decoder_record(view[record:end], codec) or {})
+        elif tag_type == 8 and 'audio' not in info:
+            audio = FLV_AUDIO_CODECS.get(view[data] >> 4)
+            if audio:
+                info['audio'] = audio
+        pos = end + 4
+    return info or None
+
+def _parse_decoder_record(record, codec):
+    """从AVCDecoderConfigurationRecord/HEVCDecoderConfigurationRecord中取出第一个SPS并解析"""
+    try:
+        if codec == 'h264':
+            if record[5] & 0x1F:
+                length = (record[6] << 8) | record[7]
+                return _parse_h264_sps(record[8:8 + length])
+        elif codec == 'hevc':
+            i = 23
+            for _ in range(record[22]):
+                nal_type = record[i] & 0x3F
+                count = (record[i + 1] << 8) | record[i + 2]
+                i += 3
+                for _ in range(count):
+                    length = (record[i] << 8) | record[i + 1]
+                    if nal_type == 33:
+                        return _parse_hevc_sps(record[i + 2:i + 2 + length])
+                    i += 2 + length
+    except (IndexError, ValueError):
+        pass
+    return None
+
+def inspect_stream(data, container):
+    """从探测时读到的数据中解析视频编码、分辨率和profile, 不启动外部程序
+
+    支持TS(PAT/PMT和H.264/H.265 SPS、MPEG-2序列头)、FLV序列头和裸H.264/H.265流。
+    返回 {'codec', 'width', 'height', 'profile', 'level', 'audio'} 中能确定的部分,
+    无法解析时返回None
+    """
+    if container not in INSPECT_CONTAINERS:
+        return None
+    with memoryview(data) as view:
+        if container == 'flv':
+            return _inspect_flv(view)
+        if container == 'h264':
+            return _find_sps(bytes(view), None)
+        return _inspect_ts(view)
+
+_VIDEO_ATTR_RE = re.compile(r'\s*video-(?:codec|resolution)="[^"]*"')
+
+def annotate_video(extinf, video):
+    """把解析出的视频编码和分辨率写入EXTINF行的 video-codec/video-resolution 属性(替换已有的值)"""
+    if not extinf or not video:
+        return extinf
+    attrs = []
+    if video.get('codec'):
+        attrs.append(f'video-codec="{video["codec"]}"')
+    if video.get('height'):
+        attrs.append(f'video-resolution="{video["width"]}x{video["height"]}"')
+    if not attrs:
+        return extinf
+    extinf = _VIDEO_ATTR_RE.sub('', extinf)
+    return re.sub(r'^#EXTINF:\s*-?[\d.]*', lambda m: f"{m.group()} {' '.join(attrs)}", extinf, count=1)
+
+class QualityStats:
+    """统计可用流的分辨率和编码, 分辨率优先取码流中的值, 其次按频道名推测"""
+
+    def __init__(self):
+        self.heights = Counter()    # 从码流解析出的视频高度
+        self.codecs = Counter()
+        self.guessed = 0
+        self.unknown = 0
+
+    def record(self, entry, video):
+        """记录一个可用条目, 返回采用的视频高度(未知时为0)"""
+        if video and video.get('codec'):
+            self.codecs[video['codec']] += 1
+        if video and video.get('height'):
+            self.heights[video['height']] += 1
+            return video['height']
+        if entry.resolution:
+            self.guessed += 1
+        else:
+            self.unknown += 1
+        return entry.resolution
+
+    def summary(self):
+        parsed = sum(self.heights.values())
+        text = f"码流解析 {parsed} 个"
+        if parsed:
+            top = sorted(self.heights.items(), key=lambda item: -item[0])[:5]
+            text += " (" + ", ".join(f"{height}p {count}" for height, count in top) + ")"
+        text += f", 按名称推测 {self.guessed} 个, 未知 {self.unknown} 个"
+        if self.codecs:
+            text += "; 编码: " + ", ".join(f"{codec} {count}" for codec, count in self.codecs.most_common())
+        return text
+
+class _SniffProgress:
+    """逐段读取时的识别状态(线程和异步引擎共用)
+
+    每段数据到达后识别一次封装格式; 可解析的格式在数据量翻倍时才重新解析视频参数,
+    读取结束时再解析一次, 解析的总数据量不超过最终数据量的两倍
+    """
+
+    __slots__ = ('container', 'video', 'inspected')
+
+    def __init__(self):
+        self.container = None
+        self.video = None
+        self.inspected = 0
+
+    def update(self, buf):
+        """返回已读数据是否足够: 识别出封装格式, 且可解析的格式已取得分辨率"""
+        self.container, need_more = sniff_container(buf)
+        if need_more:
+            return False
+        if self.container not in INSPECT_CONTAINERS:
+            return True
+        if len(buf) < 2 * self.inspected:
+            return False
+        return self._inspect(buf)
+
+    def finish(self, buf):
+        if self.container in INSPECT_CONTAINERS and len(buf) > self.inspected:
+            self._inspect(buf)
+
+    def _inspect(self, buf):
+        self.inspected = len(buf)
+        self.video = inspect_stream(buf, self.container)
+        return bool(self.video and 'height' in self.video)
+
+def evaluate_stream_response(status_code, content_type, content, elapsed, container=None, video=None):
+    """根据状态码、封装格式和Content-Type判断流是否可用(线程和异步引擎共用)
+
+    container 和 video 为读取时已得到的封装格式和视频参数, 不再重复识别和解析
+    """
+    if status_code not in [200, 206]:  # 检查状态码（包括部分内容响应）
+        return {
+            'status': 'fail',
+            'error': f'HTTP状态码错误: {status_code}',
+            'status_code': status_code
+        }
+
+    if not content:
+        return {
+            'status': 'fail',
+            'error': '无法读取流数据'
+        }
+
+    if container:
+        result = {
+            'status': 'ok',
+            'response_time': f"{elapsed:.2f}秒",
+            'elapsed': elapsed,
+            'status_code': status_code,
+            'content_type': content_type or 'unknown',
+            'container': container
+        }
+        if video:
+            result['video'] = video
+        return result
+
+    # 如果无法识别格式，但服务器返回了正确的Content-Type
+    content_type = (content_type or '').lower()
+    if any(t in content_type for t in VALID_CONTENT_TYPES):
+        return {
+            'status': 'ok',
+            'response_time': f"{elapsed:.2f}秒",
+            'elapsed': elapsed,
+            'status_code': status_code,
+            'content_type': content_type,
+            'container': 'unknown'
+        }
+
+    return {
+        'status': 'fail',
+        'error': f'未识别的流媒体格式 (Content-Type: {content_type})'
+    }
+
+def _read_for_sniff(raw, limit=PROBE_READ_SIZE, timings=None):
+    """从urllib3响应中按到达的数据逐段读取, 能识别出格式并取得视频参数时立即停止
+
+    返回 (数据, 封装格式, 视频参数)。识别出可解析的格式后最多读到 INSPECT_READ_SIZE,
+    每次最多等待 INSPECT_WAIT 秒, 超时只是没有视频参数, 不影响结果
+    """
+    buf = bytearray()
+    progress = _SniffProgress()
+    read1 = getattr(raw, 'read1', None)
+    start = time.monotonic()
+    # 缩短过超时的连接放回连接池前恢复原来的超时
+    sock = None
+    sock_timeout = None
+    cap = limit
+    try:
+        while len(buf) < cap:
+            size = cap - len(buf)
+            try:
+                if read1 is not None:
+                    chunk = read1(size, decode_content=True)
+                else:
+                    chunk = raw.read(size, decode_content=True)
+            except Exception:
+                if progress.container is None:
+                    raise
+                break
+            if not chunk:
+                break
+            if not buf and timings is not None:
+                timings['first_byte'] = time.monotonic() - start
+            buf += chunk
+            if progress.update(buf):
+                break
+            if progress.container in INSPECT_CONTAINERS:
+                cap = max(limit, INSPECT_READ_SIZE)
+            if progress.container is not None and sock is None:
+                sock = getattr(getattr(raw, 'connection', None), 'sock', None)
+                if sock is not None:
+                    sock_timeout = sock.gettimeout()
+                    sock.settimeout(INSPECT_WAIT)
+    finally:
+        if sock is not None:
+            sock.settimeout(sock_timeout)
+        if timings is not None:
+            timings['bytes'] += len(buf)
+    progress.finish(buf)
+    return buf, progress.container, progress.video
+
+def check_stream(url, timeout=PROBE_TIMEOUT):
+    """检查流媒体链接是否可用, 结果的timings中记录各阶段耗时"""
+    timings = _new_timings()
+    _probe_local.timings = timings
+    start = time.monotonic()
+    try:
+        result = _check_stream(url, timings, timeout)
+    finally:
+        _probe_local.timings = None
+    timings['total'] = time.monotonic() - start
+    result['timings'] = timings
+    return result
+
+def _caused_by_reset(error, depth=0):
+    """异常(或其包装的原因)是否为连接被对方重置"""
+    if isinstance(error, ConnectionResetError):
+        return True
+    if not isinstance(error, BaseException) or depth > 5:
+        return False
+    causes = [error.__cause__, error.__context__] + list(error.args)
+    return any(_caused_by_reset(cause, depth + 1) for cause in causes if cause is not None)
+
+def _check_stream(url, timings, timeout):
+    requests = _requests()
+    try:
+        headers = {
+            'User-Agent': USER_AGENT,
+            'Accept': '*/*',
+            'Range': f'bytes=0-{PROBE_READ_SIZE - 1}'  # 请求前4KB数据
+        }
+
+        # 直接使用GET请求并检查内容, 通过共享连接池复用keep-alive连接
+        response = get_probe_session().get(
+            url,
+            timeout=timeout,
+            headers=headers,
+            stream=True,
+            verify=False
+        )
+
+        # requests的elapsed从发送前开始计时, 包含其中的DNS/TCP/TLS耗时
+        setup = sum(timings[phase] or 0 for phase in ('dns', 'connect', 'tls'))
+        timings['ttfb'] = max(0.0, response.elapsed.total_seconds() - setup)
+        try:
+            content = container = video = None
+            if response.status_code in [200, 206]:
+                # 读取能识别格式的最少数据, 识别后立即关闭连接
+                content, container, video = _read_for_sniff(response.raw, timings=timings)
+            return evaluate_stream_response(
+                response.status_code,
+                response.headers.get('Content-Type'),
+                content,
+                response.elapsed.total_seconds(),
+                container,
+                video
+            )
+        finally:
+            _release_response(response)
+
+    except requests.exceptions.Timeout:
+        return {
+            'status': 'fail',
+            'error': '连接超时'
+        }
+    except requests.exceptions.ConnectionError as e:
+        result = {
+            'status': 'fail',
+            'error': '连接错误'
+        }
+        if _caused_by_reset(e):
+            result['reset'] = True
+        return result
+    except requests.exceptions.TooManyRedirects:
+        return {
+            'status': 'fail',
+            'error': '重定向次数过多'
+        }
+    except requests.exceptions.RequestException as e:
+        return {
+            'status': 'fail',
+            'error': str(e)
+        }
+
+# 异步检测引擎配置
+ASYNC_MAX_IN_FLIGHT = 2000   # 全局同时进行的探测数量上限
+ASYNC_PER_HOST_LIMIT = 20    # 单个主机同时进行的探测数量上限
+MAX_REDIRECTS = 30           # 与requests默认的最大重定向次数一致
+
+class AsyncProbeError(Exception):
+    """异步探测失败, 错误信息与check_stream保持一致"""
+
+_ssl_context = None
+
+def _get_ssl_context():
+    """获取不校验证书的SSL上下文(对应requests的verify=False)"""
+    global _ssl_context
+    if _ssl_context is None:
+        import ssl
+        _ssl_context = ssl.create_default_context()
+        _ssl_context.check_hostname = False
+        _ssl_context.verify_mode = ssl.CERT_NONE
+    return _ssl_context
+
+def _build_request_path(parsed):
+    """构造HTTP请求行中的路径部分"""
+    from urllib.parse import quote
+    path = quote(parsed.path or '/', safe="/%:@!$&'()*+,;=~")
+    if parsed.query:
+        path += '?' + quote(parsed.query, safe="/%:@!$&'()*+,;=~?")
+    return path
+
+class AsyncConnectionPool:
+    """异步引擎的keep-alive连接池, 按 (scheme, host, port) 保存空闲连接"""
+
+    def __init__(self, per_host=POOL_PER_HOST, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.per_host = per_host
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+
+    def acquire(self, key):
+        """取出一个仍然可用的空闲连接, 没有则返回None"""
+        conns = self.idle.get(key)
+        now = time.monotonic()
+        while conns:
+            reader, writer, idle_since = conns.pop()
+            if now - idle_since < self.idle_timeout and not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    def release(self, key, reader, writer):
+        """归还连接, 超过单主机上限时直接关闭"""
+        conns = self.idle.setdefault(key, [])
+        if len(conns) < self.per_host:
+            conns.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self):
+        for conns in self.idle.values():
+            for _, writer, _ in conns:
+                writer.close()
+        self.idle.clear()
+
+class AsyncStreamResponse:
+    """异步探测得到的HTTP响应(只保留判断需要的信息)"""
+
+    def __init__(self, status_code, headers, reader, writer, elapsed, pool=None, pool_key=None, keep_alive=False,
+                 timings=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.elapsed = elapsed
+        self.pool = pool
+        self.pool_key = pool_key
+        self.keep_alive = keep_alive
+        self.timings = timings
+        self._chunk_left = 0
+        self._body_left = None
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        self._finished = False
+        if not self._chunked and headers.get('content-length', '').isdigit():
+            self._body_left = int(headers['content-length'])
+            self._finished = self._body_left == 0
+
+    async def read(self, size, timeout, once=False):
+        """读取最多size字节的响应体, 自动处理chunked编码
+
+        once为True时只等待一次网络数据, 返回当前已到达的部分
+        """
+        try:
+            return await self._read(size, timeout, once)
+        except BaseException:
+            # 读取中断后连接状态未知, 不再复用
+            self.keep_alive = False
+            raise
+
+    async def read_for_sniff(self, limit, timeout):
+        """按到达的数据逐段读取, 能识别出封装格式并取得视频参数时立即停止
+
+        返回 (数据, 封装格式, 视频参数), 读取上限与线程引擎的 _read_for_sniff 相同
+        """
+        buf = bytearray()
+        progress = _SniffProgress()
+        start = time.monotonic()
+        cap = limit
+        try:
+            while len(buf) < cap:
+                size = cap - len(buf)
+                if progress.container is None:
+                    chunk = await self.read(size, timeout, once=True)
+                else:
+                    # 已确认可用, 为取得视频参数只短暂等待
+                    try:
+                        chunk = await self.read(size, min(timeout, INSPECT_WAIT), once=True)
+                    except (asyncio.TimeoutError, OSError):
+                        break
+                if not chunk:
+                    break
+                if not buf and self.timings is not None:
+                    self.timings['first_byte'] = time.monotonic() - start
+                buf += chunk
+                if progress.update(buf):
+                    break
+                if progress.container in INSPECT_CONTAINERS:
+                    cap = max(limit, INSPECT_READ_SIZE)
+        finally:
+            if self.timings is not None:
+                self.timings['bytes'] += len(buf)
+        progress.finish(buf)
+        return buf, progress.container, progress.video
+
+    async def _read(self, size, timeout, once=False):
+        data = bytearray()
+        while len(data) < size and not self._finished:
+            if self._chunked:
+                if self._chunk_left == 0:
+                    line = await asyncio.wait_for(self.reader.readline(), timeout)
+                    try:
+                        self._chunk_left = int(line.split(b';')[0].strip() or b'0', 16)
+                    except ValueError:
+                        self.keep_alive = False
+                        break
+                    if self._chunk_left == 0:
+                        # 跳过trailer直到空行
+                        while line not in (b'\r\n', b'\n', b''):
+                            line = await asyncio.wait_for(self.reader.readline(), timeout)
+                        self._finished = True
+                        break
+                want = min(size - len(data), self._chunk_left)
+            elif self._body_left is not None:
+                want = min(size - len(data), self._body_left)
+            else:
+                want = size - len(data)
+
+            chunk = await asyncio.wait_for(self.reader.read(want), timeout)
+            if not chunk:
+                self.keep_alive = False
+                break
+            data += chunk
+            if self._chunked:
+                self._chunk_left -= len(chunk)
+                if self._chunk_left == 0:
+                    await asyncio.wait_for(self.reader.readline(), timeout)
+            elif self._body_left is not None:
+                self._body_left -= len(chunk)
+                self._finished = self._body_left == 0
+            if once:
+                break
+        return bytes(data)
+
+    async def release(self, timeout):
+        """响应体较小时读完剩余数据并把连接归还连接池, 否则关闭连接"""
+        if self.pool is not None and self.keep_alive and not self._finished:
+            if self._body_left is not None and self._body_left <= POOL_DRAIN_LIMIT:
+                try:
+                    await self.read(self._body_left, timeout)
+                except (asyncio.TimeoutError, OSError):
+                    self.keep_alive = False
+        if self.pool is not None and self.keep_alive and self._finished:
+            self.pool.release(self.pool_key, self.reader, self.writer)
+        else:
+            self.writer.close()
+
+    def close(self):
+        self.writer.close()
+
+async def _async_connect(scheme, host, port, timeout, use_tls=True, timings=None):
+    """使用预解析的地址建立连接, https且use_tls为True时完成TLS握手"""
+    start = time.monotonic()
+    addrs = await asyncio.wrap_future(dns_resolver.submit(host))
+    _add_timing(timings, 'dns', time.monotonic() - start)
+    if not addrs:
+        raise ConnectionError(f'域名解析失败: {host}')
+    tls = scheme == 'https' and use_tls
+    # TCP连接后再单独完成TLS握手以便分别计时; Python 3.11之前没有start_tls,
+    # TLS握手耗时计入TCP连接
+    split_tls = tls and hasattr(asyncio.StreamWriter, 'start_tls')
+    inline_tls = tls and not split_tls
+    error = None
+    for _, ip in addrs[:2]:
+        start = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    ip, port,
+                    ssl=_get_ssl_context() if inline_tls else None,
+                    server_hostname=host if inline_tls else None
+                ),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            raise
+        except (OSError, UnicodeError) as e:
+            error = e
+            continue
+        finally:
+            _add_timing(timings, 'connect', time.monotonic() - start)
+        if not split_tls:
+            return reader, writer
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(writer.start_tls(_get_ssl_context(), server_hostname=host), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        finally:
+            _add_timing(timings, 'tls', time.monotonic() - start)
+        return reader, writer
+    raise ConnectionError(str(error)) from error
+
+async def _async_send_request(url, headers, timeout, pool, timings=None):
+    """发送一次GET请求并读取响应头
+
+    优先复用连接池中的空闲连接, 复用的连接已被服务器关闭时返回None由调用方重试
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    if scheme not in ('http', 'https') or not parsed.hostname:
+        raise AsyncProbeError(f'不支持的URL: {url}')
+    host = parsed.hostname
+    port = parsed.port or (443 if scheme == 'https' else 80)
+    pool_key = (scheme, host, port)
+
+    start_time = time.monotonic()
+    conn = pool.acquire(pool_key) if pool is not None else None
+    reused = conn is not None
+    if conn is None:
+        conn = await _async_connect(scheme, host, port, timeout, timings=timings)
+    reader, writer = conn
+
+    request_start = time.monotonic()
+    try:
+        request_lines = [
+            f'GET {_build_request_path(parsed)} HTTP/1.1',
+            f'Host: {parsed.netloc.rsplit("@", 1)[-1]}',
+        ]
+        request_lines += [f'{k}: {v}' for k, v in headers.items()]
+        request_lines += [
+            'Accept-Encoding: identity',
+            'Connection: keep-alive' if pool is not None else 'Connection: close',
+            '', ''
+        ]
+        writer.write('\r\n'.join(request_lines).encode('utf-8'))
+        await asyncio.wait_for(writer.drain(), timeout)
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        if not status_line and reused:
+            writer.close()
+            return None
+        _add_timing(timings, 'ttfb', time.monotonic() - request_start)
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise ConnectionError('无效的HTTP响应')
+        status_code = int(parts[1])
+
+        response_headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+    except ConnectionError:
+        writer.close()
+        if reused:
+            return None
+        raise
+    except BaseException:
+        writer.close()
+        raise
+
+    pool_stats.record(reused)
+    keep_alive = (parts[0] == 'HTTP/1.1'
+                  and 'close' not in response_headers.get('connection', '').lower())
+    return AsyncStreamResponse(status_code, response_headers, reader, writer,
+                               time.monotonic() - start_time, pool, pool_key, keep_alive, timings)
+
+async def _async_open_stream(url, headers, timeout, pool=None, timings=None):
+    """异步发送GET请求并读取响应头, 处理重定向"""
+    for _ in range(MAX_REDIRECTS + 1):
+        response = await _async_send_request(url, headers, timeout, pool, timings)
+        if response is None:
+            # 复用的空闲连接已失效, 改用新连接重试一次
+            response = await _async_send_request(url, headers, timeout, None, timings)
+
+        location = response.headers.get('location')
+        if response.status_code in (301, 302, 303, 307, 308) and location:
+            await response.release(timeout)
+            url = urljoin(url, location)
+            continue
+
+        return response
+
+    raise AsyncProbeError('重定向次数过多')
+
+def _async_error_result(error):
+    """把异步探测中的异常转换为与check_stream一致的失败结果"""
+    if isinstance(error, asyncio.TimeoutError):
+        message = '连接超时'
+    elif isinstance(error, OSError):
+        message = '连接错误'
+    elif isinstance(error, AsyncProbeError):
+        message = str(error)
+    else:
+        message = f'连接错误: {error}'
+    result = {
+        'status': 'fail',
+        'error': message
+    }
+    if _caused_by_reset(error):
+        result['reset'] = True
+    return result
+
+def _probe_headers():
+    return {
+        'User-Agent': USER_AGENT,
+        'Accept': '*/*',
+        'Range': f'bytes=0-{PROBE_READ_SIZE - 1}'
+    }
+
+async def check_stream_async(url, timeout=PROBE_TIMEOUT, pool=None):
+    """check_stream的异步版本, 判断规则和记录的分阶段耗时完全相同"""
+    timings = _new_timings()
+    start = time.monotonic()
+    try:
+        response = await _async_open_stream(url, _probe_headers(), timeout, pool, timings)
+        try:
+            content = container = video = None
+            if response.status_code in [200, 206]:
+                content, container, video = await response.read_for_sniff(PROBE_READ_SIZE, timeout)
+            result = evaluate_stream_response(
+                response.status_code,
+                response.headers.get('content-type'),
+                content,
+                response.elapsed,
+                container,
+                video
+            )
+        finally:
+            await response.release(timeout)
+    except Exception as e:
+        result = _async_error_result(e)
+    timings['total'] = time.monotonic() - start
+    result['timings'] = timings
+    return result
+
+# 分级探测配置: 每一级有独立的并发数和超时, 只有通过上一级的链接才进入下一级
+TIER_CONNECT_LIMIT = 1000     # 第1级: TCP连接(每个 主机:端口 只连接一次)
+TIER_CONNECT_TIMEOUT = 2      # TCP连接超时(秒)
+TIER_CONNECT_FAIL_TTL = 5     # TCP连接失败的结论保留的时间(秒), 之后该 主机:端口 的链接重新探测连接
+TIER_HEADER_TIMEOUT = PROBE_TIMEOUT   # 第2级: 发送请求并读取响应头, 并发数使用全局并发上限
+TIER_PAYLOAD_LIMIT = 500      # 第3级: 读取并识别数据
+TIER_PAYLOAD_TIMEOUT = PROBE_TIMEOUT
+
+TIER_NAMES = (('connect', 'TCP连接'), ('header', '响应头'), ('payload', '数据识别'))
+
+class TieredProber:
+    """异步分级探测: TCP连接 -> HTTP响应头 -> 读取并识别数据
+
+    同一 主机:端口 的TCP连接探测成功后不再重复, 连接不通的主机上的链接
+    不再发送HTTP请求; 失败的结论只保留 TIER_CONNECT_FAIL_TTL 秒, 一次偶然的
+    连接超时不会让该主机上的全部链接失败。各级淘汰数量记录在 eliminated 中
+    """
+
+    def __init__(self, pool, header_limit, connect_limit=TIER_CONNECT_LIMIT,
+                 payload_limit=TIER_PAYLOAD_LIMIT, connect_timeout=TIER_CONNECT_TIMEOUT,
+                 header_timeout=TIER_HEADER_TIMEOUT, payload_timeout=TIER_PAYLOAD_TIMEOUT):
+        self.pool = pool
+        self.connect_limit = asyncio.Semaphore(connect_limit)
+        self.header_limit = asyncio.Semaphore(header_limit)
+        self.payload_limit = asyncio.Semaphore(payload_limit)
+        self.connect_timeout = connect_timeout
+        self.header_timeout = header_timeout
+        self.payload_timeout = payload_timeout
+        self.connect_checks = {}  # (scheme, host, port) -> [连接结果的Future, 失败结论的过期时间]
+        self.eliminated = {name: 0 for name, _ in TIER_NAMES}
+        self.passed = 0
+
+    async def _tcp_connect(self, scheme, host, port):
+        """第1级: 只建立TCP连接, 返回 (失败结果, 分阶段耗时), 成功时失败结果为None"""
+        timings = _new_timings()
+        async with self.connect_limit:
+            try:
+                reader, writer = await _async_connect(scheme, host, port, self.connect_timeout, use_tls=False,
+                                                      timings=timings)
+            except Exception as e:
+                return _async_error_result(e), timings
+        if scheme == 'http' and self.pool is not None:
+            # 明文连接交给连接池, 第2级可以直接复用
+            self.pool.release((scheme, host, port), reader, writer)
+        else:
+            writer.close()
+        return None, timings
+
+    async def check_connect(self, url):
+        """同一 主机:端口 共用TCP连接探测, 返回 (失败结果, 分阶段耗时)
+
+        只有实际发起连接的探测得到分阶段耗时, 等待其他探测的连接结果时为None
+        """
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        host = (parsed.hostname or '').lower()
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        key = (scheme, host, port)
+        check = self.connect_checks.get(key)
+        owner = check is None or (check[1] is not None and time.monotonic() >= check[1])
+        if owner:
+            check = self.connect_checks[key] = [asyncio.ensure_future(self._tcp_connect(scheme, host, port)), None]
+
+            def expire(task, check=check):
+                # 只有失败的结论会过期, 成功的结论在整个检测过程中有效
+                if task.cancelled() or task.exception() is not None or task.result()[0] is not None:
+                    check[1] = time.monotonic() + TIER_CONNECT_FAIL_TTL
+            check[0].add_done_callback(expire)
+        result, timings = await asyncio.shield(check[0])
+        return result, timings if owner else None
+
+    async def probe(self, url, timeout=None):
+        """依次执行三级探测, 返回与check_stream一致的结果
+
+        timeout 不为None时代替第2、3级的默认超时
+        """
+        timings = _new_timings()
+        start = time.monotonic()
+        result = await self._probe(url, timings, timeout)
+        timings['total'] = time.monotonic() - start
+        result['timings'] = timings
+        return result
+
+    async def _probe(self, url, timings, timeout=None):
+        header_timeout = timeout or self.header_timeout
+        payload_timeout = timeout or self.payload_timeout
+        # 同一 主机:端口 共用TCP连接探测, 只有实际发起连接的探测记录连接耗时,
+        # 等待其他探测的结果的时间不计入, 以免抬高自适应超时(DNS耗时由调用方记录)
+        try:
+            result, connect_timings = await self.check_connect(url)
+        except Exception as e:
+            result, connect_timings = _async_error_result(e), None
+        if connect_timings is not None and connect_timings['connect'] is not None:
+            _add_timing(timings, 'connect', connect_timings['connect'])
+        if result is not None:
+            self.eliminated['connect'] += 1
+            return dict(result)
+
+        try:
+            async with self.header_limit:
+                response = await _async_open_stream(url, _probe_headers(), header_timeout, self.pool, timings)
+        except Exception as e:
+            self.eliminated['header'] += 1
+            return _async_error_result(e)
+
+        try:
+            if response.status_code not in [200, 206]:
+                self.eliminated['header'] += 1
+                return evaluate_stream_response(response.status_code, None, None, response.elapsed)
+
+            async with self.payload_limit:
+                content, container, video = await response.read_for_sniff(PROBE_READ_SIZE, payload_timeout)
+            result = evaluate_stream_response(
+                response.status_code,
+                response.headers.get('content-type'),
+                content,
+                response.elapsed,
+                container,
+                video
+            )
+        except Exception as e:
+            result = _async_error_result(e)
+        finally:
+            await response.release(payload_timeout)
+
+        if result['status'] == 'ok':
+            self.passed += 1
+        else:
+            self.eliminated['payload'] += 1
+        return result
+
+    def summary(self):
+        return self.format_summary(self.eliminated, self.passed, len(self.connect_checks))
+
+    @staticmethod
+    def format_summary(eliminated, passed, connect_checks):
+        parts = [f"{label}阶段淘汰 {eliminated[name]} 个" for name, label in TIER_NAMES]
+        return (f"{', '.join(parts)}, 通过 {passed} 个 "
+                f"(TCP连接探测 {connect_checks} 个 主机:端口)")
+
+def _raise_fd_limit(wanted):
+    """尽量提高进程可打开的文件描述符数量, 保证大量并发连接"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+ASYNC_FEED_BATCH = 256  # 每次从条目迭代器中读取的数量
+
+def _next_batch(iterator, size):
+    """从迭代器中最多取出size个元素"""
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            break
+    return batch
+
+async def _async_check_entries(entries, on_result, max_in_flight, per_host, timeout, breaker, tiered,
+                               timeouts=None, retry_budget=None, limiter=None):
+    """按全局和单主机并发上限异步检测所有条目, 返回分级探测器(未分级时为None)"""
+    loop = asyncio.get_running_loop()
+
+    global_limit = asyncio.Semaphore(max_in_flight)
+    # 限制已创建但尚未完成的任务数, 避免一次性为全部条目创建任务
+    pending_limit = asyncio.Semaphore(max_in_flight * 4)
+    host_limits = {}
+    pool = AsyncConnectionPool(per_host)
+    prober = TieredProber(pool, max_in_flight) if tiered else None
+
+    async def probe_once(url, origin):
+        """探测一次, 超时失败时在重试预算内重试, 返回 (结果, 使用的超时)"""
+        probe_timeout = timeouts.timeout_for(origin) if timeouts is not None else timeout
+        if prober is not None:
+            result = await prober.probe(url, probe_timeout)
+        else:
+            async with global_limit:
+                result = await check_stream_async(url, probe_timeout, pool)
+        if retry_budget is not None:
+            retry_budget.record_probe()
+            if retry_budget.should_retry(result) and retry_budget.try_acquire():
+                # 重试绕过分级探测中已缓存的TCP连接结果
+                probe_timeout = (timeouts.retry_timeout(probe_timeout) if timeouts is not None
+                                 else min(ADAPTIVE_MAX_TIMEOUT, probe_timeout * 2))
+                async with global_limit:
+                    result = await check_stream_async(url, probe_timeout, pool)
+                result['retried'] = True
+                retry_budget.record_retry(result)
+        return result, probe_timeout
+
+    async def probe(entry):
+        url = entry.url
+        try:
+            host = get_url_host(url)
+            host_limit = host_limits.get(host)
+            if host_limit is None:
+                host_limit = host_limits[host] = asyncio.Semaphore(per_host)
+            async with host_limit:
+                origin = get_url_origin(url)
+                result = breaker.check(origin) if breaker is not None else None
+                if result is None:
+                    dns_start = time.monotonic()
+                    addrs = await asyncio.wrap_future(dns_resolver.submit(host))
+                    dns_time = time.monotonic() - dns_start
+                    if not addrs:
+                        result = dns_failure_result(host)
+                    else:
+                        for attempt in range(AIMD_THROTTLE_RETRIES + 1):
+                            if limiter is not None:
+                                await limiter.acquire(origin)
+                            result = None
+                            try:
+                                result, probe_timeout = await probe_once(url, origin)
+                            finally:
+                                event = await limiter.release(origin, result) if limiter is not None else None
+                            # 被限流时窗口已缩小, 稍后重新探测, 避免把限流当作不可用
+                            if event not in AIMD_RETRY_EVENTS or attempt == AIMD_THROTTLE_RETRIES:
+                                break
+                            await asyncio.sleep(AIMD_BACKOFF * (attempt + 1))
+                        if timeouts is not None:
+                            timeouts.observe(origin, result)
+                        result['timeout'] = probe_timeout
+                        if breaker is not None:
+                            breaker.record(origin, result)
+                        result['ipv6'] = is_ipv6_addresses(addrs)
+                        _add_timing(result['timings'], 'dns', dns_time)
+                        _add_timing(result['timings'], 'total', dns_time)
+            on_result(entry, result)
+        finally:
+            pending_limit.release()
+
+    tasks = set()
+    entry_iter = iter(entries)
+    while True:
+        # 条目可能来自正在下载的列表, 在线程中读取以免阻塞事件循环
+        batch = await loop.run_in_executor(None, _next_batch, entry_iter, ASYNC_FEED_BATCH)
+        if not batch:
+            break
+        for entry in batch:
+            await pending_limit.acquire()
+            task = asyncio.create_task(probe(entry))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    pool.close()
+    return prober
+
+def run_async_checks(entries, on_result, max_in_flight=ASYNC_MAX_IN_FLIGHT,
+                     per_host=ASYNC_PER_HOST_LIMIT, timeout=PROBE_TIMEOUT, breaker=None, tiered=True,
+                     timeouts=None, retry_budget=None, limiter=None):
+    """使用asyncio引擎检测entries, 每个结果通过on_result(entry, result)回调
+
+    传入breaker(HostCircuitBreaker)时, 已熔断主机上的条目不再检测。
+    tiered为True时使用TieredProber分级探测并返回它, 以便输出各级淘汰数量。
+    传入timeouts(AdaptiveTimeouts)时按主机计算超时, 传入retry_budget(RetryBudget)
+    时超时失败的条目在预算内用加倍的超时重试一次。传入limiter(AsyncAimdLimiter)
+    时按源站的自适应窗口限制并发, 被限流的条目缩小窗口后重新探测
+    """
+    _raise_fd_limit(max_in_flight + TIER_CONNECT_LIMIT + 256)
+    return asyncio.run(_async_check_entries(entries, on_result, max_in_flight, per_host,
+                                            timeout, breaker, tiered, timeouts, retry_budget, limiter))
+
+# EXTINF行解析使用的预编译正则
+_EXTINF_ATTR_RE = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+# 4K/UHD/FHD/HD 常直接接在台名后(CCTV4K、BTVHD), 只要求其后不紧跟字母(排除HDTV等);
+# 按从高到低的顺序匹配, FHD/UHD 不会落到 HD; SD 仍要求前后都不是字母, 避免 BSD 等误判
+_RESOLUTION_HINTS = (
+    (2160, re.compile(r'2160[PI]|超高清|(?:4K|UHD)(?![A-Z])')),
+    (1080, re.compile(r'1080[PI]|FHD(?![A-Z])')),
+    (720, re.compile(r'720P|HD(?![A-Z])')),
+    (576, re.compile(r'576[PI]|(?<![A-Z])SD(?![A-Z])')),
+    (480, re.compile(r'480[PI]')),
+)
+
+def _guess_resolution(name):
+    """根据频道名中的关键字猜测分辨率(视频高度), 只在无法从码流中取得时使用"""
+    upper = name.upper()
+    for resolution, pattern in _RESOLUTION_HINTS:
+        if pattern.search(upper):
+            return resolution
+    return 0
+
+def _parse_extinf(extinf_line):
+    """单遍解析EXTINF行, 返回 (name, tvg_id, tvg_name, tvg_logo, group_title, resolution)"""
+    attrs = dict(_EXTINF_ATTR_RE.findall(extinf_line))
+    # 标题位于最后一个属性之后的第一个逗号后面
+    _, sep, title = extinf_line[extinf_line.rfind('"') + 1:].partition(',')
+    title = title.strip() if sep else ''
+    tvg_name = attrs.get('tvg-name', '')
+    return (
+        tvg_name.strip() or title,
+        attrs.get('tvg-id', ''),
+        tvg_name,
+        attrs.get('tvg-logo', ''),
+        attrs.get('group-title', ''),
+        # 只看频道名, 台标URL、分组名中的 hd/sd 等字样不作数
+        _guess_resolution(f"{tvg_name} {title}"),
+    )
+
+def parse_channel_info(extinf_line):
+    """解析EXTINF行的频道信息"""
+    name, tvg_id, tvg_name, tvg_logo, group_title, resolution = _parse_extinf(extinf_line)
+    return {
+        'name': name,
+        'tvg_id': tvg_id,
+        'tvg_logo': tvg_logo,
+        'group_title': group_title,
+        'resolution': resolution
+    }
+
+class ChannelEntry:
+    """播放列表中的一条频道记录, 使用__slots__以便处理超大列表"""
+
+    __slots__ = ('extinf', 'url', 'name', 'tvg_id', 'tvg_name', 'tvg_logo',
+                 'group_title', 'resolution', 'is_ipv6')
+
+    def __init__(self, extinf, url, name='', tvg_id='', tvg_name='', tvg_logo='',
+                 group_title='', resolution=0):
+        self.extinf = extinf
+        self.url = url
+        self.name = name
+        self.tvg_id = tvg_id
+        self.tvg_name = tvg_name
+        self.tvg_logo = tvg_logo
+        self.group_title = group_title
+        self.resolution = resolution
+        self.is_ipv6 = is_ipv6_url(url)
+
+    def __repr__(self):
+        return f"ChannelEntry({self.name!r}, {self.url!r})"
+
+M3U_CHUNK_SIZE = 64 * 1024
+
+def _iter_file_lines(f):
+    """逐行读取本地文件"""
+    with f:
+        yield from f
+
+def open_m3u_source(source):
+    """打开本地m3u文件并返回逐行读取的迭代器, 不会把整个列表读入内存
+
+    URL源由 open_m3u_sources 下载(带条件请求和本地副本)。无法打开时打印原因并返回None
+    """
+    try:
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"找不到文件: {source}")
+        print(f"正在读取本地文件: {source}")
+        return _iter_file_lines(open(source, 'r', encoding='utf-8', errors='replace'))
+    except Exception as e:
+        print(f"读取m3u文件失败: {e}")
+        return None
+
+def iter_m3u_entries(lines):
+    """单遍解析m3u内容, 逐条产出ChannelEntry
+
+    同一EXTINF行后面的多个URL共用该行的频道信息
+    """
+    current_extinf = None
+    current_attrs = ()
+    first_line = True
+    for line in lines:
+        line = line.strip()
+        if first_line:
+            line = line.lstrip('\ufeff')
+            if not line:
+                continue
+            first_line = False
+            if not line.startswith('#EXTM3U'):
+                print("警告: 文件可能不是有效的M3U文件")
+                print("尝试继续处理...")
+        if not line:
+            continue
+
+        if line.startswith('#EXTINF:'):
+            current_extinf = line
+            current_attrs = _parse_extinf(line)
+            continue
+
+        if line.startswith('http'):
+            yield ChannelEntry(current_extinf, line, *current_attrs)
+
+# 多源播放列表配置
+PLAYLIST_CACHE_DIR = 'm3u_sources'          # 下载的播放列表及其ETag/Last-Modified/内容哈希
+PLAYLIST_META_FILE = 'meta.json'
+PLAYLIST_TIMEOUT = (5, 30)                  # (连接超时, 读取超时)
+PLAYLIST_RETRIES = 3
+PLAYLIST_RETRY_DELAY = 0.5                  # 重试前的等待时间(秒), 按次数递增
+PLAYLIST_FETCH_WORKERS = 16                 # 同时下载的源数量
+PLAYLIST_REVALIDATE_AFTER = 300             # 距上次下载不到该时间(秒)的源直接使用本地副本
+PLAYLIST_BATCH_SIZE = 256                   # 下载线程每次交给条目流的条目数
+PLAYLIST_QUEUE_BATCHES = 64                 # 等待检测的条目批数上限
+
+PLAYLIST_STATE_LABELS = {
+    'fresh': '未过期',
+    'not_modified': '未修改(304)',
+    'unchanged': '内容未变',
+    'updated': '已更新',
+    'failed': '失败',
+}
+
+def _playlist_cache_path(source):
+    import hashlib
+    return os.path.join(PLAYLIST_CACHE_DIR, hashlib.sha1(source.encode('utf-8')).hexdigest()[:16] + '.m3u')
+
+def _load_playlist_meta():
+    try:
+        import json
+        with open(os.path.join(PLAYLIST_CACHE_DIR, PLAYLIST_META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_playlist_meta(meta):
+    import json
+    path = os.path.join(PLAYLIST_CACHE_DIR, PLAYLIST_META_FILE)
+    with open(path + '.part', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.part', path)
+
+def _iter_chunk_lines(chunks, digest=None, copy=None):
+    """逐块产出解码后的完整行列表, 同时计算内容哈希并写入本地副本(可选)"""
+    pending = b''
+    for chunk in chunks:
+        if digest is not None:
+            digest.update(chunk)
+        if copy is not None:
+            copy.write(chunk)
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield [line.decode('utf-8', errors='replace') for line in lines]
+    if pending:
+        yield [pending.decode('utf-8', errors='replace')]
+
+def _iter_binary_file(path):
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(M3U_CHUNK_SIZE), b'')
+
+def fetch_playlist_source(source, meta):
+    """逐块产出一个播放列表源的行列表, 读完后返回 (新的meta, 状态)
+
+    URL边下载边写入 m3u_sources 目录并产出已收到的行, 下载完整后才替换旧副本; 已有副本时
+    带上ETag/Last-Modified做条件请求, 不到 PLAYLIST_REVALIDATE_AFTER 秒的副本直接使用。
+    本地文件按修改时间和大小判断是否变化。状态见 PLAYLIST_STATE_LABELS。
+    只在开始读取内容前重试, 已产出的行不会重复
+    """
+    import hashlib
+    if not is_valid_url(source):
+        stat = os.stat(source)
+        if meta.get('mtime') == stat.st_mtime and meta.get('size') == stat.st_size and meta.get('sha256'):
+            yield from _iter_chunk_lines(_iter_binary_file(source))
+            return dict(meta), 'unchanged'
+        digest = hashlib.sha256()
+        yield from _iter_chunk_lines(_iter_binary_file(source), digest)
+        sha256 = digest.hexdigest()
+        new_meta = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': sha256}
+        return new_meta, 'unchanged' if sha256 == meta.get('sha256') else 'updated'
+
+    path = _playlist_cache_path(source)
+    has_copy = os.path.exists(path) and meta.get('sha256')
+    if has_copy and time.time() - meta.get('fetched_at', 0) < PLAYLIST_REVALIDATE_AFTER:
+        yield from _iter_chunk_lines(_iter_binary_file(path))
+        return dict(meta), 'fresh'
+
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate',
+    }
+    if has_copy:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    requests = _requests()
+    for attempt in range(PLAYLIST_RETRIES):
+        try:
+            response = requests.get(source, timeout=PLAYLIST_TIMEOUT, headers=headers, verify=False,
+                                    allow_redirects=True, stream=True)
+            if response.status_code == 304 and has_copy:
+                response.close()
+                yield from _iter_chunk_lines(_iter_binary_file(path))
+                return dict(meta, fetched_at=time.time()), 'not_modified'
+            try:
+                response.raise_for_status()
+            except requests.RequestException:
+                response.close()
+                raise
+            break
+        except requests.RequestException as e:
+            # 4xx错误重试也不会成功
+            client_error = e.response is not None and 400 <= e.response.status_code < 500
+            if client_error or attempt == PLAYLIST_RETRIES - 1:
+                raise
+            time.sleep(PLAYLIST_RETRY_DELAY * (attempt + 1))
+
+    # 边下载边写入临时文件并解析, 下载完整后再替换旧副本
+    digest = hashlib.sha256()
+    try:
+        with response, open(path + '.part', 'wb') as f:
+            yield from _iter_chunk_lines(response.iter_content(M3U_CHUNK_SIZE), digest, f)
+        os.replace(path + '.part', path)
+    except BaseException:
+        try:
+            os.remove(path + '.part')
+        except OSError:
+            pass
+        raise
+    sha256 = digest.hexdigest()
+    new_meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': sha256,
+        'fetched_at': time.time(),
+    }
+    return new_meta, 'unchanged' if sha256 == meta.get('sha256') else 'updated'
+
+def open_m3u_sources(sources, workers=PLAYLIST_FETCH_WORKERS):
+    """并发获取多个播放列表源(URL或本地文件), 合并为一个条目流
+
+    每个源在工作线程中边下载边解析, 解析出的条目分批交给条目流, 下载未完成时
+    即可开始检测; 各源的结果在该源读完时打印, 条目数量在条目流读完后打印并保存到
+    m3u_sources/meta.json。全部源都失败时返回None
+    """
+    import queue
+    os.makedirs(PLAYLIST_CACHE_DIR, exist_ok=True)
+    meta = _load_playlist_meta()
+    reports = {source: {'state': 'failed', 'elapsed': 0.0, 'entries': 0, 'error': None} for source in sources}
+    print(f"\n正在并发获取 {len(sources)} 个播放列表源...")
+    # 队列有上限, 检测跟不上时下载线程等待, 内存占用有界
+    events = queue.Queue(PLAYLIST_QUEUE_BATCHES)
+    stop = threading.Event()
+
+    def put(event):
+        """放入队列, 条目流已关闭时返回False"""
+        while not stop.is_set():
+            try:
+                events.put(event, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(source):
+        start = time.monotonic()
+        outcome = {}
+        batch = []
+
+        def flush():
+            """交出已解析的条目, 条目流已关闭时返回False"""
+            if batch:
+                if not put(('entries', source, batch[:], None)):
+                    return False
+                batch.clear()
+            return True
+
+        def lines():
+            chunks = fetch_playlist_source(source, meta.get(source, {}))
+            while True:
+                # 等待下一块数据前交出已解析的条目, 下载较慢时也能尽快开始检测
+                if not flush():
+                    return
+                try:
+                    chunk = next(chunks)
+                except StopIteration as done:
+                    outcome['meta'], outcome['state'] = done.value
+                    return
+                yield from chunk
+
+        try:
+            for entry in iter_m3u_entries(lines()):
+                batch.append(entry)
+                if len(batch) >= PLAYLIST_BATCH_SIZE and not flush():
+                    return
+            if outcome:
+                put(('done', source, outcome, time.monotonic() - start))
+        except Exception as e:
+            put(('failed', source, e, time.monotonic() - start))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources))))
+    for source in sources:
+        executor.submit(fetch, source)
+    executor.shutdown(wait=False)
+
+    def next_event():
+        kind, source, payload, elapsed = events.get()
+        report = reports[source]
+        if kind == 'entries':
+            report['entries'] += len(payload)
+            return payload
+        report['elapsed'] = elapsed
+        if kind == 'failed':
+            report['error'] = str(payload)
+            print(f"  [失败] {source}: {payload}")
+        else:
+            source_meta = payload['meta']
+            source_meta['entries'] = report['entries']
+            meta[source] = source_meta
+            report['state'] = payload['state']
+            print(f"  [{PLAYLIST_STATE_LABELS[report['state']]}] {source} ({report['elapsed']:.2f}秒)")
+        return None
+
+    # 等到第一批条目或全部源结束, 以便全部失败时返回None
+    remaining = len(sources)
+    first = None
+    while remaining and first is None:
+        first = next_event()
+        if first is None:
+            remaining -= 1
+    if first is None and all(report['state'] == 'failed' for report in reports.values()):
+        _save_playlist_meta(meta)
+        return None
+
+    def merged_entries(remaining, batch):
+        try:
+            while True:
+                if batch:
+                    yield from batch
+                if not remaining:
+                    break
+                batch = next_event()
+                if batch is None:
+                    remaining -= 1
+        finally:
+            stop.set()
+        _save_playlist_meta(meta)
+        print("\n\n播放列表源:")
+        for source in sources:
+            report = reports[source]
+            state = PLAYLIST_STATE_LABELS[report['state']]
+            print(f"  [{state}] {source}: {report['entries']} 个条目, 获取耗时 {report['elapsed']:.2f}秒")
+        total = sum(report['entries'] for report in reports.values())
+        fetched = sum(report['state'] != 'failed' for report in reports.values())
+        print(f"合并后共 {total} 个条目 (来自 {fetched}/{len(sources)} 个源)")
+
+    return merged_entries(remaining, first)
+
+def open_m3u_entries(source):
+    """打开一个源或多个源(列表), 返回ChannelEntry迭代器, 无法打开时返回None
+
+    URL源都经过 open_m3u_sources, 单个URL同样使用ETag/内容哈希缓存
+    """
+    if isinstance(source, (list, tuple)):
+        return open_m3u_sources(source)
+    if is_valid_url(source):
+        return open_m3u_sources([source])
+    lines = open_m3u_source(source)
+    return iter_m3u_entries(lines) if lines is not None else None
+
+def is_ipv6_url(url):
+    """检查是否是IPv6地址的URL"""
+    try:
+        host = urlparse(url).netloc.split(':')[0]
+        # 检查是否包含IPv6的特征（多个冒号）
+        return ':' in host or any(c in host for c in '[]')
+    except:
+        return False
+
+# 探测结果缓存配置
+PROBE_CACHE_FILE = 'probe_cache.db'  # 保存在输出目录中
+PROBE_CACHE_OK_TTL = 12 * 3600     # 可用结果的有效期(秒)
+PROBE_CACHE_FAIL_TTL = 2 * 3600    # 不可用结果的有效期(秒)
+PROBE_CACHE_COMMIT_EVERY = 500     # 每写入多少条结果提交一次
+
+def normalize_url(url):
+    """规范化URL: 协议和主机名小写, 去掉默认端口和片段"""
+    try:
+        parsed = urlparse(url.strip())
+        scheme = parsed.scheme.lower()
+        host = (parsed.hostname or '').lower()
+        if ':' in host:
+            host = f'[{host}]'
+        port = parsed.port
+        if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+            host = f'{host}:{port}'
+        if parsed.username or parsed.password:
+            host = f'{parsed.netloc.rsplit("@", 1)[0]}@{host}'
+        path = parsed.path or '/'
+        return f"{scheme}://{host}{path}" + (f"?{parsed.query}" if parsed.query else '')
+    except ValueError:
+        return url.strip()
+
+class ProbeCache:
+    """基于SQLite的探测结果缓存, 按规范化URL保存最近一次的检测结果
+
+    可用和不可用的结果分别使用不同的有效期, 过期的结果需要重新检测
+    """
+
+    def __init__(self, path, ok_ttl=PROBE_CACHE_OK_TTL, fail_ttl=PROBE_CACHE_FAIL_TTL):
+        import sqlite3
+        self.ok_ttl = ok_ttl
+        self.fail_ttl = fail_ttl
+        self.hits = 0
+        self._uncommitted = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS probe_results ('
+            'url TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT, '
+            'response_time REAL, status_code INTEGER, content_type TEXT, '
+            'checked_at REAL NOT NULL, ipv6 INTEGER, container TEXT, timings TEXT, video TEXT)'
+        )
+        # 兼容旧版本创建的缓存文件
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(probe_results)')}
+        for column, column_type in (('ipv6', 'INTEGER'), ('container', 'TEXT'), ('timings', 'TEXT'),
+                                    ('video', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE probe_results ADD COLUMN {column} {column_type}')
+        self.conn.commit()
+
+    def get(self, url):
+        """返回未过期的缓存结果, 没有或已过期时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, error, response_time, status_code, content_type, checked_at, ipv6, container, '
+                'video FROM probe_results WHERE url = ?', (normalize_url(url),)
+            ).fetchone()
+            if row is None:
+                return None
+            status, error, response_time, status_code, content_type, checked_at, ipv6, container, video = row
+            ttl = self.ok_ttl if status == 'ok' else self.fail_ttl
+            if time.time() - checked_at > ttl:
+                return None
+            # 多个检测线程同时查询, 计数也在锁内更新
+            self.hits += 1
+
+        if status == 'ok':
+            result = {
+                'status': 'ok',
+                'response_time': f"{response_time or 0:.2f}秒",
+                'elapsed': response_time,
+                'status_code': status_code,
+                'content_type': content_type,
+                'container': container,
+                'cached': True
+            }
+            if video:
+                import json
+                result['video'] = json.loads(video)
+        else:
+            result = {
+                'status': 'fail',
+                'error': error,
+                'cached': True
+            }
+            if status_code is not None:
+                result['status_code'] = status_code
+        if ipv6 is not None:
+            result['ipv6'] = bool(ipv6)
+        return result
+
+    def put(self, url, result):
+        """保存一条新的检测结果, 分阶段耗时和视频参数以JSON保存"""
+        import json
+        timings = json.dumps(result['timings']) if result.get('timings') else None
+        video = json.dumps(result['video']) if result.get('video') else None
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO probe_results '
+                '(url, status, error, response_time, status_code, content_type, checked_at, ipv6, container, '
+                'timings, video) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (normalize_url(url), result['status'], result.get('error'), result.get('elapsed'),
+                 result.get('status_code'), result.get('content_type'), time.time(), result.get('ipv6'),
+                 result.get('container'), timings, video)
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= PROBE_CACHE_COMMIT_EVERY:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+# 检测历史配置
+HISTORY_FILE = 'probe_history.db'
+HISTORY_HALF_LIFE = 7 * 86400      # 滚动统计中旧结果的权重每隔该时间(秒)减半
+HISTORY_LATENCY_SCALE = 2.0        # 中位耗时为该值(秒)时可靠性得分减半
+HISTORY_LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)  # 耗时直方图上界(秒)
+HISTORY_COMMIT_EVERY = 1000
+HISTORY_DIFF_FILE = 'history_diff.json'
+HISTORY_REPORT_FILE = 'history_report.json'
+
+def _histogram_percentile(counts, fraction):
+    """根据直方图估计分位数(桶内线性插值), 没有数据时返回None"""
+    total = sum(counts)
+    if total <= 0:
+        return None
+    target = total * fraction
+    cumulative = 0.0
+    lower = 0.0
+    for upper, count in zip(HISTORY_LATENCY_BUCKETS + (HISTORY_LATENCY_BUCKETS[-1] * 2,), counts):
+        if count > 0 and cumulative + count >= target:
+            return lower + (upper - lower) * (target - cumulative) / count
+        cumulative += count
+        lower = upper
+    return lower
+
+def _pack_histogram(counts):
+    """耗时直方图以float32数组保存, 比JSON更紧凑, 读取时也不需要解析"""
+    import array
+    return array.array('f', counts).tobytes()
+
+def _unpack_histogram(blob):
+    import array
+    counts = array.array('f')
+    counts.frombytes(blob)
+    return counts
+
+def reliability_score(weight, ok_weight, latency):
+    """可靠性得分: 平滑后的可用率, 按中位耗时打折; 检测次数少时向0.5收缩"""
+    uptime = (ok_weight + 1) / (weight + 2)
+    p50 = _histogram_percentile(latency, 0.5) if latency else None
+    return uptime / (1 + (p50 or 0) / HISTORY_LATENCY_SCALE)
+
+class ProbeHistory:
+    """只追加的检测历史, 保存在SQLite中
+
+    probes 表只追加地保存每一次检测的结果和耗时, (URL编号, 时间) 上的覆盖索引使
+    查询单个链接任意时间段的历史只需读取该链接的索引项; stream_stats 表为每个链接维护按
+    HISTORY_HALF_LIFE 指数衰减的可用率和耗时直方图, 每次检测O(1)更新,
+    计算得分、排序和按主机汇总时不需要扫描全部历史
+    """
+
+    def __init__(self, path=HISTORY_FILE, source=None):
+        import sqlite3
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS urls ('
+            'id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, host TEXT NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS urls_host ON urls (host);'
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'id INTEGER PRIMARY KEY, started_at REAL NOT NULL, source TEXT);'
+            'CREATE TABLE IF NOT EXISTS probes ('
+            'id INTEGER PRIMARY KEY, url_id INTEGER NOT NULL, checked_at INTEGER NOT NULL, '
+            'run_id INTEGER NOT NULL, ok INTEGER NOT NULL, latency_ms INTEGER);'
+            'CREATE INDEX IF NOT EXISTS probes_url ON probes (url_id, checked_at, ok, latency_ms);'
+            'CREATE TABLE IF NOT EXISTS stream_stats ('
+            'url_id INTEGER PRIMARY KEY, updated_at REAL NOT NULL, weight REAL NOT NULL, '
+            'ok_weight REAL NOT NULL, latency BLOB, probes INTEGER NOT NULL, '
+            'last_ok INTEGER, last_run INTEGER);'
+        )
+        self.source = source if isinstance(source, str) or source is None else ' '.join(source)
+        self.run_id = None      # 第一次记录时创建, 只查询时不产生空的运行记录
+        self.became_working = []
+        self.became_failing = []
+        self.recorded = 0
+        self._uncommitted = 0
+
+    def _url_id(self, url):
+        key = normalize_url(url)
+        row = self.conn.execute('SELECT id FROM urls WHERE url = ?', (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.conn.execute('INSERT INTO urls (url, host) VALUES (?, ?)',
+                                 (key, get_url_origin(url))).lastrowid
+
+    def record(self, entry, result):
+        """追加一次检测结果, 更新滚动统计, 并记下相对上一次检测的状态变化"""
+        now = time.time()
+        ok = result['status'] == 'ok'
+        latency = (result.get('timings') or {}).get('total') or result.get('elapsed')
+        with self.lock:
+            if self.run_id is None:
+                self.run_id = self.conn.execute('INSERT INTO runs (started_at, source) VALUES (?, ?)',
+                                                (now, self.source)).lastrowid
+            url_id = self._url_id(entry.url)
+            self.conn.execute(
+                'INSERT INTO probes (url_id, checked_at, run_id, ok, latency_ms) VALUES (?, ?, ?, ?, ?)',
+                (url_id, int(now * 1000), self.run_id, int(ok), int(latency * 1000) if latency is not None else None)
+            )
+            row = self.conn.execute(
+                'SELECT updated_at, weight, ok_weight, latency, probes, last_ok FROM stream_stats WHERE url_id = ?',
+                (url_id,)
+            ).fetchone()
+            if row is None:
+                weight = ok_weight = 0.0
+                counts = [0.0] * (len(HISTORY_LATENCY_BUCKETS) + 1)
+                probes = 0
+                last_ok = None
+            else:
+                updated_at, weight, ok_weight, counts, probes, last_ok = row
+                decay = 0.5 ** (max(0.0, now - updated_at) / HISTORY_HALF_LIFE)
+                weight *= decay
+                ok_weight *= decay
+                counts = [count * decay for count in _unpack_histogram(counts)]
+            weight += 1
+            if ok:
+                ok_weight += 1
+                if latency is not None:
+                    bucket = next((i for i, upper in enumerate(HISTORY_LATENCY_BUCKETS) if latency <= upper),
+                                  len(HISTORY_LATENCY_BUCKETS))
+                    counts[bucket] += 1
+            self.conn.execute(
+                'INSERT OR REPLACE INTO stream_stats '
+                '(url_id, updated_at, weight, ok_weight, latency, probes, last_ok, last_run) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url_id, now, weight, ok_weight, _pack_histogram(counts),
+                 probes + 1, int(ok), self.run_id)
+            )
+            if last_ok is not None and bool(last_ok) != ok:
+                (self.became_working if ok else self.became_failing).append((entry.extinf, entry.url))
+            self.recorded += 1
+            self._uncommitted += 1
+            if self._uncommitted >= HISTORY_COMMIT_EVERY:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def scores(self):
+        """返回 {规范化URL: 可靠性得分}"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT urls.url, stream_stats.weight, stream_stats.ok_weight, stream_stats.latency '
+                'FROM stream_stats JOIN urls ON urls.id = stream_stats.url_id'
+            ).fetchall()
+        return {url: reliability_score(weight, ok_weight, _unpack_histogram(latency))
+                for url, weight, ok_weight, latency in rows}
+
+    def stream_report(self, url, since=None):
+        """按原始记录计算单个链接在 since(时间戳)之后的可用率和耗时分位数"""
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM urls WHERE url = ?', (normalize_url(url),)).fetchone()
+            if row is None:
+                return None
+            rows = self.conn.execute(
+                'SELECT ok, latency_ms FROM probes WHERE url_id = ? AND checked_at >= ?',
+                (row[0], int((since or 0) * 1000))
+            ).fetchall()
+        if not rows:
+            return None
+        latencies = sorted(latency for ok, latency in rows if ok and latency is not None)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] / 1000
+
+        return {
+            'probes': len(rows),
+            'uptime': sum(ok for ok, _ in rows) / len(rows),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+        }
+
+    def host_stats(self):
+        """按主机汇总滚动统计, 返回按可用率从低到高排列的列表"""
+        hosts = {}
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT urls.host, stream_stats.weight, stream_stats.ok_weight, stream_stats.latency '
+                'FROM stream_stats JOIN urls ON urls.id = stream_stats.url_id'
+            ).fetchall()
+        for host, weight, ok_weight, latency in rows:
+            stats = hosts.get(host)
+            if stats is None:
+                stats = hosts[host] = {'host': host, 'streams': 0, 'weight': 0.0, 'ok_weight': 0.0,
+                                       'latency': [0.0] * (len(HISTORY_LATENCY_BUCKETS) + 1)}
+            stats['streams'] += 1
+            stats['weight'] += weight
+            stats['ok_weight'] += ok_weight
+            stats['latency'] = [a + b for a, b in zip(stats['latency'], _unpack_histogram(latency))]
+        report = []
+        for stats in hosts.values():
+            report.append({
+                'host': stats['host'],
+                'streams': stats['streams'],
+                'uptime': round(stats['ok_weight'] / stats['weight'], 4) if stats['weight'] else None,
+                'p50': _histogram_percentile(stats['latency'], 0.5),
+                'p95': _histogram_percentile(stats['latency'], 0.95),
+            })
+        report.sort(key=lambda item: (item['uptime'] if item['uptime'] is not None else 1, -item['streams']))
+        return report
+
+    def write_reports(self, output_dir):
+        """输出本次相对上一次检测的状态变化和按主机汇总的统计"""
+        import json
+        with open(os.path.join(output_dir, HISTORY_DIFF_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'run': self.run_id,
+                'became_working': [url for _, url in self.became_working],
+                'became_failing': [url for _, url in self.became_failing],
+            }, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(output_dir, HISTORY_REPORT_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'run': self.run_id, 'hosts': self.host_stats()}, f, ensure_ascii=False, indent=2)
+
+    def summary(self):
+        return (f"记录 {self.recorded} 次检测, 相比上次检测变为可用 {len(self.became_working)} 个, "
+                f"变为不可用 {len(self.became_failing)} 个")
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+HOST_BREAKER_THRESHOLD = 5  # 同一主机连续连接失败/超时达到该次数后熔断
+
+def get_url_host(url):
+    """获取URL中的主机名(小写)"""
+    try:
+        return (urlparse(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+def dns_failure_result(host):
+    """域名解析失败时的检测结果"""
+    return {
+        'status': 'fail',
+        'error': f'域名解析失败: {host}'
+    }
+
+def get_url_origin(url):
+    """获取URL的 主机:端口 (小写), 用于按源站统计"""
+    try:
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+        port = parsed.port or (443 if parsed.scheme.lower() == 'https' else 80)
+    except ValueError:
+        return ''
+    return f'[{host}]:{port}' if ':' in host else f'{host}:{port}'
+
+class HostCircuitBreaker:
+    """主机熔断器
+
+    同一主机(主机:端口)连续出现连接错误或超时达到阈值后, 该主机剩余的
+    链接不再检测, 直接记为不可用。收到任何HTTP响应都会清零计数
+    """
+
+    TRIP_ERRORS = ('连接超时', '连接错误')
+
+    def __init__(self, threshold=HOST_BREAKER_THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.open_hosts = set()
+        self.skipped = 0
+
+    def check(self, host):
+        """主机已熔断时返回失败结果, 否则返回None"""
+        with self.lock:
+            if host not in self.open_hosts:
+                return None
+            self.skipped += 1
+        return {
+            'status': 'fail',
+            'error': f'主机熔断: 连续{self.threshold}次连接失败, 未检测',
+            'skipped': True
+        }
+
+    def record(self, host, result):
+        """记录一次真实检测的结果"""
+        error = result.get('error') or ''
+        with self.lock:
+            if result['status'] == 'fail' and error.startswith(self.TRIP_ERRORS):
+                count = self.failures.get(host, 0) + 1
+                self.failures[host] = count
+                if count >= self.threshold:
+                    self.open_hosts.add(host)
+            else:
+                self.failures.pop(host, None)
+
+# 自适应超时配置
+ADAPTIVE_MIN_TIMEOUT = 1.0     # 超时下限(秒), 避免局域网主机上的正常抖动被判为超时
+ADAPTIVE_MAX_TIMEOUT = 15.0    # 超时上限(秒), 重试时的超时也不超过该值
+ADAPTIVE_RTTVAR_K = 4          # 超时 = SRTT + K * RTTVAR (与TCP的RTO计算相同)
+RETRY_BUDGET_RATIO = 0.1       # 因超时失败的重试次数不超过已探测数量的该比例
+RETRY_BUDGET_MIN = 20          # 探测数量较少时也至少允许的重试次数
+
+class AdaptiveTimeouts:
+    """按主机(主机:端口)估计响应时间并计算探测超时
+
+    与TCP的RTO计算相同(RFC 6298): 每次成功收到响应后用本次探测中最长的一次
+    等待(TCP连接/TLS握手/首字节/首个数据)更新平滑值SRTT和偏差RTTVAR,
+    超时取 SRTT + K * RTTVAR 并限制在上下限之间。没有样本的主机使用默认超时
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, default=PROBE_TIMEOUT, minimum=ADAPTIVE_MIN_TIMEOUT, maximum=ADAPTIVE_MAX_TIMEOUT):
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.lock = threading.Lock()
+        self.estimates = {}  # 主机 -> [SRTT, RTTVAR, 样本数]
+
+    def timeout_for(self, host):
+        """返回该主机下一次探测使用的超时(秒)"""
+        with self.lock:
+            estimate = self.estimates.get(host)
+        if estimate is None:
+            return self.default
+        srtt, rttvar, _ = estimate
+        return min(self.maximum, max(self.minimum, srtt + ADAPTIVE_RTTVAR_K * rttvar))
+
+    def observe(self, host, result):
+        """用一次收到了HTTP响应的探测更新该主机的估计值"""
+        timings = result.get('timings')
+        if not timings or timings.get('ttfb') is None:
+            return
+        sample = max(timings.get(phase) or 0 for phase in ('connect', 'tls', 'ttfb', 'first_byte'))
+        with self.lock:
+            estimate = self.estimates.get(host)
+            if estimate is None:
+                self.estimates[host] = [sample, sample / 2, 1]
+                return
+            srtt, rttvar, samples = estimate
+            rttvar = (1 - self.BETA) * rttvar + self.BETA * abs(srtt - sample)
+            srtt = (1 - self.ALPHA) * srtt + self.ALPHA * sample
+            self.estimates[host] = [srtt, rttvar, samples + 1]
+
+    def retry_timeout(self, timeout):
+        """超时后重试使用的超时: 与TCP的退避相同翻倍"""
+        return min(self.maximum, timeout * 2)
+
+    def to_dict(self):
+        return {host: {'srtt': round(srtt, 6), 'rttvar': round(rttvar, 6), 'samples': samples,
+                       'timeout': round(self.timeout_for(host), 3)}
+                for host, (srtt, rttvar, samples) in sorted(self.estimates.items())}
+
+    def summary(self):
+        if not self.estimates:
+            return f"没有可用的样本, 全部使用默认超时 {self.default} 秒"
+        timeouts = [self.timeout_for(host) for host in self.estimates]
+        return (f"{len(timeouts)} 个主机, 超时 {min(timeouts):.1f}-{max(timeouts):.1f} 秒 "
+                f"(未知主机 {self.default} 秒)")
+
+class RetryBudget:
+    """全局重试预算: 只有超时导致的失败可以重试, 总次数按探测数量的比例限制"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.lock = threading.Lock()
+        self.probes = 0
+        self.used = 0
+        self.recovered = 0
+
+    @staticmethod
+    def should_retry(result):
+        return result['status'] == 'fail' and result.get('error') == '连接超时'
+
+    def record_probe(self):
+        with self.lock:
+            self.probes += 1
+
+    def try_acquire(self):
+        """预算未用完时占用一次重试"""
+        with self.lock:
+            if self.used >= self.minimum + self.ratio * self.probes:
+                return False
+            self.used += 1
+            return True
+
+    def record_retry(self, result):
+        if result['status'] == 'ok':
+            with self.lock:
+                self.recovered += 1
+
+    def summary(self):
+        return f"超时重试 {self.used} 次 (预算上限 {self.minimum} + {self.ratio:.0%}), 重试后可用 {self.recovered} 个"
+
+# 按源站的自适应并发控制配置(AIMD)
+AIMD_INITIAL_WINDOW = 2        # 每个源站的初始并发窗口
+AIMD_DECREASE = 0.5            # 出现限流信号时窗口乘以该系数
+AIMD_COOLDOWN = 1.0            # 同一源站两次缩小窗口的最短间隔(秒), 同一波限流只缩小一次
+AIMD_SPIKE_FACTOR = 4          # 首字节耗时超过平滑值的该倍数视为延迟突增
+AIMD_SPIKE_MIN = 0.2           # 低于该耗时(秒)的波动不算延迟突增
+AIMD_SPIKE_MIN_SAMPLES = 5     # 至少有这么多样本后才判断延迟突增
+AIMD_THROTTLE_RETRIES = 2      # 被限流(429/503/连接重置)的链接缩小窗口后重新探测的次数
+AIMD_BACKOFF = 1.0             # 重新探测前的等待时间(秒), 按次数递增
+
+AIMD_EVENT_LABELS = {'http_429': 'HTTP 429', 'http_503': 'HTTP 503', 'reset': '连接重置', 'latency': '延迟突增'}
+AIMD_RETRY_EVENTS = ('http_429', 'http_503', 'reset')
+
+class _AimdState:
+    __slots__ = ('window', 'ssthresh', 'in_flight', 'latency', 'samples', 'last_cut', 'events')
+
+    def __init__(self, window, ssthresh):
+        self.window = window
+        self.ssthresh = ssthresh
+        self.in_flight = 0
+        self.latency = None     # 首字节耗时的平滑值
+        self.samples = 0
+        self.last_cut = 0.0
+        self.events = Counter()
+
+class AimdLimiter:
+    """按源站(主机:端口)的自适应并发窗口, 与TCP拥塞控制相同的加性增、乘性减
+
+    每个源站从较小的窗口开始, 未出现限流前每次成功窗口加1(慢启动),
+    出现过限流后每次成功只增加 1/窗口; 遇到429、503、连接重置或延迟突增时
+    窗口减半。线程引擎在提交任务前用try_acquire占用名额(线程不在窗口上等待),
+    异步引擎使用AsyncAimdLimiter
+    """
+
+    def __init__(self, maximum=ASYNC_PER_HOST_LIMIT, initial=AIMD_INITIAL_WINDOW):
+        self.maximum = maximum
+        self.initial = min(initial, maximum)
+        self.cond = threading.Condition()
+        self.states = {}
+
+    def _state(self, origin):
+        state = self.states.get(origin)
+        if state is None:
+            state = self.states[origin] = _AimdState(self.initial, self.maximum)
+        return state
+
+    def try_acquire(self, origin):
+        """该源站的并发数低于窗口时占用一个名额并返回True, 否则立即返回False"""
+        with self.cond:
+            state = self._state(origin)
+            if state.in_flight >= int(state.window):
+                return False
+            state.in_flight += 1
+            return True
+
+    def release(self, origin, result):
+        """结束一次探测并调整窗口, 返回限流事件(没有时为None)
+
+        result 为None表示探测异常中止, 只释放并发名额
+        """
+        with self.cond:
+            state = self._state(origin)
+            state.in_flight -= 1
+            event = self._update(state, result)
+            self.cond.notify_all()
+        return event
+
+    @staticmethod
+    def _throttle_event(state, result):
+        status_code = result.get('status_code')
+        if status_code == 429:
+            return 'http_429'
+        if status_code == 503:
+            return 'http_503'
+        if result.get('reset'):
+            return 'reset'
+        ttfb = (result.get('timings') or {}).get('ttfb')
+        if (ttfb is not None and state.samples >= AIMD_SPIKE_MIN_SAMPLES
+                and ttfb > AIMD_SPIKE_MIN and ttfb > AIMD_SPIKE_FACTOR * state.latency):
+            return 'latency'
+        return None
+
+    def _update(self, state, result):
+        if result is None:
+            # 探测异常中止, 只释放并发名额
+            return None
+        event = self._throttle_event(state, result)
+        ttfb = (result.get('timings') or {}).get('ttfb')
+        if ttfb is not None and event != 'latency':
+            state.latency = ttfb if state.latency is None else state.latency * 7 / 8 + ttfb / 8
+            state.samples += 1
+
+        if event is not None:
+            state.events[event] += 1
+            now = time.monotonic()
+            if now - state.last_cut >= max(AIMD_COOLDOWN, state.latency or 0):
+                state.window = max(1.0, state.window * AIMD_DECREASE)
+                state.ssthresh = state.window
+                state.last_cut = now
+        elif ttfb is not None:
+            # 收到了正常的HTTP响应才增大窗口, 连接失败/超时不影响窗口
+            if state.window < state.ssthresh:
+                state.window += 1
+            else:
+                state.window += 1 / state.window
+            state.window = min(state.window, self.maximum)
+        return event
+
+    def throttled_hosts(self):
+        """出现过限流事件的源站, 按事件数从多到少"""
+        hosts = [(origin, state) for origin, state in self.states.items() if state.events]
+        return sorted(hosts, key=lambda item: sum(item[1].events.values()), reverse=True)
+
+    def summary(self, limit=10):
+        """各源站最终窗口和限流事件, 只列出事件最多的limit个源站"""
+        totals = Counter()
+        for state in self.states.values():
+            totals.update(state.events)
+        throttled = self.throttled_hosts()
+        lines = [f"{len(self.states)} 个源站, {len(throttled)} 个出现限流信号"
+                 + (f" ({', '.join(f'{AIMD_EVENT_LABELS[k]} {v} 次' for k, v in totals.items())})" if totals else '')]
+        for origin, state in throttled[:limit]:
+            events = ', '.join(f"{AIMD_EVENT_LABELS[k]} {v} 次" for k, v in state.events.items())
+            lines.append(f"  {origin}: 最终窗口 {int(state.window)}, {events}")
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {origin: {'window': round(state.window, 2), 'events': dict(state.events)}
+                for origin, state in sorted(self.states.items())}
+
+class AsyncAimdLimiter(AimdLimiter):
+    """异步引擎使用的AimdLimiter, 每个源站一个asyncio.Condition
+
+    Condition绑定创建它的事件循环, 换到新的事件循环(多次asyncio.run)时重新创建,
+    各源站已调整的窗口保留
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.conditions = {}
+        self._loop = None
+
+    def _condition(self, origin):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self.conditions = {}
+        cond = self.conditions.get(origin)
+        if cond is None:
+            cond = self.conditions[origin] = asyncio.Condition()
+        return cond
+
+    async def acquire(self, origin):
+        cond = self._condition(origin)
+        state = self._state(origin)
+        async with cond:
+            await cond.wait_for(lambda: state.in_flight < int(state.window))
+            state.in_flight += 1
+
+    async def release(self, origin, result):
+        state = self._state(origin)
+        state.in_flight -= 1
+        event = self._update(state, result)
+        cond = self._condition(origin)
+        async with cond:
+            cond.notify_all()
+        return event
+
+class StreamResultWriter:
+    """边检测边把结果追加到输出文件, 结束时按数量重命名为最终文件名
+
+    检测过程中写入 *.m3u.part 临时文件, 每条结果立即落盘,
+    程序中途退出时已完成的结果仍保留在临时文件中
+    """
+
+    def __init__(self, output_dir, low_quality=False):
+        self.output_dir = output_dir
+        self.files = {}
+        self.counts = {}
+        # low_quality为True时可用但分辨率低于要求的条目单独写入 *_低画质_N个.m3u
+        kinds = ('可用', '不可用', '低画质') if low_quality else ('可用', '不可用')
+        for prefix in ('全部', 'IPv4', 'IPv6'):
+            for kind in kinds:
+                path = self._part_path(prefix, kind)
+                f = open(path, 'w', encoding='utf-8', buffering=1)
+                f.write("#EXTM3U\n")
+                self.files[(prefix, kind)] = f
+                self.counts[(prefix, kind)] = 0
+
+    def _part_path(self, prefix, kind):
+        return os.path.join(self.output_dir, f"{prefix}_{kind}.m3u.part")
+
+    def write(self, extinf, url, is_ipv6, ok, low_quality=False):
+        """写入一条检测结果"""
+        kind = ('低画质' if low_quality else '可用') if ok else '不可用'
+        text = f"{extinf}\n{url}\n" if extinf else f"{url}\n"
+        for prefix in ('全部', 'IPv6' if is_ipv6 else 'IPv4'):
+            self.files[(prefix, kind)].write(text)
+            self.counts[(prefix, kind)] += 1
+
+    def total(self, prefix):
+        return sum(count for (p, _), count in self.counts.items() if p == prefix)
+
+    @staticmethod
+    def _reorder(path, scores, heights=None):
+        """按得分从高到低重新排列文件中的条目, 没有得分的条目排在最后
+
+        提供 heights({规范化URL: 视频高度}) 时先按分辨率从高到低, 同分辨率内再按得分
+        """
+        scores = scores or {}
+        heights = heights or {}
+        entries = []
+        extinf = None
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('#EXTINF'):
+                    extinf = line
+                elif line and not line.startswith('#'):
+                    entries.append((extinf, line))
+                    extinf = None
+        def sort_key(item):
+            key = normalize_url(item[1])
+            return -heights.get(key, 0), -scores.get(key, 0.0)
+        entries.sort(key=sort_key)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("#EXTM3U\n")
+            for extinf, url in entries:
+                f.write(f"{extinf}\n{url}\n" if extinf else f"{url}\n")
+
+    def finalize(self, scores=None, heights=None):
+        """关闭临时文件并重命名为 *_可用_N个.m3u, 没有条目的IPv4/IPv6文件不保留
+
+        提供 scores({规范化URL: 得分}) 时可用列表按得分从高到低排列,
+        提供 heights 时先按分辨率排列
+        """
+        for f in self.files.values():
+            f.close()
+        for (prefix, kind), count in self.counts.items():
+            part_path = self._part_path(prefix, kind)
+            if prefix != '全部' and self.total(prefix) == 0:
+                os.remove(part_path)
+                continue
+            if (scores or heights) and kind == '可用':
+                self._reorder(part_path, scores, heights)
+            os.replace(part_path, os.path.join(self.output_dir, f"{prefix}_{kind}_{count}个.m3u"))
+
+# 耗时统计配置
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # 直方图上界(秒)
+METRICS_JSON_FILE = 'probe_metrics.json'
+METRICS_PROM_FILE = 'probe_metrics.prom'
+TIMING_LABELS = {'dns': 'DNS解析', 'connect': 'TCP连接', 'tls': 'TLS握手', 'ttfb': '首字节',
+                 'first_byte': '首个数据', 'total': '总耗时'}
+
+class _ProbeStats:
+    """一组探测(一个主机或一种地址族)的计数和各阶段耗时直方图"""
+
+    __slots__ = ('probes', 'ok', 'bytes', 'phases')
+
+    def __init__(self):
+        self.probes = 0
+        self.ok = 0
+        self.bytes = 0
+        # 阶段 -> [各区间计数..., 超出最大上界的计数, 总和, 次数]
+        self.phases = {}
+
+    def observe(self, result, timings):
+        self.probes += 1
+        if result['status'] == 'ok':
+            self.ok += 1
+        self.bytes += timings.get('bytes') or 0
+        for phase in TIMING_PHASES:
+            seconds = timings.get(phase)
+            if seconds is None:
+                continue
+            hist = self.phases.get(phase)
+            if hist is None:
+                hist = self.phases[phase] = [0] * (len(METRICS_BUCKETS) + 3)
+            i = 0
+            while i < len(METRICS_BUCKETS) and seconds > METRICS_BUCKETS[i]:
+                i += 1
+            hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def quantile(self, phase, q):
+        """根据直方图估算分位数(取所在区间的上界)"""
+        hist = self.phases.get(phase)
+        if not hist or not hist[-1]:
+            return None
+        rank = q * hist[-1]
+        seen = 0
+        for i, bound in enumerate(METRICS_BUCKETS):
+            seen += hist[i]
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        phases = {}
+        for phase, hist in self.phases.items():
+            p99 = self.quantile(phase, 0.99)
+            phases[phase] = {
+                'count': hist[-1],
+                'sum': round(hist[-2], 6),
+                'avg': round(hist[-2] / hist[-1], 6),
+                'p50': self.quantile(phase, 0.5),
+                'p90': self.quantile(phase, 0.9),
+                'p99': None if p99 == float('inf') else p99,
+                'buckets': hist[:len(METRICS_BUCKETS) + 1],
+            }
+        return {'probes': self.probes, 'ok': self.ok, 'fail': self.probes - self.ok,
+                'bytes': self.bytes, 'phases': phases}
+
+def _prom_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class ProbeMetrics:
+    """汇总每次实际探测的分阶段耗时, 按主机和地址族输出直方图
+
+    缓存命中、重复链接和熔断跳过的条目没有发生网络请求, 不计入统计
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self.hosts = {}
+        self.started_at = time.time()
+
+    def record(self, url, result):
+        timings = result.get('timings')
+        if timings is None:
+            return
+        family = 'ipv6' if result.get('ipv6') else 'ipv4'
+        host = get_url_origin(url)
+        with self.lock:
+            for groups, key in ((self.families, family), (self.hosts, host)):
+                stats = groups.get(key)
+                if stats is None:
+                    stats = groups[key] = _ProbeStats()
+                stats.observe(result, timings)
+
+    def summary(self):
+        """各阶段的总耗时和平均耗时, 用于找出扫描时间花在哪里"""
+        totals = {}
+        for stats in self.families.values():
+            for phase, hist in stats.phases.items():
+                spent, count = totals.get(phase, (0, 0))
+                totals[phase] = (spent + hist[-2], count + hist[-1])
+        parts = [f"{TIMING_LABELS[phase]} 平均 {totals[phase][0] / totals[phase][1] * 1000:.0f}ms"
+                 for phase in TIMING_PHASES if totals.get(phase, (0, 0))[1]]
+        return ', '.join(parts) if parts else '没有实际探测'
+
+    def to_dict(self):
+        # 主机按总耗时从高到低排列, 拖慢扫描的上游排在前面
+        def total_time(item):
+            hist = item[1].phases.get('total')
+            return hist[-2] if hist else 0
+        hosts = sorted(self.hosts.items(), key=total_time, reverse=True)
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'buckets': list(METRICS_BUCKETS),
+            'families': {family: stats.to_dict() for family, stats in sorted(self.families.items())},
+            'hosts': {host: stats.to_dict() for host, stats in hosts},
+        }
+
+    def write_json(self, path, extra=None):
+        """写入JSON报告, extra中的内容(如各主机的超时)一并写入"""
+        import json
+        report = self.to_dict()
+        report.update(extra or {})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def _prom_lines(self, name, label, groups):
+        yield f"# HELP {name} Probe phase duration in seconds"
+        yield f"# TYPE {name} histogram"
+        for key, stats in sorted(groups.items()):
+            for phase, hist in stats.phases.items():
+                labels = f'{label}="{_prom_label(key)}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(METRICS_BUCKETS, hist):
+                    cumulative += count
+                    yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                yield f'{name}_bucket{{{labels},le="+Inf"}} {hist[-1]}'
+                yield f'{name}_sum{{{labels}}} {hist[-2]:.6f}'
+                yield f'{name}_count{{{labels}}} {hist[-1]}'
+
+    def write_prometheus(self, path):
+        """写入Prometheus文本格式(可供node_exporter的textfile收集器读取)"""
+        lines = []
+        lines += self._prom_lines('iptv_probe_phase_seconds', 'family', self.families)
+        lines += self._prom_lines('iptv_host_probe_phase_seconds', 'host', self.hosts)
+        lines.append("# HELP iptv_probes_total Probes performed")
+        lines.append("# TYPE iptv_probes_total counter")
+        for family, stats in sorted(self.families.items()):
+            lines.append(f'iptv_probes_total{{family="{family}",status="ok"}} {stats.ok}')
+            lines.append(f'iptv_probes_total{{family="{family}",status="fail"}} {stats.probes - stats.ok}')
+        lines.append("# HELP iptv_probe_bytes_total Payload bytes read by probes")
+        lines.append("# TYPE iptv_probe_bytes_total counter")
+        for family, stats in sorted(self.families.items()):
+            lines.append(f'iptv_probe_bytes_total{{family="{family}"}} {stats.bytes}')
+        # 先写临时文件再替换, 收集器不会读到写了一半的文件
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+# 持续速率测量配置
+MEASURE_WINDOW = 3.0                   # 每个流读取的时长(秒)
+MEASURE_MAX_BYTES = 8 * 1024 * 1024    # 或读满该字节数即停止
+MEASURE_CONCURRENCY = 20               # 同时测量的流数量
+MEASURE_PER_HOST = 4                   # 同一主机同时测量的流数量
+MEASURE_BANDWIDTH_CAP = 100            # 全局带宽上限(Mbps), 0表示不限制
+MEASURE_STALL_GAP = 0.5                # 两段数据之间的等待超过该时间(秒)记为一次卡顿
+MEASURE_CHUNK_SIZE = 64 * 1024
+MEASURE_PLAYLIST_LIMIT = 1024 * 1024   # HLS播放列表最多读取的字节数
+MEASURE_REPORT_FILE = 'throughput.json'
+
+class BandwidthLimiter:
+    """所有测量共用的令牌桶, 限制总下载速率(字节/秒)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def consume(self, size):
+        """消耗size字节的令牌, 不足时等待, 返回等待的时间"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+class _MeasureState:
+    """一次测量的累计值, 跨越HLS的多个分片"""
+
+    __slots__ = ('start', 'deadline', 'max_bytes', 'bytes', 'stalls', 'first_payload', 'throttled')
+
+    def __init__(self, window, max_bytes):
+        self.start = time.monotonic()
+        self.deadline = self.start + window
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stalls = 0
+        self.first_payload = None   # 收到第一段媒体数据的时间
+        self.throttled = 0.0        # 因全局带宽上限等待的时间, 较长时说明速率受到上限影响
+
+    def done(self):
+        return time.monotonic() >= self.deadline or self.bytes >= self.max_bytes
+
+def _parse_hls_playlist(text, base_url):
+    """解析HLS播放列表, 返回 ('master', 子播放列表URL列表) 或 ('media', 分片URL列表)"""
+    variants = []
+    segments = []
+    expect_variant = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-STREAM-INF'):
+            expect_variant = True
+        elif not line.startswith('#'):
+            (variants if expect_variant else segments).append(urljoin(base_url, line))
+            expect_variant = False
+    if variants:
+        return 'master', variants
+    return 'media', segments
+
+def _looks_like_hls(url, content_type, head):
+    return ('mpegurl' in (content_type or '').lower()
+            or urlparse(url).path.lower().endswith('.m3u8')
+            or head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'#EXTM3U'))
+
+async def _measure_body(response, state, bandwidth, first_chunk=b''):
+    """读取响应体直到测量窗口结束, 记录卡顿次数"""
+    chunk = first_chunk
+    while True:
+        if chunk:
+            if state.first_payload is None:
+                state.first_payload = time.monotonic()
+            state.bytes += len(chunk)
+            state.throttled += await bandwidth.consume(len(chunk))
+        if state.done():
+            return
+        wait_start = time.monotonic()
+        try:
+            timeout = max(0.1, min(PROBE_TIMEOUT, state.deadline - wait_start + MEASURE_STALL_GAP))
+            chunk = await response.read(MEASURE_CHUNK_SIZE, timeout, once=True)
+        except asyncio.TimeoutError:
+            state.stalls += 1
+            return
+        if time.monotonic() - wait_start > MEASURE_STALL_GAP and state.first_payload is not None:
+            state.stalls += 1
+        if not chunk:
+            return
+
+async def measure_stream(url, bandwidth, window=MEASURE_WINDOW, max_bytes=MEASURE_MAX_BYTES):
+    """持续读取一个流, 返回 持续速率(字节/秒)、首个数据耗时、卡顿次数
+
+    HLS流依次请求子播放列表和其中的分片, 按分片数据计算速率
+    """
+    headers = {'User-Agent': USER_AGENT, 'Accept': '*/*'}
+    state = _MeasureState(window, max_bytes)
+    hls = False
+    error = None
+    try:
+        response = await _async_open_stream(url, headers, PROBE_TIMEOUT)
+        try:
+            if response.status_code not in (200, 206):
+                raise AsyncProbeError(f'HTTP状态码错误: {response.status_code}')
+            head = await response.read(MEASURE_CHUNK_SIZE, PROBE_TIMEOUT, once=True)
+            hls = _looks_like_hls(url, response.headers.get('content-type'), head)
+            if hls:
+                playlist = head + await response.read(MEASURE_PLAYLIST_LIMIT - len(head), PROBE_TIMEOUT)
+            else:
+                await _measure_body(response, state, bandwidth, head)
+        finally:
+            response.close()
+
+        if hls:
+            playlist_url = url
+            kind, urls = _parse_hls_playlist(playlist.decode('utf-8', 'replace'), playlist_url)
+            # 主播放列表取第一个子播放列表, 最多跟随3层
+            for _ in range(3):
+                if kind == 'media':
+                    break
+                if not urls:
+                    raise AsyncProbeError('HLS播放列表中没有子播放列表')
+                playlist_url = urls[0]
+                response = await _async_open_stream(playlist_url, headers, PROBE_TIMEOUT)
+                try:
+                    playlist = await response.read(MEASURE_PLAYLIST_LIMIT, PROBE_TIMEOUT)
+                finally:
+                    response.close()
+                kind, urls = _parse_hls_playlist(playlist.decode('utf-8', 'replace'), playlist_url)
+            if kind != 'media' or not urls:
+                raise AsyncProbeError('HLS播放列表中没有分片')
+            for segment_url in urls:
+                response = await _async_open_stream(segment_url, headers, PROBE_TIMEOUT)
+                try:
+                    if response.status_code not in (200, 206):
+                        raise AsyncProbeError(f'HLS分片HTTP状态码错误: {response.status_code}')
+                    await _measure_body(response, state, bandwidth)
+                finally:
+                    response.close()
+                if state.done():
+                    break
+    except Exception as e:
+        error = _async_error_result(e)['error']
+
+    # 速率按收到第一段数据之后的实际时长计算, 不包含建立连接和等待首个数据的时间
+    active = time.monotonic() - state.first_payload if state.first_payload is not None else 0.0
+    return {
+        'bytes_per_sec': state.bytes / active if active > 0 else 0.0,
+        'ttfp': state.first_payload - state.start if state.first_payload is not None else None,
+        'stalls': state.stalls,
+        'bytes': state.bytes,
+        'throttled': round(state.throttled, 3),
+        'hls': hls,
+        'error': error,
+    }
+
+async def _measure_all(urls, on_result, window, max_bytes, bandwidth_cap, concurrency, per_host):
+    bandwidth = BandwidthLimiter(bandwidth_cap * 1000 * 1000 / 8)
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+
+    async def measure(url):
+        host = get_url_host(url)
+        host_limit = host_limits.get(host)
+        if host_limit is None:
+            host_limit = host_limits[host] = asyncio.Semaphore(per_host)
+        async with host_limit, limit:
+            result = await measure_stream(url, bandwidth, window, max_bytes)
+        on_result(url, result)
+
+    await asyncio.gather(*(measure(url) for url in urls))
+
+def measure_throughput(entries, output_dir, window=MEASURE_WINDOW, max_bytes=MEASURE_MAX_BYTES,
+                       bandwidth_cap=MEASURE_BANDWIDTH_CAP, concurrency=MEASURE_CONCURRENCY,
+                       per_host=MEASURE_PER_HOST):
+    """测量可用流的持续速率, 按速率从高到低输出排序列表和测量报告
+
+    entries 是 (EXTINF行, URL) 列表, 相同URL只测量一次。
+    bandwidth_cap 为全局带宽上限(Mbps), 0表示不限制; 同时测量的流的速率之和
+    超过上限时各流的测量值会偏低, 报告中的throttled记录了因此等待的时间
+    """
+    urls = list(dict.fromkeys(url for _, url in entries))
+    print(f"\n开始测量 {len(urls)} 个可用流的持续速率 (每个流 {window} 秒或 {max_bytes // (1024 * 1024)}MB, "
+          f"带宽上限 {bandwidth_cap or '不限'} Mbps)")
+    results = {}
+    start_time = time.time()
+
+    def on_result(url, result):
+        results[url] = result
+        print(f"\r测速进度: {len(results)}/{len(urls)}", end='')
+
+    asyncio.run(_measure_all(urls, on_result, window, max_bytes, bandwidth_cap, concurrency, per_host))
+
+    ranked = sorted(entries, key=lambda item: results[item[1]]['bytes_per_sec'], reverse=True)
+    output_file = os.path.join(output_dir, f"测速排序_{len(ranked)}个.m3u")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        for extinf, url in ranked:
+            if extinf:
+                f.write(f"{extinf}\n")
+            f.write(f"{url}\n")
+
+    import json
+    report = [dict(results[url], url=url) for url in sorted(urls, key=lambda u: results[u]['bytes_per_sec'],
+                                                            reverse=True)]
+    report_file = os.path.join(output_dir, MEASURE_REPORT_FILE)
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    rates = sorted(result['bytes_per_sec'] for result in results.values())
+    stalled = sum(1 for result in results.values() if result['stalls'])
+    median = rates[len(rates) // 2] * 8 / 1000 / 1000 if rates else 0
+    print(f"\n测速完成! 耗时 {time.time() - start_time:.1f} 秒")
+    print(f"速率中位数 {median:.2f} Mbps, {stalled} 个流出现卡顿")
+    print(f"按速率排序的列表: {output_file}")
+    print(f"测量报告: {report_file}")
+
+# 多进程分片配置
+SHARD_BATCH = 256             # 父进程每次发给工作进程的条目数量
+SHARD_QUEUE_BATCHES = 64       # 每个工作进程排队中的批次上限
+SHARD_RESULT_BATCH = 256       # 工作进程攒够该数量的结果后发回父进程
+SHARD_FLUSH_INTERVAL = 0.2     # 或距上次发送超过该时间(秒)后发回
+
+class _ShardEntry:
+    """发给工作进程的条目, 只包含检测需要的URL和父进程中的编号"""
+
+    __slots__ = ('key', 'url')
+
+    def __init__(self, key, url):
+        self.key = key
+        self.url = url
+
+def _shard_worker(shard, in_queue, out_queue, max_in_flight, per_host, timeout):
+    """工作进程: 用自己的异步引擎检测分到的条目, 批量发回结果, 最后发回统计"""
+    import traceback
+    buffer = []
+    last_flush = time.monotonic()
+
+    def entries():
+        while True:
+            batch = in_queue.get()
+            if batch is None:
+                return
+            for key, url in batch:
+                yield _ShardEntry(key, url)
+
+    def flush():
+        nonlocal buffer, last_flush
+        if buffer:
+            out_queue.put(('results', buffer))
+            buffer = []
+        last_flush = time.monotonic()
+
+    def on_result(entry, result):
+        buffer.append((entry.key, result))
+        if len(buffer) >= SHARD_RESULT_BATCH or time.monotonic() - last_flush > SHARD_FLUSH_INTERVAL:
+            flush()
+
+    # 按主机分片, 熔断、超时估计和并发窗口都只涉及本进程的主机
+    breaker = HostCircuitBreaker()
+    timeouts = AdaptiveTimeouts()
+    retry_budget = RetryBudget()
+    limiter = AsyncAimdLimiter(per_host)
+    try:
+        prober = run_async_checks(entries(), on_result, max_in_flight=max_in_flight, per_host=per_host,
+                                  timeout=timeout, breaker=breaker, timeouts=timeouts,
+                                  retry_budget=retry_budget, limiter=limiter)
+        flush()
+        out_queue.put(('done', (shard, {
+            'pool': (pool_stats.hits, pool_stats.misses),
+            'dns': (dns_resolver.resolved, dns_resolver.failed),
+            'breaker': (breaker.skipped, breaker.open_hosts),
+            'retries': (retry_budget.probes, retry_budget.used, retry_budget.recovered),
+            'timeouts': timeouts.estimates,
+            'limiter': limiter.states,
+            'tiers': (prober.eliminated, prober.passed, len(prober.connect_checks)),
+        })))
+    except BaseException:
+        flush()
+        out_queue.put(('error', (shard, traceback.format_exc())))
+
+def shard_of(url, workers):
+    """按主机名的CRC32分片, 在所有进程中结果一致"""
+    import zlib
+    return zlib.crc32(get_url_host(url).encode('utf-8', 'replace')) % workers
+
+def run_sharded_checks(entries, on_result, workers, max_in_flight=ASYNC_MAX_IN_FLIGHT,
+                       per_host=ASYNC_PER_HOST_LIMIT, timeout=PROBE_TIMEOUT):
+    """把条目按主机分到workers个进程, 每个进程运行异步引擎, 结果通过on_result回调
+
+    全局并发上限平均分给各进程; 单主机并发上限不变(同一主机只在一个进程中)。
+    返回各工作进程的统计列表, 工作进程异常退出时其未完成的条目记为失败
+    """
+    import multiprocessing
+    import queue
+    ctx = multiprocessing.get_context('spawn')
+    out_queue = ctx.Queue()
+    in_queues = [ctx.Queue(maxsize=SHARD_QUEUE_BATCHES) for _ in range(workers)]
+    per_worker = max(1, max_in_flight // workers)
+    processes = [ctx.Process(target=_shard_worker, args=(i, in_queues[i], out_queue, per_worker, per_host, timeout),
+                             daemon=True) for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    pending = {}    # 编号 -> (条目, 分片)
+    pending_lock = threading.Lock()
+    finished = set()
+    stats = []
+
+    def fail_shard(shard, message):
+        """工作进程异常退出, 把它剩余的条目记为失败"""
+        with pending_lock:
+            lost = [key for key, (_, entry_shard) in pending.items() if entry_shard == shard]
+            entries_lost = [pending.pop(key)[0] for key in lost]
+        for entry in entries_lost:
+            on_result(entry, {'status': 'fail', 'error': message})
+
+    def consume():
+        done_count = 0
+        while done_count < workers:
+            try:
+                kind, payload = out_queue.get(timeout=1)
+            except queue.Empty:
+                for shard, process in enumerate(processes):
+                    if shard not in finished and not process.is_alive():
+                        finished.add(shard)
+                        done_count += 1
+                        fail_shard(shard, f'检测进程异常退出 (退出码 {process.exitcode})')
+                continue
+            if kind == 'results':
+                for key, result in payload:
+                    with pending_lock:
+                        item = pending.pop(key, None)
+                    if item is not None:
+                        on_result(item[0], result)
+            else:
+                shard, payload = payload
+                if kind == 'error':
+                    print(f"\n检测进程出错:\n{payload}")
+                    fail_shard(shard, '检测进程出错')
+                else:
+                    stats.append(payload)
+                finished.add(shard)
+                done_count += 1
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+
+    def put(shard, item):
+        """发送给工作进程, 进程已退出时放弃"""
+        while shard not in finished:
+            try:
+                in_queues[shard].put(item, timeout=1)
+                return
+            except queue.Full:
+                if not processes[shard].is_alive():
+                    return
+
+    batches = [[] for _ in range(workers)]
+    for key, entry in enumerate(entries):
+        shard = shard_of(entry.url, workers)
+        with pending_lock:
+            pending[key] = (entry, shard)
+        batches[shard].append((key, entry.url))
+        if len(batches[shard]) >= SHARD_BATCH:
+            put(shard, batches[shard])
+            batches[shard] = []
+    for shard in range(workers):
+        if batches[shard]:
+            put(shard, batches[shard])
+        put(shard, None)
+
+    consumer.join()
+    for process in processes:
+        process.join(timeout=5)
+    return stats
 
-        # 直接使用GET请求并检查内容
-        response = requests.get(
-            url,
-            timeout=5,  # 增加超时时间
-            headers=headers,
-            stream=True,
-            verify=False
-        )
-        
-        if response.status_code not in [200, 206]:  # 检查状态码（包括部分内容响应）
-            return {
-                'status': 'fail',
-                'error': f'HTTP状态码错误: {response.status_code}'
-            }
+def merge_shard_stats(stats, breaker, timeouts, retry_budget, limiter):
+    """把工作进程的统计合并到父进程的对象中, 返回分级探测的汇总文字
 
-        # 读取一段数据进行分析
-        content = next(response.iter_content(4096), None)
-        
-        if not content:
-            return {
-                'status': 'fail',
-                'error': '无法读取流数据'
-            }
+    分片模式下熔断只在各工作进程内进行, 父进程的 breaker 只用于汇总
+    """
+    eliminated = Counter()
+    passed = 0
+    connect_checks = 0
+    for item in stats:
+        with pool_stats.lock:
+            pool_stats.hits += item['pool'][0]
+            pool_stats.misses += item['pool'][1]
+        with dns_resolver.lock:
+            dns_resolver.resolved += item['dns'][0]
+            dns_resolver.failed += item['dns'][1]
+        with breaker.lock:
+            breaker.skipped += item['breaker'][0]
+            breaker.open_hosts |= item['breaker'][1]
+        with retry_budget.lock:
+            retry_budget.probes += item['retries'][0]
+            retry_budget.used += item['retries'][1]
+            retry_budget.recovered += item['retries'][2]
+        with timeouts.lock:
+            timeouts.estimates.update(item['timeouts'])
+        with limiter.cond:
+            limiter.states.update(item['limiter'])
+        tier_eliminated, tier_passed, tier_connects = item['tiers']
+        eliminated.update(tier_eliminated)
+        passed += tier_passed
+        connect_checks += tier_connects
+    return TieredProber.format_summary(eliminated, passed, connect_checks)
 
-        # 检查数据特征
-        # 常见的流媒体格式特征
-        stream_signatures = [
-            b'FLV', b'G@', b'\x47',  # FLV, TS流特征
-            b'ID3', b'#EXTM3U',      # MP3, M3U特征
-            b'RIFF',                  # AVI特征
-            b'\x00\x00\x00\x1c',     # H264特征
-            b'\x00\x00\x01',         # MPEG特征
-        ]
+THREAD_WORKERS = 20
+THREAD_PENDING_LIMIT = THREAD_WORKERS * 50  # 线程池中同时排队的任务上限
+THREAD_DEFERRED_LIMIT = 20000               # 等待源站并发名额的条目上限, 达到后暂停读取列表
 
-        # 检查内容是否包含任何已知的流媒体格式特征
-        is_valid_stream = any(sig in content for sig in stream_signatures)
-        
-        if is_valid_stream:
-            return {
-                'status': 'ok',
-                'response_time': f"{response.elapsed.total_seconds():.2f}秒",
-                'status_code': response.status_code,
-                'content_type': response.headers.get('Content-Type', 'unknown')
-            }
-        else:
-            # 如果没有找到特征，但服务器返回了正确的Content-Type
-            content_type = response.headers.get('Content-Type', '').lower()
-            valid_types = ['video/', 'audio/', 'application/octet-stream', 'application/vnd.apple.mpegurl']
-            
-            if any(t in content_type for t in valid_types):
-                return {
-                    'status': 'ok',
-                    'response_time': f"{response.elapsed.total_seconds():.2f}秒",
-                    'status_code': response.status_code,
-                    'content_type': content_type
-                }
-            
-            return {
-                'status': 'fail',
-                'error': f'未识别的流媒体格式 (Content-Type: {content_type})'
-            }
+def run_thread_checks(entries, probe, on_result, limiter, workers=THREAD_WORKERS):
+    """线程引擎: 只把源站并发窗口还有空位的条目交给线程池, 线程不会在限流窗口上等待
 
-    except requests.exceptions.Timeout:
-        return {
-            'status': 'fail',
-            'error': '连接超时'
-        }
-    except requests.exceptions.ConnectionError:
-        return {
-            'status': 'fail',
-            'error': '连接错误'
-        }
-    except requests.exceptions.TooManyRedirects:
-        return {
-            'status': 'fail',
-            'error': '重定向次数过多'
-        }
-    except requests.exceptions.RequestException as e:
-        return {
-            'status': 'fail',
-            'error': str(e)
-        }
+    probe(url, attempt) 在线程中执行, 调用前已占用该源站的一个名额, 返回
+    (结果, 是否因限流需要稍后重新检测)。窗口已满的条目按源站排队, 该源站有探测
+    结束时再提交; 需要重新检测的条目等待 AIMD_BACKOFF 秒(按次数递增)后重新排队
+    """
+    import heapq
+    from collections import deque
+    waiting = {}    # 源站 -> 等待名额的 (条目, 第几次检测)
+    delayed = []    # (可以重新检测的时间, 序号, 条目, 第几次检测)
+    pending = {}    # future -> (条目, 第几次检测)
+    queued = 0
+    seq = 0
 
-def parse_channel_info(extinf_line):
-    """解析EXTINF行的频道信息"""
-    channel_info = {}
-    
-    # 获取频道名称
-    name_match = re.search(r'tvg-name="([^"]*)"', extinf_line) or \
-                re.search(r'group-title="[^"]*",\s*([^,]+)$', extinf_line) or \
-                re.search(r',([^,]+)$', extinf_line)
-    
-    if name_match:
-        channel_info['name'] = name_match.group(1).strip()
-    
-    # 解析分辨率
-    resolution = 0
-    if '4K' in extinf_line or '2160P' in extinf_line.upper():
-        resolution = 2160
-    elif '1080P' in extinf_line.upper() or 'FHD' in extinf_line.upper():
-        resolution = 1080
-    elif '720P' in extinf_line.upper() or 'HD' in extinf_line.upper():
-        resolution = 720
-    elif '576P' in extinf_line.upper() or 'SD' in extinf_line.upper():
-        resolution = 576
-    elif '480P' in extinf_line.upper():
-        resolution = 480
-    channel_info['resolution'] = resolution
-    
-    return channel_info
-
-def load_m3u_content(source):
-    """加载m3u内容,支持URL和本地文件"""
-    try:
-        if is_valid_url(source):
-            print(f"正在从URL下载m3u文件: {source}")
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive'
-            }
-            
-            # 尝试多次下载
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # 禁用SSL验证警告
-                    with warnings.catch_warnings():
-                        warnings.simplefilter('ignore')
-                        response = requests.get(
-                            source, 
-                            timeout=30,
-                            headers=headers,
-                            verify=False,
-                            allow_redirects=True
-                        )
-                    response.raise_for_status()
-                    
-                    # 检查内容类型
-                    if 'text/plain' in response.headers.get('Content-Type', ''):
-                        response.encoding = 'utf-8'
-                    else:
-                        # 尝试检测编码
-                        response.encoding = response.apparent_encoding or 'utf-8'
-                    
-                    content = response.text
-                    if '#EXTM3U' in content:  # 验证是否是有效的M3U文件
-                        return content
-                    else:
-                        print(f"警告: 下载的内容可能不是有效的M3U文件")
-                        print("尝试继续处理...")
-                        return content
-                        
-                except requests.RequestException as e:
-                    if attempt < max_retries - 1:
-                        print(f"下载失败，正在重试 ({attempt + 1}/{max_retries}): {e}")
-                        time.sleep(2)  # 等待2秒后重试
-                        continue
-                    else:
-                        raise
-            
-        else:
-            if not os.path.exists(source):
-                raise FileNotFoundError(f"找不到文件: {source}")
-            print(f"正在读取本地文件: {source}")
-            with open(source, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if '#EXTM3U' in content:
-                    return content
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        def drain(origin):
+            nonlocal queued
+            queue = waiting.get(origin)
+            while queue and limiter.try_acquire(origin):
+                entry, attempt = queue.popleft()
+                queued -= 1
+                pending[executor.submit(probe, entry.url, attempt)] = (entry, attempt)
+            if queue is not None and not queue:
+                del waiting[origin]
+
+        def dispatch(entry, attempt):
+            nonlocal queued
+            origin = get_url_origin(entry.url)
+            if origin not in waiting and limiter.try_acquire(origin):
+                pending[executor.submit(probe, entry.url, attempt)] = (entry, attempt)
+            else:
+                waiting.setdefault(origin, deque()).append((entry, attempt))
+                queued += 1
+
+        def collect():
+            nonlocal seq
+            now = time.monotonic()
+            timeout = max(0.0, delayed[0][0] - now) if delayed else None
+            if pending:
+                done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                time.sleep(timeout or 0)
+                done = ()
+            for future in done:
+                entry, attempt = pending.pop(future)
+                result, retry = future.result()
+                if retry:
+                    seq += 1
+                    heapq.heappush(delayed, (time.monotonic() + AIMD_BACKOFF * (attempt + 1), seq, entry, attempt + 1))
                 else:
-                    print(f"警告: 文件可能不是有效的M3U文件")
-                    print("尝试继续处理...")
-                    return content
-                    
-    except requests.exceptions.RequestException as e:
-        print(f"下载m3u文件失败: {e}")
-        print("提示: 如果您可以在浏览器中访问该URL，可以先下载到本地再使用本地文件路径")
-        return None
-    except Exception as e:
-        print(f"读取m3u文件失败: {e}")
-        return None
+                    on_result(entry, result)
+                drain(get_url_origin(entry.url))
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, entry, attempt = heapq.heappop(delayed)
+                dispatch(entry, attempt)
 
-def is_ipv6_url(url):
-    """检查是否是IPv6地址的URL"""
-    try:
-        host = urlparse(url).netloc.split(':')[0]
-        # 检查是否包含IPv6的特征（多个冒号）
-        return ':' in host or any(c in host for c in '[]')
-    except:
-        return False
+        for entry in entries:
+            while len(pending) >= THREAD_PENDING_LIMIT or queued >= THREAD_DEFERRED_LIMIT:
+                collect()
+            dispatch(entry, 0)
+        while pending or delayed or queued:
+            collect()
 
-def check_all_streams(source):
-    """检查所有流的可用性"""
-    content = load_m3u_content(source)
-    if not content:
+def check_all_streams(source, engine='thread', max_in_flight=ASYNC_MAX_IN_FLIGHT, per_host=ASYNC_PER_HOST_LIMIT,
+                      use_cache=True, epg_index=None, prometheus=False, workers=None,
+                      measure=False, measure_window=MEASURE_WINDOW, measure_bytes=MEASURE_MAX_BYTES,
+                      bandwidth_cap=MEASURE_BANDWIDTH_CAP, output_dir="m3u_check_result",
+                      on_result=None, interactive=True, history=True, min_height=0, rank_quality=False,
+                      network_check=None):
+    """检查所有流的可用性
+
+    engine 为 'thread' 时使用20线程的线程池, 为 'async' 时使用asyncio引擎,
+    为 'sharded' 时按主机把条目分到 workers 个进程(默认CPU核数), 每个进程运行
+    异步引擎。各引擎的判断规则和输出文件完全一致。use_cache 为True时复用
+    probe_cache.db 中未过期的结果, 只检测新增或过期的链接。提供 epg_index
+    时为没有tvg-id的条目补上匹配到的EPG频道ID。各阶段耗时的统计保存为
+    probe_metrics.json, prometheus 为True时另外输出Prometheus文本文件。
+    measure 为True时检测结束后测量可用流的持续速率, 输出按速率排序的列表。
+    on_result(entry, result) 会收到每个条目的结果。interactive 为False时不询问
+    是否继续, 直接返回检测统计。history 为True时把每次实际检测追加到输出目录中的
+    probe_history.db, 可用列表按可靠性得分排列, 并输出与上次检测相比的变化。
+    可用条目的EXTINF行标注从码流中解析出的编码和分辨率; min_height 大于0时
+    分辨率已知且低于该值的可用条目写入 *_低画质_N个.m3u, rank_quality 为True时
+    可用列表先按分辨率从高到低排列。network_check 为后台网络环境检测的Future,
+    加载播放列表时已完成则立即输出结果, 否则在检测结束时输出
+    """
+    entries = open_m3u_entries(source)
+    if network_check is not None and network_check.done():
+        report_network_check(network_check)
+        network_check = None
+    if entries is None:
         print("无法加载M3U内容")
         return
 
     # 创建输出目录
-    output_dir = "m3u_check_result"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    lines = content.splitlines()
-    
-    # 分别存储IPv4和IPv6的流
-    ipv4_working = ["#EXTM3U\n"]
-    ipv4_failed = ["#EXTM3U\n"]
-    ipv6_working = ["#EXTM3U\n"]
-    ipv6_failed = ["#EXTM3U\n"]
-    # 添加总的汇总列表
-    all_working = ["#EXTM3U\n"]
-    all_failed = ["#EXTM3U\n"]
-    
-    total_streams = sum(1 for line in lines if line.strip().startswith('http'))
-    working_count = 0
-    ipv4_working_count = 0
-    ipv6_working_count = 0
-    ipv4_total = 0
-    ipv6_total = 0
+    parsed_count = 0
+    parsing_done = False
     current = 0
 
-    print(f"\n开始检查，共发现 {total_streams} 个流媒体链接")
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        current_extinf = None
-        channel_info = None
-        futures = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.startswith('#EXTINF:'):
-                current_extinf = line
-                channel_info = parse_channel_info(line)
-                continue
-                
-            if line.startswith('http'):
-                is_ipv6 = is_ipv6_url(line)
-                if is_ipv6:
-                    ipv6_total += 1
-                else:
-                    ipv4_total += 1
-                futures.append((executor.submit(check_stream, line), current_extinf, line, channel_info, is_ipv6))
+    writer = StreamResultWriter(output_dir, low_quality=min_height > 0)
+    quality = QualityStats()
+    heights = {}    # 按分辨率排序时保存可用条目的 规范化URL -> 视频高度
+    cache = ProbeCache(os.path.join(output_dir, PROBE_CACHE_FILE)) if use_cache else None
+    probe_history = ProbeHistory(os.path.join(output_dir, HISTORY_FILE), source=source) if history else None
+    breaker = HostCircuitBreaker()
+    metrics = ProbeMetrics()
+    working = []    # 需要测速时保存可用条目的 (EXTINF行, URL)
+    timeouts = AdaptiveTimeouts()
+    retry_budget = RetryBudget()
+    limiter = AimdLimiter(per_host) if engine != 'async' else AsyncAimdLimiter(per_host)
+    # 相同(规范化)URL只检测一次: 检测中的URL -> 等待结果的其他条目, 已完成的URL -> 结果
+    inflight = {}
+    finished = {}
+    dedup_saved = 0
+    dns_skipped = 0     # 域名已知解析失败, 未发出请求的条目
+    # 异步引擎中解析(含缓存命中)和检测回调可能来自不同线程
+    result_lock = threading.RLock()
 
-        for future in concurrent.futures.as_completed([f[0] for f in futures]):
+    def record_result(entry, result):
+        """把检测结果写入对应文件并刷新进度"""
+        nonlocal current
+        with result_lock:
             current += 1
-            
-            for f, extinf, url, info, is_ipv6 in futures:
-                if f == future:
-                    result = future.result()
-                    if result['status'] == 'ok':
-                        working_count += 1
-                        if is_ipv6:
-                            ipv6_working_count += 1
-                            if extinf:
-                                ipv6_working.append(f"{extinf}\n")
-                                all_working.append(f"{extinf}\n")
-                            ipv6_working.append(f"{url}\n")
-                            all_working.append(f"{url}\n")
-                        else:
-                            ipv4_working_count += 1
-                            if extinf:
-                                ipv4_working.append(f"{extinf}\n")
-                                all_working.append(f"{extinf}\n")
-                            ipv4_working.append(f"{url}\n")
-                            all_working.append(f"{url}\n")
-                    else:
-                        if is_ipv6:
-                            if extinf:
-                                ipv6_failed.append(f"{extinf}\n")
-                                all_failed.append(f"{extinf}\n")
-                            ipv6_failed.append(f"{url}\n")
-                            all_failed.append(f"{url}\n")
-                        else:
-                            if extinf:
-                                ipv4_failed.append(f"{extinf}\n")
-                                all_failed.append(f"{extinf}\n")
-                            ipv4_failed.append(f"{url}\n")
-                            all_failed.append(f"{url}\n")
-                    break
-            
-            print(f"\r检查进度: {current}/{total_streams} ({(current/total_streams*100):.1f}%) "
-                  f"IPv4可用: {ipv4_working_count}/{ipv4_total} "
-                  f"IPv6可用: {ipv6_working_count}/{ipv6_total}", end='')
-
-    # 保存结果文件
-    # 保存总的汇总文件
-    all_working_file = os.path.join(output_dir, f"全部_可用_{working_count}个.m3u")
-    all_failed_file = os.path.join(output_dir, f"全部_不可用_{total_streams - working_count}个.m3u")
-    with open(all_working_file, 'w', encoding='utf-8') as f:
-        f.writelines(all_working)
-    with open(all_failed_file, 'w', encoding='utf-8') as f:
-        f.writelines(all_failed)
-
-    # 保存IPv4文件
-    if ipv4_total > 0:
-        ipv4_working_file = os.path.join(output_dir, f"IPv4_可用_{ipv4_working_count}个.m3u")
-        ipv4_failed_file = os.path.join(output_dir, f"IPv4_不可用_{ipv4_total - ipv4_working_count}个.m3u")
-        with open(ipv4_working_file, 'w', encoding='utf-8') as f:
-            f.writelines(ipv4_working)
-        with open(ipv4_failed_file, 'w', encoding='utf-8') as f:
-            f.writelines(ipv4_failed)
-
-    # 保存IPv6文件
-    if ipv6_total > 0:
-        ipv6_working_file = os.path.join(output_dir, f"IPv6_可用_{ipv6_working_count}个.m3u")
-        ipv6_failed_file = os.path.join(output_dir, f"IPv6_不可用_{ipv6_total - ipv6_working_count}个.m3u")
-        with open(ipv6_working_file, 'w', encoding='utf-8') as f:
-            f.writelines(ipv6_working)
-        with open(ipv6_failed_file, 'w', encoding='utf-8') as f:
-            f.writelines(ipv6_failed)
-
-    print(f"\n\n检查完成!")
+            # 域名按实际解析出的地址族分类, 没有解析信息时按URL中的地址判断
+            is_ipv6 = result.get('ipv6')
+            if is_ipv6 is None:
+                is_ipv6 = entry.is_ipv6
+            extinf = epg_index.annotate(entry) if epg_index is not None else entry.extinf
+            ok = result['status'] == 'ok'
+            low_quality = False
+            if ok:
+                video = result.get('video')
+                extinf = annotate_video(extinf, video)
+                height = quality.record(entry, video)
+                low_quality = 0 < height < min_height
+                if rank_quality and height:
+                    heights[normalize_url(entry.url)] = height
+            writer.write(extinf, entry.url, is_ipv6, ok, low_quality)
+            if on_result is not None:
+                on_result(entry, result)
+            if measure and result['status'] == 'ok':
+                working.append((extinf, entry.url))
+
+            progress = f"{current}/{parsed_count}"
+            if parsing_done:
+                progress += f" ({(current/parsed_count*100):.1f}%)"
+            print(f"\r检查进度: {progress} "
+                  f"IPv4可用: {writer.counts[('IPv4', '可用')]}/{writer.total('IPv4')} "
+                  f"IPv6可用: {writer.counts[('IPv6', '可用')]}/{writer.total('IPv6')}", end='')
+
+    def record_probe_result(entry, result):
+        """记录一次检测结果, 并分发给使用相同URL的其他条目"""
+        with result_lock:
+            key = normalize_url(entry.url)
+            if not result.get('cached') and not result.get('skipped'):
+                metrics.record(entry.url, result)
+                if cache is not None:
+                    cache.put(entry.url, result)
+            # 熔断跳过的条目也是本次检测的结论, 记入历史; 缓存复用的结果不重复记录
+            if probe_history is not None and not result.get('cached'):
+                probe_history.record(entry, result)
+            finished[key] = result
+            record_result(entry, result)
+            for waiting_entry in inflight.pop(key, ()):
+                record_result(waiting_entry, result)
+
+    def entries_to_probe():
+        """边解析边产出待检测条目
+
+        重复的URL共用一次检测结果, 缓存中仍然有效或主机已熔断的条目直接记录结果
+        """
+        nonlocal parsed_count, parsing_done, dedup_saved, dns_skipped
+        for entry in entries:
+            with result_lock:
+                parsed_count += 1
+                key = normalize_url(entry.url)
+                if key in finished:
+                    dedup_saved += 1
+                    record_result(entry, finished[key])
+                    continue
+                if key in inflight:
+                    dedup_saved += 1
+                    inflight[key].append(entry)
+                    continue
+
+                cached = cache.get(entry.url) if cache is not None else None
+                if cached is None and engine != 'sharded':
+                    # 分片模式由各工作进程自己熔断, 结束后合并统计
+                    cached = breaker.check(get_url_origin(entry.url))
+                if cached is None:
+                    # 已知解析失败的域名直接跳过, 其余域名提前开始并发解析
+                    # (分片模式由各工作进程自己解析)
+                    host = get_url_host(entry.url)
+                    if dns_resolver.cached_addresses(host) == []:
+                        cached = dns_failure_result(host)
+                        dns_skipped += 1
+                    elif engine != 'sharded':
+                        dns_resolver.submit(host)
+                if cached is not None:
+                    record_probe_result(entry, cached)
+                    continue
+                inflight[key] = []
+            yield entry
+        parsing_done = True
+
+    def probe(url, attempt):
+        """线程池中执行的一次检测, 提交前已占用源站的并发名额; 主机已熔断时跳过
+
+        返回 (结果, 是否因限流需要稍后重新检测)
+        """
+        origin = get_url_origin(url)
+        result = None
+        try:
+            skipped = breaker.check(origin)
+            if skipped is not None:
+                return skipped, False
+            host = get_url_host(url)
+            dns_start = time.monotonic()
+            addrs = dns_resolver.resolve(host)
+            dns_time = time.monotonic() - dns_start
+            if not addrs:
+                return dns_failure_result(host), False
+            timeout = timeouts.timeout_for(origin)
+            result = check_stream(url, timeout)
+            retry_budget.record_probe()
+            if retry_budget.should_retry(result) and retry_budget.try_acquire():
+                timeout = timeouts.retry_timeout(timeout)
+                result = check_stream(url, timeout)
+                result['retried'] = True
+                retry_budget.record_retry(result)
+        finally:
+            event = limiter.release(origin, result)
+        # 被限流时窗口已缩小, 稍后重新探测, 避免把限流当作不可用
+        if event in AIMD_RETRY_EVENTS and attempt < AIMD_THROTTLE_RETRIES:
+            return result, True
+        timeouts.observe(origin, result)
+        result['timeout'] = timeout
+        breaker.record(origin, result)
+        result['ipv6'] = is_ipv6_addresses(addrs)
+        _add_timing(result['timings'], 'dns', dns_time)
+        _add_timing(result['timings'], 'total', dns_time)
+        return result, False
+
+    print("\n开始检查 (边读取列表边检测)")
+    start_time = time.time()
+    pool_stats.reset()
+    dns_resolver.reset_stats()
+    prober = None
+    tier_summary = None
+
+    try:
+        if engine == 'sharded':
+            workers = workers or os.cpu_count() or 1
+            print(f"使用 {workers} 个进程分片检测 (全局并发 {max_in_flight}, 单主机并发 {per_host})")
+            stats = run_sharded_checks(entries_to_probe(), record_probe_result, workers,
+                                       max_in_flight=max_in_flight, per_host=per_host)
+            tier_summary = merge_shard_stats(stats, breaker, timeouts, retry_budget, limiter)
+        elif engine == 'async':
+            print(f"使用异步引擎 (全局并发 {max_in_flight}, 单主机并发 {per_host})")
+            prober = run_async_checks(entries_to_probe(), record_probe_result, max_in_flight=max_in_flight,
+                                      per_host=per_host, breaker=breaker, timeouts=timeouts,
+                                      retry_budget=retry_budget, limiter=limiter)
+        else:
+            run_thread_checks(entries_to_probe(), probe, record_probe_result, limiter)
+    finally:
+        writer.finalize(probe_history.scores() if probe_history is not None else None, heights)
+        if cache is not None:
+            cache.close()
+        if probe_history is not None:
+            probe_history.write_reports(output_dir)
+            probe_history.close()
+
+    total_streams = writer.total('全部')
+    ipv4_total = writer.total('IPv4')
+    ipv6_total = writer.total('IPv6')
+    working_count = writer.counts[('全部', '可用')]
+    ipv4_working_count = writer.counts[('IPv4', '可用')]
+    ipv6_working_count = writer.counts[('IPv6', '可用')]
+
+    print(f"\n\n检查完成! 耗时 {time.time() - start_time:.1f} 秒")
     print(f"总计: {total_streams} 个流")
     print(f"总可用: {working_count} 个")
     print(f"IPv4: 总共 {ipv4_total} 个，可用 {ipv4_working_count} 个")
     print(f"IPv6: 总共 {ipv6_total} 个，可用 {ipv6_working_count} 个")
+    if network_check is not None:
+        report_network_check(network_check)
+    print(f"连接池: {pool_stats.summary()}")
+    cache_hits = cache.hits if cache is not None else 0
+    probed = total_streams - dedup_saved - breaker.skipped - cache_hits - dns_skipped
+    if cache is not None:
+        print(f"缓存: 复用 {cache_hits} 个未过期结果")
+    print(f"DNS: 解析成功 {dns_resolver.resolved} 个域名, 解析失败 {dns_resolver.failed} 个, "
+          f"跳过 {dns_skipped} 个解析失败域名的链接")
+    print(f"去重: {dedup_saved} 个重复链接共用检测结果")
+    print(f"熔断: {len(breaker.open_hosts)} 个主机被熔断, 跳过 {breaker.skipped} 个链接")
+    print(f"实际检测 {probed} 个, 节省探测 {total_streams - probed} 次")
+    if prober is not None:
+        tier_summary = prober.summary()
+    if tier_summary is not None:
+        print(f"分级探测: {tier_summary}")
+    if epg_index is not None:
+        print(f"EPG: 为 {epg_index.matched} 个条目补充了tvg-id")
+    print(f"耗时分布: {metrics.summary()}")
+    print(f"自适应超时: {timeouts.summary()}")
+    print(f"重试: {retry_budget.summary()}")
+    print(f"并发控制: {limiter.summary()}")
+    print(f"画质: {quality.summary()}")
+    if probe_history is not None:
+        print(f"检测历史: {probe_history.summary()}")
+    metrics.write_json(os.path.join(output_dir, METRICS_JSON_FILE), {
+        'timeouts': timeouts.to_dict(),
+        'retries': {'probes': retry_budget.probes, 'used': retry_budget.used,
+                    'recovered': retry_budget.recovered},
+        'concurrency': limiter.to_dict(),
+        'dns_skipped': dns_skipped,
+    })
+    if prometheus:
+        metrics.write_prometheus(os.path.join(output_dir, METRICS_PROM_FILE))
 
     print(f"\n结果已保存到目录: {output_dir}")
     print(f"全部可用流: 全部_可用_{working_count}个.m3u")
-    print(f"全部不可用流: 全部_不可用_{total_streams - working_count}个.m3u")
+    print(f"全部不可用流: 全部_不可用_{writer.counts[('全部', '不可用')]}个.m3u")
+    print(f"耗时统计: {METRICS_JSON_FILE}" + (f", {METRICS_PROM_FILE}" if prometheus else ''))
     if ipv4_total > 0:
         print(f"IPv4可用流: IPv4_可用_{ipv4_working_count}个.m3u")
-        print(f"IPv4不可用流: IPv4_不可用_{ipv4_total - ipv4_working_count}个.m3u")
+        print(f"IPv4不可用流: IPv4_不可用_{writer.counts[('IPv4', '不可用')]}个.m3u")
     if ipv6_total > 0:
         print(f"IPv6可用流: IPv6_可用_{ipv6_working_count}个.m3u")
-        print(f"IPv6不可用流: IPv6_不可用_{ipv6_total - ipv6_working_count}个.m3u")
+        print(f"IPv6不可用流: IPv6_不可用_{writer.counts[('IPv6', '不可用')]}个.m3u")
+    if min_height > 0:
+        low_count = writer.counts[('全部', '低画质')]
+        print(f"低于 {min_height}p 的可用流: 全部_低画质_{low_count}个.m3u")
+    if probe_history is not None:
+        print(f"状态变化: {HISTORY_DIFF_FILE}, 按主机统计: {HISTORY_REPORT_FILE} (可用列表已按可靠性排序)")
+
+    if measure and working:
+        measure_throughput(working, output_dir, window=measure_window, max_bytes=measure_bytes,
+                           bandwidth_cap=bandwidth_cap)
 
-    # 添加继续/退出选项
+    if not interactive:
+        return {'total': total_streams, 'working': working_count, 'probed': probed,
+                'elapsed': time.time() - start_time}
+    return ask_continue()
+
+def ask_continue():
+    """询问是否继续检测其他文件"""
     while True:
         choice = input("\n是否继续检测其他文件？(y/n): ").lower()
         if choice == 'y':
@@ -558,8 +4334,935 @@ def check_all_streams(source):
         else:
             print("无效的选择，请输入 y 或 n")
 
-def get_m3u_source():
-    """获取m3u源"""
+# 最佳源模式配置
+BEST_SOURCES_PER_CHANNEL = 2    # 每个频道保留的可用源数量
+BEST_SOURCE_STAGGER = 0.3       # 同一频道相邻候选源的启动间隔(秒)
+
+def normalize_channel_name(name):
+    """规范化频道名称: 全角转半角、忽略大小写、去掉空白和连接符"""
+    import unicodedata
+    name = unicodedata.normalize('NFKC', name or '').casefold()
+    return re.sub(r'[\s\-_]+', '', name)
+
+def channel_group_key(entry):
+    """频道分组键: 有tvg-id时按tvg-id分组, 否则按规范化的频道名称"""
+    if entry.tvg_id:
+        return 'id:' + entry.tvg_id.strip().casefold()
+    return 'name:' + normalize_channel_name(entry.name)
+
+async def _race_candidates(candidates, want, stagger, probe):
+    """错峰启动同一频道的候选源, 成功want个后取消其余探测
+
+    每隔stagger秒(或前一个候选结束后立即)启动下一个候选源,
+    返回 (成功的 (entry, result) 列表, 实际启动的探测数)
+    """
+    winners = []
+    running = {}
+    candidate_iter = iter(candidates)
+    launched = 0
+
+    def launch_next():
+        nonlocal launched
+        entry = next(candidate_iter, None)
+        if entry is None:
+            return False
+        running[asyncio.ensure_future(probe(entry))] = entry
+        launched += 1
+        return True
+
+    try:
+        while len(winners) < want:
+            if not running and not launch_next():
+                break
+            done, _ = await asyncio.wait(running, timeout=stagger, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch_next()
+                continue
+            for task in done:
+                entry = running.pop(task)
+                result = task.result()
+                if result['status'] == 'ok':
+                    winners.append((entry, result))
+            if len(winners) < want:
+                launch_next()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return winners[:want], launched
+
+async def _async_best_sources(groups, want, stagger, max_in_flight, per_host, on_group_done):
+    """并发为每个频道分组竞速挑选最佳源"""
+    pool = AsyncConnectionPool(per_host)
+    prober = TieredProber(pool, max_in_flight)
+    host_limits = {}
+    # 同时竞速的频道数量, 每个频道最多同时有几个探测
+    group_limit = asyncio.Semaphore(max(1, max_in_flight // 2))
+
+    async def probe(entry):
+        host = get_url_host(entry.url)
+        host_limit = host_limits.get(host)
+        if host_limit is None:
+            host_limit = host_limits[host] = asyncio.Semaphore(per_host)
+        async with host_limit:
+            addrs = await asyncio.wrap_future(dns_resolver.submit(host))
+            if not addrs:
+                return dns_failure_result(host)
+            return await prober.probe(entry.url)
+
+    async def race(key, candidates):
+        async with group_limit:
+            winners, launched = await _race_candidates(candidates, want, stagger, probe)
+        on_group_done(key, candidates, winners, launched)
+
+    await asyncio.gather(*(race(key, candidates) for key, candidates in groups.items()))
+    pool.close()
+
+def check_best_sources(source, per_channel=BEST_SOURCES_PER_CHANNEL, stagger=BEST_SOURCE_STAGGER,
+                       max_in_flight=ASYNC_MAX_IN_FLIGHT, per_host=ASYNC_PER_HOST_LIMIT, epg_index=None):
+    """为每个频道挑选响应最快的可用源
+
+    按tvg-id或规范化的频道名分组, 同组候选源错峰竞速, 每个频道得到
+    per_channel 个可用源后取消其余探测。结果按频道首次出现的顺序输出,
+    同一频道内按响应时间排序
+    """
+    entries = open_m3u_entries(source)
+    if entries is None:
+        print("无法加载M3U内容")
+        return
+
+    output_dir = "m3u_check_result"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # 分组需要看到同一频道的全部候选源, 这里读完整个列表(只保存紧凑的记录)
+    groups = {}
+    seen_urls = set()
+    total_entries = 0
+    for entry in entries:
+        total_entries += 1
+        url_key = normalize_url(entry.url)
+        if url_key in seen_urls:
+            continue
+        seen_urls.add(url_key)
+        groups.setdefault(channel_group_key(entry), []).append(entry)
+    seen_urls.clear()
+
+    candidate_total = sum(len(candidates) for candidates in groups.values())
+    print(f"\n共 {total_entries} 个条目, {len(groups)} 个频道, 去重后 {candidate_total} 个候选源")
+    print(f"每个频道保留 {per_channel} 个最快的可用源")
+
+    best = {}
+    done_groups = 0
+    probes_launched = 0
+
+    def on_group_done(key, candidates, winners, launched):
+        nonlocal done_groups, probes_launched
+        done_groups += 1
+        probes_launched += launched
+        if winners:
+            best[key] = sorted(winners, key=lambda item: item[1].get('elapsed') or 0)
+        print(f"\r竞速进度: {done_groups}/{len(groups)} 个频道, 已探测 {probes_launched} 个源", end='')
+
+    start_time = time.time()
+    pool_stats.reset()
+    dns_resolver.reset_stats()
+    _raise_fd_limit(max_in_flight + TIER_CONNECT_LIMIT + 256)
+    asyncio.run(_async_best_sources(groups, per_channel, stagger, max_in_flight, per_host, on_group_done))
+
+    source_count = sum(len(winners) for winners in best.values())
+    output_file = os.path.join(output_dir, f"最佳源_{source_count}个.m3u")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        for key in groups:
+            for entry, result in best.get(key, ()):
+                extinf = epg_index.annotate(entry) if epg_index is not None else entry.extinf
+                if extinf:
+                    f.write(f"{extinf}\n")
+                f.write(f"{entry.url}\n")
+
+    print(f"\n\n竞速完成! 耗时 {time.time() - start_time:.1f} 秒")
+    print(f"频道: 共 {len(groups)} 个, 找到可用源 {len(best)} 个")
+    print(f"探测: 实际探测 {probes_launched} 个源, 节省 {candidate_total - probes_launched} 个")
+    print(f"连接池: {pool_stats.summary()}")
+    print(f"结果已保存到: {output_file}")
+
+    return ask_continue()
+
+# 抽样估计模式配置
+SAMPLE_MIN_PER_HOST = 3         # 每个主机第一轮抽样的链接数量
+SAMPLE_MAX_PER_HOST = 10        # 第一轮有失败但能连上的主机扩大抽样到该数量
+SAMPLE_Z = 1.96                 # 95%置信区间对应的正态分位数
+SAMPLE_REPORT_FILE = 'sample_report.json'
+SAMPLE_TOP = 10                 # 控制台中列出的主机/分组数量
+
+def wilson_interval(ok, n, population=None, z=SAMPLE_Z):
+    """可用比例的Wilson置信区间, 返回 (下界, 上界)
+
+    提供 population 时按有限总体修正区间宽度, 全部抽到时区间退化为实际比例
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = ok / n
+    if population is not None and n >= population:
+        return p, p
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * ((p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5) / denom
+    if population is not None and population > 1:
+        half *= ((population - n) / (population - 1)) ** 0.5
+    # 修正后区间变窄, 但全部可用/全部不可用时对应的一端仍应是1/0
+    low = 0.0 if ok == 0 else max(0.0, center - half)
+    high = 1.0 if ok == n else min(1.0, center + half)
+    return low, high
+
+def combine_strata(parts, z=SAMPLE_Z):
+    """合并各层(主机)的抽样结果, 返回 (估计值, 下界, 上界)
+
+    parts 为 (权重, 可用数, 抽样数, 总体数) 的列表, 估计值按权重加权。
+    方差使用Agresti-Coull修正后的比例, 避免全部可用或全部不可用的层方差为0
+    """
+    total_weight = sum(weight for weight, _, n, _ in parts if n)
+    if not total_weight:
+        return 0.0, 0.0, 1.0
+    estimate = variance = 0.0
+    for weight, ok, n, population in parts:
+        if not n:
+            continue
+        share = weight / total_weight
+        estimate += share * ok / n
+        if n < population:
+            adjusted_n = n + z * z
+            adjusted_p = (ok + z * z / 2) / adjusted_n
+            fpc = (population - n) / (population - 1) if population > 1 else 0.0
+            variance += share * share * adjusted_p * (1 - adjusted_p) / adjusted_n * fpc
+    half = z * variance ** 0.5
+    return estimate, max(0.0, estimate - half), min(1.0, estimate + half)
+
+class _SampleStratum:
+    """抽样模式中一个主机(主机:端口)的条目统计和抽样结果"""
+
+    __slots__ = ('origin', 'entries', 'urls', 'groups', 'probed', 'ok', 'responded', 'errors')
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.entries = 0        # 条目数量(含重复链接)
+        self.urls = []          # 去重后的 (URL, 分组), 抽样前打乱为抽样顺序
+        self.groups = Counter() # 分组 -> 条目数量
+        self.probed = 0
+        self.ok = 0
+        self.responded = 0      # 收到HTTP响应的抽样数量(含错误状态码)
+        self.errors = Counter()
+
+    @property
+    def alive(self):
+        return self.ok > 0
+
+class _SampleProbe:
+    """待探测的抽样链接, 提供检测引擎需要的url属性"""
+
+    __slots__ = ('url', 'stratum')
+
+    def __init__(self, url, stratum):
+        self.url = url
+        self.stratum = stratum
+
+def _stratified_order(urls, rng):
+    """在主机内按分组分层打乱: 各分组轮流取一个, 使少量抽样也能覆盖更多分组"""
+    buckets = {}
+    for item in urls:
+        buckets.setdefault(item[1], []).append(item)
+    queues = list(buckets.values())
+    rng.shuffle(queues)
+    for queue in queues:
+        rng.shuffle(queue)
+    ordered = []
+    index = 0
+    while len(ordered) < len(urls):
+        for queue in queues:
+            if index < len(queue):
+                ordered.append(queue[index])
+        index += 1
+    return ordered
+
+def _format_ratio(estimate, low, high):
+    return f"{estimate * 100:.1f}% (95%置信区间 {low * 100:.1f}%-{high * 100:.1f}%)"
+
+def check_sampled_health(source, min_per_host=SAMPLE_MIN_PER_HOST, max_per_host=SAMPLE_MAX_PER_HOST,
+                         max_in_flight=ASYNC_MAX_IN_FLIGHT, per_host=ASYNC_PER_HOST_LIMIT,
+                         use_cache=True, seed=None, epg_index=None):
+    """按主机分层抽样, 快速估计超大列表的可用率
+
+    每个主机先随机抽 min_per_host 个链接(主机内按分组轮流抽取), 除全部可用和
+    完全连不上的主机外再扩大到 max_per_host 个。输出整体、各主机和各分组的可用率估计及95%
+    置信区间(sample_report.json), 并把抽样中至少有一个可用链接的主机上的全部
+    条目写入列表, 作为完整检测的输入
+    """
+    import json
+    import random
+
+    entries = open_m3u_entries(source)
+    if entries is None:
+        print("无法加载M3U内容")
+        return
+
+    output_dir = "m3u_check_result"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # 分层需要看到每个主机的全部链接, 这里读完整个列表
+    strata = {}
+    seen_urls = set()
+    entries = list(entries)
+    for entry in entries:
+        origin = get_url_origin(entry.url)
+        stratum = strata.get(origin)
+        if stratum is None:
+            stratum = strata[origin] = _SampleStratum(origin)
+        stratum.entries += 1
+        stratum.groups[entry.group_title] += 1
+        url_key = normalize_url(entry.url)
+        if url_key not in seen_urls:
+            seen_urls.add(url_key)
+            stratum.urls.append((entry.url, entry.group_title))
+    unique_count = len(seen_urls)
+    seen_urls.clear()
+
+    rng = random.Random(seed)
+    for stratum in strata.values():
+        stratum.urls = _stratified_order(stratum.urls, rng)
+
+    print(f"\n共 {len(entries)} 个条目, 去重后 {unique_count} 个链接, 分布在 {len(strata)} 个主机")
+    print(f"每个主机抽样 {min_per_host} 个链接, 有失败但能连上的主机扩大到 {max_per_host} 个")
+
+    cache = ProbeCache(os.path.join(output_dir, PROBE_CACHE_FILE)) if use_cache else None
+    breaker = HostCircuitBreaker()
+    timeouts = AdaptiveTimeouts()
+    retry_budget = RetryBudget()
+    limiter = AsyncAimdLimiter(per_host)
+    result_lock = threading.Lock()
+    planned = 0
+    probed = 0
+
+    def record(probe, result):
+        nonlocal probed
+        with result_lock:
+            probed += 1
+            stratum = probe.stratum
+            stratum.probed += 1
+            if result['status'] == 'ok':
+                stratum.ok += 1
+            if result.get('status_code') is not None:
+                stratum.responded += 1
+            if result['status'] != 'ok':
+                stratum.errors[result.get('error') or '未知错误'] += 1
+            if cache is not None and not result.get('cached') and not result.get('skipped'):
+                cache.put(probe.url, result)
+            print(f"\r抽样进度: {probed}/{planned}", end='')
+
+    def samples(targets):
+        """产出各主机本轮需要探测的链接, 缓存中仍然有效的结果直接计入"""
+        for stratum, start, stop in targets:
+            for url, _ in stratum.urls[start:stop]:
+                probe = _SampleProbe(url, stratum)
+                cached = cache.get(url) if cache is not None else None
+                if cached is not None:
+                    record(probe, cached)
+                    continue
+                yield probe
+
+    start_time = time.time()
+    pool_stats.reset()
+    dns_resolver.reset_stats()
+    try:
+        first_round = [(stratum, 0, min(min_per_host, len(stratum.urls))) for stratum in strata.values()]
+        planned = sum(stop for _, _, stop in first_round)
+        run_async_checks(samples(first_round), record, max_in_flight=max_in_flight, per_host=per_host,
+                         breaker=breaker, timeouts=timeouts, retry_budget=retry_budget, limiter=limiter)
+        # 全部可用或完全连不上的主机不再扩大抽样; 能连上但有失败的主机(包括恰好
+        # 抽到的都是失效链接的主机)扩大抽样
+        second_round = [(stratum, stratum.probed, min(max_per_host, len(stratum.urls)))
+                        for stratum in strata.values()
+                        if stratum.ok < stratum.probed and (stratum.ok or stratum.responded)
+                        and stratum.probed < min(max_per_host, len(stratum.urls))]
+        if second_round:
+            planned += sum(stop - start for _, start, stop in second_round)
+            run_async_checks(samples(second_round), record, max_in_flight=max_in_flight, per_host=per_host,
+                             breaker=breaker, timeouts=timeouts, retry_budget=retry_budget, limiter=limiter)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    overall = combine_strata([(s.entries, s.ok, s.probed, len(s.urls)) for s in strata.values()])
+    hosts = []
+    for stratum in sorted(strata.values(), key=lambda s: -s.entries):
+        low, high = wilson_interval(stratum.ok, stratum.probed, len(stratum.urls))
+        hosts.append({
+            'origin': stratum.origin,
+            'entries': stratum.entries,
+            'urls': len(stratum.urls),
+            'sampled': stratum.probed,
+            'ok': stratum.ok,
+            'estimate': stratum.ok / stratum.probed if stratum.probed else 0.0,
+            'low': low,
+            'high': high,
+            'alive': stratum.alive,
+            'reachable': stratum.ok + stratum.responded > 0,
+            'error': stratum.errors.most_common(1)[0][0] if stratum.errors else None,
+        })
+
+    # 分组的可用率按其条目在各主机上的分布, 用各主机的估计加权得到
+    group_parts = {}
+    for stratum in strata.values():
+        for group, count in stratum.groups.items():
+            group_parts.setdefault(group, []).append((count, stratum.ok, stratum.probed, len(stratum.urls)))
+    groups = []
+    for group, parts in group_parts.items():
+        estimate, low, high = combine_strata(parts)
+        groups.append({
+            'group': group,
+            'entries': sum(part[0] for part in parts),
+            'hosts': len(parts),
+            'estimate': estimate,
+            'low': low,
+            'high': high,
+        })
+    groups.sort(key=lambda item: -item['entries'])
+
+    alive_entries = [entry for entry in entries if strata[get_url_origin(entry.url)].alive]
+    output_file = os.path.join(output_dir, f"抽样_存活主机_{len(alive_entries)}个.m3u")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        for entry in alive_entries:
+            extinf = epg_index.annotate(entry) if epg_index is not None else entry.extinf
+            if extinf:
+                f.write(f"{extinf}\n")
+            f.write(f"{entry.url}\n")
+
+    estimate, low, high = overall
+    report_file = os.path.join(output_dir, SAMPLE_REPORT_FILE)
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'entries': len(entries),
+            'urls': unique_count,
+            'sampled': probed,
+            'overall': {'estimate': estimate, 'low': low, 'high': high},
+            'hosts': hosts,
+            'groups': groups,
+        }, f, ensure_ascii=False, indent=2)
+
+    dead_hosts = [host for host in hosts if not host['alive']]
+    print(f"\n\n抽样完成! 耗时 {time.time() - start_time:.1f} 秒")
+    print(f"抽样: 探测 {probed} 个链接, 占去重后链接的 {probed / unique_count * 100 if unique_count else 0:.1f}%")
+    print(f"整体可用率估计: {_format_ratio(*overall)}")
+    print(f"主机: 存活 {len(hosts) - len(dead_hosts)} 个, 疑似不可用 {len(dead_hosts)} 个 "
+          f"(涉及 {sum(host['entries'] for host in dead_hosts)} 个条目)")
+    if dead_hosts:
+        print("\n条目最多的疑似不可用主机:")
+        for host in dead_hosts[:SAMPLE_TOP]:
+            print(f"  {host['origin']}: {host['entries']} 个条目, 抽样 {host['sampled']} 个全部失败 ({host['error']})")
+    if groups:
+        print("\n条目最多的分组:")
+        for group in groups[:SAMPLE_TOP]:
+            print(f"  {group['group'] or '(无分组)'}: {group['entries']} 个条目, "
+                  f"可用率 {_format_ratio(group['estimate'], group['low'], group['high'])}")
+    print(f"\n存活主机上的全部条目: {output_file}")
+    print(f"抽样报告: {report_file}")
+
+    return ask_continue()
+
+# 守护进程模式配置
+DAEMON_RATE = 20                  # 每秒最多发起的探测数量
+DAEMON_MAX_IN_FLIGHT = 200        # 同时进行的探测数量上限
+DAEMON_MIN_INTERVAL = 60          # 刚失败或状态反复变化的流的检测间隔(秒)
+DAEMON_BASE_INTERVAL = 600        # 可用的流第一次复查的间隔(秒), 之后每连续可用一次翻倍
+DAEMON_MAX_INTERVAL = 6 * 3600    # 检测间隔上限(秒), 长期稳定(可用或不可用)的流按该间隔复查
+DAEMON_HISTORY = 8                # 判断状态是否反复变化时看最近几次结果
+DAEMON_FLAP_CHANGES = 2           # 最近几次结果中状态变化达到该次数视为不稳定
+DAEMON_JITTER = 0.1               # 检测间隔的随机浮动比例, 避免同一批流总在同一时刻到期
+DAEMON_WRITE_INTERVAL = 10        # 输出文件最短的更新间隔(秒)
+DAEMON_REPORT_INTERVAL = 60       # 打印运行状态的间隔(秒)
+DAEMON_RELOAD_INTERVAL = 3600     # 重新加载播放列表源的间隔(秒)
+DAEMON_OUTPUTS = (('全部', '/all.m3u'), ('IPv4', '/ipv4.m3u'), ('IPv6', '/ipv6.m3u'))  # (输出文件名, 对应的HTTP路径)
+
+# 内置HTTP服务配置
+SERVE_BIND = '127.0.0.1'
+SERVE_PORT = 8080
+SERVE_GZIP_LEVEL = 6
+SERVE_NO_GROUP = '未分组'           # 没有group-title的条目所在的分组名
+SERVE_CONTENT_TYPE = 'audio/x-mpegurl; charset=utf-8'
+SERVE_IDLE_TIMEOUT = 15            # 等待下一个请求(含读取请求头)的最长时间(秒), 超时关闭keep-alive连接
+
+def _accepts_gzip(accept_encoding):
+    """按Accept-Encoding中的q值判断客户端是否接受gzip, gzip;q=0 表示拒绝"""
+    wildcard = None
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, sep, value = param.partition('=')
+            if sep and name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ('gzip', 'x-gzip'):
+            return q > 0
+        if coding == '*':
+            wildcard = q > 0
+    return bool(wildcard)
+
+class _RenderedPlaylist:
+    """预先渲染好的一个HTTP响应: 原始内容、gzip压缩后的内容和各自的ETag"""
+
+    __slots__ = ('body', 'gzipped', 'etag', 'gzip_etag', 'content_type')
+
+    def __init__(self, body, content_type=SERVE_CONTENT_TYPE):
+        import gzip
+        import hashlib
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.body = body
+        # mtime=0使相同内容的压缩结果相同
+        self.gzipped = gzip.compress(body, SERVE_GZIP_LEVEL, mtime=0)
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+        self.content_type = content_type
+
+class PlaylistServer:
+    """从内存中的检测结果提供播放列表的轻量HTTP服务
+
+    响应内容在结果变化时由 update 预先渲染并压缩, 处理请求时只需查表;
+    支持gzip、ETag/If-None-Match(304)、HEAD和keep-alive
+    """
+
+    def __init__(self):
+        self.responses = {}     # 路径 -> _RenderedPlaylist
+        self.requests = 0
+        self.not_modified = 0
+
+    def update(self, bodies):
+        """用新的 {路径: 内容} 替换全部响应, 内容未变的路径沿用已压缩的结果"""
+        import json
+        responses = {}
+        for path, body in bodies.items():
+            old = self.responses.get(path)
+            responses[path] = old if old is not None and old.body == body else _RenderedPlaylist(body)
+        index = [{'path': path, 'entries': body.count(b'\nhttp')} for path, body in bodies.items()]
+        index = json.dumps(index, ensure_ascii=False, indent=2).encode('utf-8')
+        old = self.responses.get('/index.json')
+        responses['/index.json'] = (old if old is not None and old.body == index
+                                    else _RenderedPlaylist(index, 'application/json; charset=utf-8'))
+        self.responses = responses
+
+    def _respond(self, method, path, headers):
+        """返回 (状态行, 响应头列表, 响应体)"""
+        from urllib.parse import unquote
+        if method not in ('GET', 'HEAD'):
+            return '405 Method Not Allowed', [('Allow', 'GET, HEAD')], b''
+        path = unquote(path.split('?', 1)[0])
+        response = self.responses.get('/all.m3u' if path == '/' else path)
+        if response is None:
+            return '404 Not Found', [], b''
+        use_gzip = _accepts_gzip(headers.get('accept-encoding', ''))
+        etag = response.gzip_etag if use_gzip else response.etag
+        response_headers = [('ETag', etag), ('Vary', 'Accept-Encoding'), ('Cache-Control', 'no-cache')]
+        if_none_match = headers.get('if-none-match', '')
+        if if_none_match and (if_none_match == '*' or etag in (tag.strip() for tag in if_none_match.split(','))):
+            self.not_modified += 1
+            return '304 Not Modified', response_headers, b''
+        response_headers.append(('Content-Type', response.content_type))
+        if use_gzip:
+            response_headers.append(('Content-Encoding', 'gzip'))
+        return '200 OK', response_headers, response.gzipped if use_gzip else response.body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                # 空闲或发送请求头过慢的连接不再占用
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), SERVE_IDLE_TIMEOUT)
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                if len(parts) != 3:
+                    break
+                method, path, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                self.requests += 1
+                status, response_headers, body = self._respond(method, path, headers)
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+                response_headers.append(('Content-Length', str(len(body))))
+                response_headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+                head_lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in response_headers]
+                writer.write(('\r\n'.join(head_lines) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=SERVE_BIND, port=SERVE_PORT):
+        return await asyncio.start_server(self.handle, host, port, backlog=1024)
+
+def next_check_interval(ok, streak, flapping):
+    """根据最近的检测历史计算下次检测的间隔(秒)
+
+    状态反复变化的流按最短间隔检测; 失败的流前几次按最短间隔复查, 之后和可用的流
+    一样随连续次数翻倍, 直到上限
+    """
+    if flapping:
+        return DAEMON_MIN_INTERVAL
+    base = DAEMON_BASE_INTERVAL if ok else DAEMON_MIN_INTERVAL
+    return min(DAEMON_MAX_INTERVAL, base * 2 ** min(max(streak - 1, 0), 16))
+
+class _MonitoredStream:
+    """守护进程中一个(规范化)URL的状态, 相同URL的多个条目共用"""
+
+    __slots__ = ('url', 'entries', 'order', 'ok', 'ipv6', 'checks', 'history', 'streak',
+                 'next_check', 'last_checked', 'active', 'video')
+
+    def __init__(self, url, order):
+        self.url = url
+        self.entries = []
+        self.order = order      # 在播放列表中首次出现的位置, 输出按该顺序排列
+        self.ok = None          # 尚未检测时为None
+        self.ipv6 = False
+        self.checks = 0
+        self.history = 0        # 最近的结果, 每一位表示一次检测是否可用
+        self.streak = 0         # 当前状态连续出现的次数
+        self.next_check = 0.0
+        self.last_checked = None
+        self.active = True      # 重新加载后已不在列表中的流置为False
+        self.video = None       # 最近一次从码流中解析出的视频参数
+
+    @property
+    def flapping(self):
+        window = min(self.checks, DAEMON_HISTORY)
+        if window < 2:
+            return False
+        changes = (self.history ^ (self.history >> 1)) & ((1 << (window - 1)) - 1)
+        return bin(changes).count('1') >= DAEMON_FLAP_CHANGES
+
+    def record(self, ok):
+        """记录一次检测结果, 返回状态是否发生变化"""
+        changed = ok != self.ok
+        self.streak = 1 if changed else self.streak + 1
+        self.ok = ok
+        self.checks += 1
+        self.history = ((self.history << 1) | int(ok)) & ((1 << DAEMON_HISTORY) - 1)
+        return changed
+
+class MonitorDaemon:
+    """持续监测播放列表的守护进程
+
+    所有流按下次检测时间放在优先队列中, 到期后以不超过 rate 的速率重新探测,
+    间隔由 next_check_interval 根据最近的结果调整。状态有变化时原子地更新
+    output_dir 中的可用列表(全部/IPv4/IPv6)。提供 serve=(地址, 端口) 时在同一
+    事件循环中运行 PlaylistServer
+    """
+
+    def __init__(self, sources, output_dir="m3u_check_result", rate=DAEMON_RATE,
+                 max_in_flight=DAEMON_MAX_IN_FLIGHT, per_host=ASYNC_PER_HOST_LIMIT,
+                 reload_interval=DAEMON_RELOAD_INTERVAL, use_cache=True, serve=None):
+        import random
+        self.sources = sources
+        self.output_dir = output_dir
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.reload_interval = reload_interval
+        self.use_cache = use_cache
+        self.rng = random.Random()
+        self.streams = {}       # 规范化URL -> _MonitoredStream
+        self.queue = []         # (下次检测时间, 序号, 流)
+        self.sequence = 0
+        self.probes = 0
+        self.changes = 0
+        self.dirty = False
+        self.written = {}       # 输出文件 -> 最近一次写入内容的摘要
+        self.serve = serve      # (地址, 端口), 为None时不启动HTTP服务
+        self.server = PlaylistServer() if serve is not None else None
+
+    def _schedule(self, stream, delay):
+        import heapq
+        if delay > 0:
+            delay *= 1 + self.rng.uniform(-DAEMON_JITTER, DAEMON_JITTER)
+        stream.next_check = time.monotonic() + delay
+        self.sequence += 1
+        heapq.heappush(self.queue, (stream.next_check, self.sequence, stream))
+
+    def read_sources(self):
+        """读取播放列表源的全部条目(在线程中执行), 无法加载时返回None"""
+        source = self.sources[0] if len(self.sources) == 1 else self.sources
+        entries = open_m3u_entries(source)
+        return list(entries) if entries is not None else None
+
+    def load(self, entries, cache):
+        """合并新读取的条目, 新的流立即进入队列, 已删除的流停止检测"""
+        if entries is None:
+            print(f"[{datetime.now():%H:%M:%S}] 无法加载播放列表, 继续使用当前列表")
+            return
+        streams = {}
+        for entry in entries:
+            key = normalize_url(entry.url)
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = self.streams.get(key) or _MonitoredStream(entry.url, len(streams))
+                stream.order = len(streams) - 1
+                stream.entries = []
+            stream.entries.append(entry)
+
+        added = 0
+        for key, stream in streams.items():
+            if key in self.streams:
+                continue
+            added += 1
+            # 缓存中仍然有效的结果作为初始状态, 在其剩余有效期内随机安排复查
+            cached = cache.get(stream.url) if cache is not None else None
+            if cached is not None:
+                stream.record(cached['status'] == 'ok')
+                stream.ipv6 = cached.get('ipv6', stream.entries[0].is_ipv6)
+                stream.video = cached.get('video')
+                self._schedule(stream, self.rng.uniform(0, next_check_interval(stream.ok, 1, False)))
+            else:
+                self._schedule(stream, 0)
+        for key, stream in self.streams.items():
+            if key not in streams:
+                stream.active = False
+        removed = len(self.streams) - (len(streams) - added)
+        self.streams = streams
+        self.dirty = True
+        print(f"[{datetime.now():%H:%M:%S}] 已加载 {len(streams)} 个链接 (新增 {added}, 移除 {removed})")
+
+    def render_playlists(self):
+        """按播放列表顺序渲染全部可用条目, 返回 {HTTP路径: 内容}
+
+        除全部/IPv4/IPv6外, 每个group-title还有一个 /group/<分组名>.m3u
+        """
+        from urllib.parse import quote
+        playlists = {path: ["#EXTM3U"] for _, path in DAEMON_OUTPUTS}
+        for stream in sorted(self.streams.values(), key=lambda s: s.order):
+            if not stream.ok:
+                continue
+            family = '/ipv6.m3u' if stream.ipv6 else '/ipv4.m3u'
+            for entry in stream.entries:
+                group = f"/group/{entry.group_title or SERVE_NO_GROUP}.m3u"
+                lines = playlists.get(group)
+                if lines is None:
+                    lines = playlists[group] = ["#EXTM3U"]
+                extinf = annotate_video(entry.extinf, stream.video)
+                for target in (playlists['/all.m3u'], playlists[family], lines):
+                    if extinf:
+                        target.append(extinf)
+                    target.append(entry.url)
+        return {path: ("\n".join(lines) + "\n").encode('utf-8') for path, lines in playlists.items()}
+
+    def write_outputs(self):
+        """内容有变化的输出文件先写入临时文件再替换, 读取方不会看到写了一半的文件
+
+        启用了HTTP服务时同时更新预先渲染的响应
+        """
+        import hashlib
+        self.dirty = False
+        playlists = self.render_playlists()
+        if self.server is not None:
+            self.server.update(playlists)
+        for label, key in DAEMON_OUTPUTS:
+            content = playlists[key]
+            digest = hashlib.sha1(content).hexdigest()
+            path = os.path.join(self.output_dir, f"{label}_可用.m3u")
+            if self.written.get(path) == digest:
+                continue
+            with open(path + '.part', 'wb') as f:
+                f.write(content)
+            os.replace(path + '.part', path)
+            self.written[path] = digest
+
+    def summary(self):
+        checked = [stream for stream in self.streams.values() if stream.ok is not None]
+        working = sum(1 for stream in checked if stream.ok)
+        flapping = sum(1 for stream in checked if stream.flapping)
+        text = (f"已探测 {self.probes} 次, 状态变化 {self.changes} 次, "
+                f"可用 {working}/{len(checked)} (共 {len(self.streams)} 个链接), 不稳定 {flapping} 个")
+        if self.server is not None:
+            text += f", HTTP请求 {self.server.requests} 次 (304: {self.server.not_modified})"
+        return text
+
+    async def _probe(self, stream, pool, limiter, timeouts, cache):
+        url = stream.url
+        host = get_url_host(url)
+        origin = get_url_origin(url)
+        addrs = await asyncio.wrap_future(dns_resolver.submit(host))
+        if not addrs:
+            result = dns_failure_result(host)
+        else:
+            await limiter.acquire(origin)
+            result = None
+            try:
+                result = await check_stream_async(url, timeouts.timeout_for(origin), pool)
+            finally:
+                await limiter.release(origin, result)
+            timeouts.observe(origin, result)
+            result['ipv6'] = is_ipv6_addresses(addrs)
+        self.probes += 1
+        if cache is not None:
+            cache.put(url, result)
+        if not stream.active:
+            return
+        ok = result['status'] == 'ok'
+        ipv6 = result.get('ipv6', stream.entries[0].is_ipv6)
+        first = stream.ok is None
+        if stream.record(ok) or ipv6 != stream.ipv6:
+            self.changes += not first
+            self.dirty = True
+        stream.ipv6 = ipv6
+        if result.get('video') and result['video'] != stream.video:
+            stream.video = result['video']
+            self.dirty = True
+        stream.last_checked = time.time()
+        self._schedule(stream, next_check_interval(ok, stream.streak, stream.flapping))
+
+    async def run(self):
+        import heapq
+        import signal
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        cache = ProbeCache(os.path.join(self.output_dir, PROBE_CACHE_FILE)) if self.use_cache else None
+        pool = AsyncConnectionPool(self.per_host)
+        limiter = AsyncAimdLimiter(self.per_host)
+        timeouts = AdaptiveTimeouts()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        self.load(await loop.run_in_executor(None, self.read_sources), cache)
+        self.write_outputs()
+        http_server = None
+        if self.server is not None:
+            http_server = await self.server.start(*self.serve)
+            print(f"[{datetime.now():%H:%M:%S}] HTTP服务: http://{self.serve[0]}:{self.serve[1]}/all.m3u "
+                  f"(另有 /ipv4.m3u /ipv6.m3u /group/<分组名>.m3u /index.json)")
+
+        next_launch = next_write = next_report = time.monotonic()
+        next_reload = time.monotonic() + self.reload_interval
+
+        async def probe(stream):
+            try:
+                await self._probe(stream, pool, limiter, timeouts, cache)
+            except Exception as e:
+                print(f"[{datetime.now():%H:%M:%S}] 检测出错 ({stream.url}): {e}")
+                self._schedule(stream, DAEMON_MIN_INTERVAL)
+            finally:
+                in_flight.release()
+
+        print(f"[{datetime.now():%H:%M:%S}] 开始持续检测 (每秒最多 {self.rate} 次探测, 按 Ctrl+C 停止)")
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if self.dirty and now >= next_write:
+                    self.write_outputs()
+                    next_write = now + DAEMON_WRITE_INTERVAL
+                if now >= next_report:
+                    print(f"[{datetime.now():%H:%M:%S}] {self.summary()}")
+                    next_report = now + DAEMON_REPORT_INTERVAL
+                if now >= next_reload:
+                    # 只有读取在线程中进行, 合并在事件循环中完成, 不与检测回调同时修改队列
+                    self.load(await loop.run_in_executor(None, self.read_sources), cache)
+                    next_reload = time.monotonic() + self.reload_interval
+
+                # 跳过已移除的流和重新加载前留下的过期队列项
+                while self.queue and (not self.queue[0][2].active or self.queue[0][2].next_check != self.queue[0][0]):
+                    heapq.heappop(self.queue)
+                due = self.queue[0][0] if self.queue else now + 1
+                wait = max(due, next_launch) - now
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(stop.wait(), min(wait, 1.0))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await in_flight.acquire()
+                _, _, stream = heapq.heappop(self.queue)
+                next_launch = max(next_launch, now) + 1 / self.rate
+                task = asyncio.create_task(probe(stream))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if http_server is not None:
+                http_server.close()
+            self.write_outputs()
+            pool.close()
+            if cache is not None:
+                cache.close()
+            print(f"\n[{datetime.now():%H:%M:%S}] 已停止: {self.summary()}")
+
+def run_daemon(sources, **kwargs):
+    """以守护进程模式持续检测 sources, 直到收到SIGINT/SIGTERM"""
+    _raise_fd_limit(kwargs.get('max_in_flight', DAEMON_MAX_IN_FLIGHT) + 256)
+    asyncio.run(MonitorDaemon(sources, **kwargs).run())
+
+def _input_positive_int(prompt, default):
+    """读取正整数, 直接回车使用默认值"""
+    while True:
+        value = input(f"{prompt} (默认 {default}): ").strip()
+        if not value:
+            return default
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+        print("请输入正整数")
+
+def _input_m3u_sources():
+    """读取一个或多个m3u源(用空格分隔), 多个源时返回列表, 有无效的源时返回None"""
+    text = input("请输入m3u文件路径或URL (多个源用空格分隔): ").strip()
+    if is_valid_url(text) or os.path.exists(text):
+        return text
+    sources = text.split()
+    if len(sources) > 1 and all(is_valid_url(source) or os.path.exists(source) for source in sources):
+        return sources
+    return None
+
+def choose_check_engine():
+    """选择检测引擎, 返回 (engine, 全局并发, 单主机并发, 进程数)"""
+    while True:
+        print("\n请选择检测引擎:")
+        print("1. 多线程 (20线程)")
+        print("2. 异步引擎 (适合大规模列表)")
+        print("3. 多进程分片 (适合超大列表, 每个进程运行异步引擎)")
+        choice = input("\n请选择 (1-3, 默认1): ").strip()
+        if choice in ('', '1'):
+            return 'thread', ASYNC_MAX_IN_FLIGHT, ASYNC_PER_HOST_LIMIT, None
+        if choice in ('2', '3'):
+            workers = _input_positive_int("进程数", os.cpu_count() or 1) if choice == '3' else None
+            max_in_flight = _input_positive_int("全局最大并发数", ASYNC_MAX_IN_FLIGHT)
+            per_host = _input_positive_int("单主机最大并发数", ASYNC_PER_HOST_LIMIT)
+            return ('sharded' if choice == '3' else 'async'), max_in_flight, per_host, workers
+        print("无效的选择，请重新输入")
+
+def get_m3u_source(epg_index=None, network_check=None):
+    """获取m3u源
+
+    network_check 为后台网络环境检测的Future, 在第一次开始检测时输出其结果
+    """
     while True:
         print("\n请选择m3u源类型:")
         print("1. 输入m3u文件URL")
@@ -567,17 +5270,66 @@ def get_m3u_source():
         print("3. 使用默认本地文件(./iptv.m3u)")
         print("4. 检测全部节点可用性")
         print("5. 退出程序")  # 新增退出选项
+        print("6. 为每个频道挑选最快的可用源")
+        print("7. 抽样快速估计可用率 (适合超大列表)")
         
-        choice = input("\n请选择 (1-5): ").strip()
+        choice = input("\n请选择 (1-7): ").strip()
         
         if choice == '5':
             print("程序已退出")
             sys.exit(0)
+
+        if choice == '6':
+            source = _input_m3u_sources()
+            if source:
+                per_channel = _input_positive_int("每个频道保留的可用源数量", BEST_SOURCES_PER_CHANNEL)
+                if network_check is not None:
+                    report_network_check(network_check)
+                    network_check = None
+                if not check_best_sources(source, per_channel=per_channel, epg_index=epg_index):
+                    print("程序已退出")
+                    sys.exit(0)
+                continue
+            print("无效的文件路径或URL，请重新输入")
+            continue
             
+        if choice == '7':
+            source = _input_m3u_sources()
+            if source:
+                max_per_host = _input_positive_int("每个主机最多抽样的链接数量", SAMPLE_MAX_PER_HOST)
+                if network_check is not None:
+                    report_network_check(network_check)
+                    network_check = None
+                if not check_sampled_health(source, min_per_host=min(SAMPLE_MIN_PER_HOST, max_per_host),
+                                            max_per_host=max_per_host, epg_index=epg_index):
+                    print("程序已退出")
+                    sys.exit(0)
+                continue
+            print("无效的文件路径或URL，请重新输入")
+            continue
+
         if choice == '4':
-            source = input("请输入m3u文件路径或URL: ").strip()
-            if is_valid_url(source) or os.path.exists(source):
-                continue_check = check_all_streams(source)
+            source = _input_m3u_sources()
+            if source:
+                engine, max_in_flight, per_host, workers = choose_check_engine()
+                use_cache = input("是否复用未过期的检测结果缓存？(y/n, 默认y): ").strip().lower() != 'n'
+                prometheus = input("是否额外导出Prometheus格式的耗时指标？(y/n, 默认n): ").strip().lower() == 'y'
+                measure = input("是否测量可用流的持续速率并按速率排序？(y/n, 默认n): ").strip().lower() == 'y'
+                measure_options = {}
+                if measure:
+                    measure_options = {
+                        'measure_window': _input_positive_int("每个流的测量时长(秒)", int(MEASURE_WINDOW)),
+                        'measure_bytes': _input_positive_int("每个流最多读取(MB)", MEASURE_MAX_BYTES // (1024 * 1024))
+                                         * 1024 * 1024,
+                        'bandwidth_cap': _input_positive_int("全局带宽上限(Mbps)", MEASURE_BANDWIDTH_CAP),
+                    }
+                continue_check = check_all_streams(source, engine=engine,
+                                                   max_in_flight=max_in_flight, per_host=per_host,
+                                                   use_cache=use_cache, epg_index=epg_index,
+                                                   prometheus=prometheus, workers=workers,
+                                                   measure=measure, network_check=network_check,
+                                                   **measure_options)
+                network_check = None
                 if not continue_check:
                     print("程序已退出")
                     sys.exit(0)
@@ -606,23 +5358,76 @@ def get_m3u_source():
         else:
             print("无效的选择,请重新输入")
 
+def _parse_host_port(text):
+    """解析 HOST:PORT 或 [IPv6]:PORT 形式的地址"""
+    import argparse
+    host, sep, port = text.rpartition(':')
+    if not sep or not port.isdigit() or not host:
+        raise argparse.ArgumentTypeError(f'地址格式应为 HOST:PORT 或 [IPv6]:PORT: {text}')
+    return host.strip('[]'), int(port)
+
+def parse_args(argv=None):
+    """解析命令行参数, 不带m3u源时进入交互菜单"""
+    import argparse
+    parser = argparse.ArgumentParser(description='IPTV流媒体检测工具 (不带参数时进入交互菜单)')
+    parser.add_argument('sources', nargs='*', help='m3u文件路径或URL, 可以有多个')
+    parser.add_argument('--daemon', action='store_true', help='持续检测, 按每个流的历史调整复查间隔')
+    parser.add_argument('--engine', choices=('thread', 'async', 'sharded'), default='thread',
+                        help='单次检测使用的引擎 (默认 thread)')
+    parser.add_argument('--workers', type=int, help='分片引擎的进程数 (默认CPU核数)')
+    parser.add_argument('--max-in-flight', type=int, help='全局最大并发数')
+    parser.add_argument('--per-host', type=int, default=ASYNC_PER_HOST_LIMIT, help='单主机最大并发数')
+    parser.add_argument('--rate', type=float, default=DAEMON_RATE, help='守护进程每秒最多发起的探测数量')
+    parser.add_argument('--reload-interval', type=float, default=DAEMON_RELOAD_INTERVAL,
+                        help='守护进程重新加载播放列表源的间隔(秒)')
+    parser.add_argument('--serve', nargs='?', type=int, const=SERVE_PORT, metavar='PORT',
+                        help=f'以守护进程模式运行并通过HTTP提供可用列表 (默认端口 {SERVE_PORT})')
+    parser.add_argument('--bind', default=SERVE_BIND, help=f'HTTP服务监听的地址 (默认 {SERVE_BIND})')
+    parser.add_argument('--output-dir', default='m3u_check_result', help='结果输出目录')
+    parser.add_argument('--no-cache', action='store_true', help='不使用检测结果缓存')
+    parser.add_argument('--no-history', action='store_true', help='不记录检测历史, 可用列表不按可靠性排序')
+    parser.add_argument('--min-height', type=int, default=0, metavar='PIXELS',
+                        help='分辨率低于该高度(如720)的可用流单独输出到 *_低画质 文件')
+    parser.add_argument('--rank', choices=('reliability', 'quality'), default='reliability',
+                        help='可用列表的排序: reliability 按可靠性, quality 先按分辨率再按可靠性')
+    parser.add_argument('--ipv4-target', type=_parse_host_port, default=NETWORK_PROBE_TARGETS['ipv4'],
+                        metavar='HOST:PORT', help='检查IPv4网络时连接的地址')
+    parser.add_argument('--ipv6-target', type=_parse_host_port, default=NETWORK_PROBE_TARGETS['ipv6'],
+                        metavar='[HOST]:PORT', help='检查IPv6网络时连接的地址')
+    args = parser.parse_args(argv)
+    if args.serve is not None:
+        args.daemon = True
+    if args.daemon and not args.sources:
+        parser.error('--daemon/--serve 需要至少一个m3u源')
+    return args
+
 def main():
-    # 检查网络环境
-    print("正在检查网络环境...")
-    network_info = check_network_capabilities()
-    
-    if network_info['ipv4']['available']:
-        print(f"√ IPv4 网络可用 (速度评分: {network_info['ipv4']['speed']:.2f})")
-    if network_info['ipv6']['available']:
-        print(f"√ IPv6 网络可用 (速度评分: {network_info['ipv6']['speed']:.2f})")
-    
-    print(f"\n将优先使用 {network_info['preference'].upper()} 网络")
-    
+    args = parse_args()
+    # 检查网络环境(后台进行, 同时加载EPG和播放列表)
+    network_check = start_network_check(targets={'ipv4': args.ipv4_target, 'ipv6': args.ipv6_target})
+    if args.sources:
+        # 命令行模式: 不询问任何问题, 适合cron或systemd
+        if args.daemon:
+            network_check.add_done_callback(report_network_check)
+            run_daemon(args.sources, output_dir=args.output_dir, rate=args.rate,
+                       max_in_flight=args.max_in_flight or DAEMON_MAX_IN_FLIGHT, per_host=args.per_host,
+                       reload_interval=args.reload_interval, use_cache=not args.no_cache,
+                       serve=(args.bind, args.serve) if args.serve is not None else None)
+            return
+        source = args.sources[0] if len(args.sources) == 1 else args.sources
+        check_all_streams(source, engine=args.engine, max_in_flight=args.max_in_flight or ASYNC_MAX_IN_FLIGHT,
+                          per_host=args.per_host, use_cache=not args.no_cache, workers=args.workers,
+                          output_dir=args.output_dir, interactive=False, history=not args.no_history,
+                          min_height=args.min_height, rank_quality=args.rank == 'quality',
+                          network_check=network_check)
+        return
+
     # 获取EPG数据
     epg_data = get_epg_data()
-    
+    epg_index = get_epg_index(epg_data) if epg_data else None
+
     # 获取m3u源
-    m3u_source = get_m3u_source()
+    m3u_source = get_m3u_source(epg_index, network_check)
     if not m3u_source:  # 如果返回None，说明已经完成了全部检测
         return
         
@@ -52,7 +52,7 @@ install_deps() {
             apt install -y python3 python3-pip python3-full python3-venv
             
             # 安装系统级依赖包
-            apt install -y python3-requests python3-bs4 ca-certificates
+            apt install -y python3-requests ca-certificates
             
             # 创建虚拟环境
             print_info "创建 Python 虚拟环境..."
@@ -60,7 +60,7 @@ install_deps() {
             
             # 激活虚拟环境并安装包
             print_info "在虚拟环境中安装 Python 包..."
-            /opt/iptv_env/bin/pip install requests beautifulsoup4
+            /opt/iptv_env/bin/pip install requests
             ;;
             
         "CentOS Linux"|"Red Hat Enterprise Linux")
@@ -74,7 +74,7 @@ install_deps() {
             yum install -y python3 python3-pip python3-devel python3-virtualenv
             
             # 安装依赖包
-            yum install -y python3-requests python3-beautifulsoup4 ca-certificates
+            yum install -y python3-requests ca-certificates
             
             # 创建虚拟环境
             print_info "创建 Python 虚拟环境..."
@@ -82,7 +82,7 @@ install_deps() {
             
             # 激活虚拟环境并安装包
             print_info "在虚拟环境中安装 Python 包..."
-            /opt/iptv_env/bin/pip install requests beautifulsoup4
+            /opt/iptv_env/bin/pip install requests
             ;;
             
         *)
@@ -113,11 +113,6 @@ verify_install() {
         exit 1
     fi
     
-    if ! /opt/iptv_env/bin/python3 -c "import bs4" 2>/dev/null; then
-        print_error "beautifulsoup4 模块安装失败"
-        exit 1
-    fi
-    
     print_info "所有依赖安装成功！"
 }
 
@@ -128,8 +123,7 @@ check_deps() {
     # 检查 Python3 和虚拟环境
     if command -v python3 &> /dev/null && [ -d "/opt/iptv_env" ]; then
         # 验证虚拟环境中的包
-        if /opt/iptv_env/bin/python3 -c "import requests" 2>/dev/null && \
-           /opt/iptv_env/bin/python3 -c "import bs4" 2>/dev/null; then
+        if /opt/iptv_env/bin/python3 -c "import requests" 2>/dev/null; then
             print_info "所有依赖已安装，跳过安装步骤"
             return 0
         fi
@@ -0,0 +1,347 @@
+#!/opt/iptv_env/bin/python3
+# -*- coding: utf-8 -*-
+"""IPTV检测性能基准测试
+
+在本机启动模拟的IPTV源站(TS/FLV/HLS/垃圾数据, 可配置延迟、带宽、错误率、
+重定向、429限流和挂起连接), 生成指向这些源站的播放列表, 用iptv.py的检测
+引擎检测, 输出每秒检测数、检测耗时p50/p99、峰值内存和判断准确率。
+结果保存为JSON, 可以用 --compare 与之前的结果对比
+
+    python3 iptv_bench.py --sizes 1000,10000 --engine async --output bench.json
+    python3 iptv_bench.py --sizes 1000,10000 --engine async --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_PORT = 19000              # 第一个模拟源站的端口, 其余源站依次递增
+BENCH_HOSTS = 20                # 模拟源站(主机:端口)数量
+BENCH_DEAD_HOSTS = 2            # 没有监听的端口数量, 用于模拟连不上的主机
+BENCH_BODY_SIZE = 188 * 200     # 媒体响应体大小(字节)
+BENCH_PACKET = 188 * 7          # 按带宽限速时每次发送的字节数
+BENCH_READY_TIMEOUT = 10        # 等待模拟源站启动的时间(秒)
+
+# 流类型: 名称 -> 正确的判断结果是否为可用
+STREAM_KINDS = {
+    'ts': True,
+    'flv': True,
+    'hls': True,
+    'redirect': True,
+    'error': False,
+    'garbage': False,
+    'hang': False,
+    'dead': False,
+}
+
+TS_PACKET = b'\x47\x40\x00\x10' + b'\xff' * 184
+FLV_HEADER = b'FLV\x01\x05\x00\x00\x00\x09\x00\x00\x00\x00'
+HLS_PLAYLIST = b'#EXTM3U\n#EXT-X-TARGETDURATION:5\n#EXTINF:5,\nseg0.ts\n#EXTINF:5,\nseg1.ts\n'
+
+def _media_body(kind, rng):
+    """生成指定类型的响应体"""
+    if kind == 'ts':
+        return TS_PACKET * (BENCH_BODY_SIZE // len(TS_PACKET))
+    if kind == 'flv':
+        return FLV_HEADER + b'\x09' + bytes(BENCH_BODY_SIZE - len(FLV_HEADER) - 1)
+    if kind == 'hls':
+        return HLS_PLAYLIST
+    # 看起来像网页的随机文本
+    alphabet = b'abcdefghijklmnopqrstuvwxyz <>/="'
+    return b'<html>' + bytes(rng.choice(alphabet) for _ in range(2048))
+
+class OriginServer:
+    """模拟的IPTV源站, 每个端口代表一个主机
+
+    请求路径为 /s/<类型>/<编号>, 限流主机同时处理的请求超过 throttle_limit
+    时返回429。延迟在发送响应头之前等待, 带宽限制每个连接的发送速率
+    """
+
+    def __init__(self, latency, jitter, bandwidth, throttle_limit, throttled_ports, seed):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.bandwidth = bandwidth * 1000 / 8 if bandwidth else 0   # kbps -> 字节/秒
+        self.throttle_limit = throttle_limit
+        self.throttled_ports = set(throttled_ports)
+        self.in_flight = {}
+        self.rng = random.Random(seed)
+        self.bodies = {kind: _media_body(kind, self.rng) for kind in ('ts', 'flv', 'hls', 'garbage')}
+
+    async def _send(self, writer, status, reason, headers, body=b''):
+        lines = [f'HTTP/1.1 {status} {reason}']
+        lines += [f'{name}: {value}' for name, value in headers]
+        lines.append(f'Content-Length: {len(body)}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not body or not self.bandwidth or len(body) <= BENCH_PACKET:
+            writer.write(body)
+            await writer.drain()
+            return
+        delay = BENCH_PACKET / self.bandwidth
+        for offset in range(0, len(body), BENCH_PACKET):
+            writer.write(body[offset:offset + BENCH_PACKET])
+            await writer.drain()
+            await asyncio.sleep(delay)
+
+    async def _respond(self, port, path, writer):
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        kind = parts[1] if len(parts) >= 3 and parts[0] == 's' else ''
+        if kind == 'hang':
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+
+        if kind in ('ts', 'flv'):
+            content_type = 'video/mp2t' if kind == 'ts' else 'video/x-flv'
+            await self._send(writer, 200, 'OK', [('Content-Type', content_type)], self.bodies[kind])
+        elif kind == 'hls':
+            await self._send(writer, 200, 'OK', [('Content-Type', 'application/vnd.apple.mpegurl')],
+                             self.bodies['hls'])
+        elif kind == 'garbage':
+            await self._send(writer, 200, 'OK', [('Content-Type', 'text/html')], self.bodies['garbage'])
+        elif kind == 'redirect':
+            await self._send(writer, 302, 'Found', [('Location', f'/s/ts/{parts[2]}')])
+        elif kind == 'error':
+            status, reason = (404, 'Not Found') if self.rng.random() < 0.5 else (500, 'Internal Server Error')
+            await self._send(writer, status, reason, [])
+        else:
+            await self._send(writer, 404, 'Not Found', [])
+
+    async def handle(self, reader, writer):
+        port = writer.get_extra_info('sockname')[1]
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+                method, path, _ = (request_line.split(' ') + ['', ''])[:3]
+                keep_alive = b'connection: close' not in head.lower()
+                if port in self.throttled_ports and self.in_flight.get(port, 0) >= self.throttle_limit:
+                    await self._send(writer, 429, 'Too Many Requests', [('Retry-After', '1')])
+                else:
+                    self.in_flight[port] = self.in_flight.get(port, 0) + 1
+                    try:
+                        await self._respond(port, path, writer)
+                    finally:
+                        self.in_flight[port] -= 1
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ports, ready):
+        servers = [await asyncio.start_server(self.handle, '127.0.0.1', port, backlog=4096) for port in ports]
+        ready.set()
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+def _serve_origin(config, ports, ready):
+    """模拟源站进程的入口"""
+    server = OriginServer(config['latency'], config['jitter'], config['bandwidth'],
+                          config['throttle_limit'], config['throttled_ports'], config['seed'])
+    asyncio.run(server.serve(ports, ready))
+
+def _pick_kind(rng, rates):
+    value = rng.random()
+    for kind, rate in rates:
+        if value < rate:
+            return kind
+        value -= rate
+    return rng.choice(('ts', 'ts', 'flv', 'hls'))
+
+def generate_playlist(path, size, config):
+    """生成指向模拟源站的播放列表, 流类型写在路径中以便事后核对结果"""
+    rng = random.Random(config['seed'] + size)
+    rates = [(kind, config[f'{kind}_rate']) for kind in ('error', 'garbage', 'redirect', 'hang', 'dead')]
+    live_ports = config['ports']
+    dead_ports = config['dead_ports']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('#EXTM3U\n')
+        for i in range(size):
+            kind = _pick_kind(rng, rates)
+            port = rng.choice(dead_ports if kind == 'dead' else live_ports)
+            f.write(f'#EXTINF:-1 tvg-name="基准频道{i}" group-title="基准{i % 10}",基准频道{i}\n')
+            f.write(f'http://127.0.0.1:{port}/s/{kind}/{i}\n')
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def _run_scan(playlist, engine, workers, max_in_flight, per_host, verbose, result_queue):
+    """在独立进程中运行检测, 使峰值内存只包含检测本身"""
+    import resource
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import iptv
+
+    latencies = []
+    confusion = {kind: {'ok': 0, 'fail': 0} for kind in STREAM_KINDS}
+
+    def on_result(entry, result):
+        kind = entry.url.rsplit('/', 2)[-2]
+        confusion[kind]['ok' if result['status'] == 'ok' else 'fail'] += 1
+        total = (result.get('timings') or {}).get('total')
+        if total is not None:
+            latencies.append(total)
+
+    with tempfile.TemporaryDirectory(prefix='iptv_bench_') as output_dir:
+        start = time.monotonic()
+        summary = iptv.check_all_streams(playlist, engine=engine, max_in_flight=max_in_flight, per_host=per_host,
+                                         use_cache=False, workers=workers, output_dir=output_dir,
+                                         on_result=on_result, interactive=False, history=False)
+        elapsed = time.monotonic() - start
+
+    latencies.sort()
+    correct = sum(counts['ok' if STREAM_KINDS[kind] else 'fail'] for kind, counts in confusion.items())
+    total = sum(counts['ok'] + counts['fail'] for counts in confusion.values())
+    result_queue.put({
+        'entries': total,
+        'probed': summary['probed'] if summary else None,
+        'elapsed': round(elapsed, 3),
+        'probes_per_sec': round(total / elapsed, 1) if elapsed else None,
+        'latency_p50_ms': round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        'latency_p99_ms': round(_percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        # Linux下ru_maxrss的单位为KB; 分片引擎的工作进程单独统计
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_child_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'accuracy': round(correct / total, 4) if total else None,
+        'false_ok': sum(counts['ok'] for kind, counts in confusion.items() if not STREAM_KINDS[kind]),
+        'false_fail': sum(counts['fail'] for kind, counts in confusion.items() if STREAM_KINDS[kind]),
+        'by_kind': confusion,
+    })
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _compare(results, baseline_path):
+    """打印与之前结果相比的变化"""
+    try:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取对比结果 {baseline_path}: {e}")
+        return
+    previous = {run['size']: run for run in baseline.get('runs', [])}
+    print(f"\n与 {baseline_path} (版本 {baseline.get('revision') or '未知'}) 对比:")
+    if baseline.get('engine') != results['engine'] or baseline.get('config') != results['config']:
+        print("  注意: 两次结果的引擎或模拟源站配置不同")
+    for run in results['runs']:
+        old = previous.get(run['size'])
+        if old is None:
+            continue
+        changes = []
+        for key in ('probes_per_sec', 'latency_p50_ms', 'latency_p99_ms', 'peak_rss_mb', 'accuracy'):
+            if run.get(key) is not None and old.get(key):
+                changes.append(f"{key} {old[key]} -> {run[key]} ({(run[key] - old[key]) / old[key] * 100:+.1f}%)")
+        print(f"  {run['size']} 条: " + ', '.join(changes))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='IPTV检测性能基准测试 (使用本机模拟源站)')
+    parser.add_argument('--sizes', default='1000,10000', help='播放列表条目数量, 逗号分隔 (默认 1000,10000)')
+    parser.add_argument('--engine', choices=('thread', 'async', 'sharded'), default='async')
+    parser.add_argument('--workers', type=int, default=None, help='分片引擎的进程数')
+    parser.add_argument('--max-in-flight', type=int, default=2000, help='异步引擎的全局并发数')
+    parser.add_argument('--per-host', type=int, default=20, help='单主机并发数')
+    parser.add_argument('--hosts', type=int, default=BENCH_HOSTS, help='模拟源站数量')
+    parser.add_argument('--port', type=int, default=BENCH_PORT, help='第一个模拟源站的端口')
+    parser.add_argument('--latency', type=float, default=20, help='响应延迟(毫秒)')
+    parser.add_argument('--jitter', type=float, default=10, help='延迟的随机波动(毫秒)')
+    parser.add_argument('--bandwidth', type=float, default=8000, help='每个连接的带宽(kbps), 0为不限')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='返回404/500的比例')
+    parser.add_argument('--garbage-rate', type=float, default=0.05, help='返回非媒体数据的比例')
+    parser.add_argument('--redirect-rate', type=float, default=0.1, help='经过302重定向的比例')
+    parser.add_argument('--hang-rate', type=float, default=0.002, help='连接后不响应的比例')
+    parser.add_argument('--dead-rate', type=float, default=0.02, help='指向连不上的主机的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.1, help='启用429限流的源站比例')
+    parser.add_argument('--throttle-limit', type=int, default=4, help='限流源站同时处理的请求数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_result.json', help='结果JSON文件')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--verbose', action='store_true', help='显示检测过程的输出')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    ports = list(range(args.port, args.port + args.hosts))
+    throttled = ports[:int(round(args.hosts * args.throttle_rate))]
+    config = {
+        'latency': args.latency, 'jitter': args.jitter, 'bandwidth': args.bandwidth,
+        'throttle_limit': args.throttle_limit, 'throttled_ports': throttled, 'seed': args.seed,
+        'ports': ports,
+        'dead_ports': list(range(args.port + args.hosts, args.port + args.hosts + BENCH_DEAD_HOSTS)),
+        'error_rate': args.error_rate, 'garbage_rate': args.garbage_rate, 'redirect_rate': args.redirect_rate,
+        'hang_rate': args.hang_rate, 'dead_rate': args.dead_rate,
+    }
+
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Event()
+    origin = ctx.Process(target=_serve_origin, args=(config, ports, ready), daemon=True)
+    origin.start()
+    if not ready.wait(BENCH_READY_TIMEOUT):
+        origin.terminate()
+        print("模拟源站启动失败")
+        return 1
+    print(f"模拟源站已启动: 127.0.0.1:{ports[0]}-{ports[-1]} ({len(throttled)} 个启用限流)")
+
+    results = {
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'engine': args.engine,
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('sizes', 'output', 'compare', 'verbose')},
+        'runs': [],
+    }
+    workdir = tempfile.TemporaryDirectory(prefix='iptv_bench_')
+    try:
+        for size in sizes:
+            playlist = os.path.join(workdir.name, f'bench_{size}.m3u')
+            generate_playlist(playlist, size, config)
+            result_queue = ctx.Queue()
+            scan = ctx.Process(target=_run_scan, args=(playlist, args.engine, args.workers, args.max_in_flight,
+                                                       args.per_host, args.verbose, result_queue))
+            scan.start()
+            run = None
+            while run is None:
+                try:
+                    run = result_queue.get(timeout=1)
+                except queue.Empty:
+                    if not scan.is_alive():
+                        break
+            scan.join()
+            if run is None:
+                print(f"{size} 条: 检测进程异常退出 (退出码 {scan.exitcode})")
+                continue
+            run['size'] = size
+            results['runs'].append(run)
+            accuracy = f"{run['accuracy'] * 100:.2f}%" if run['accuracy'] is not None else '无'
+            print(f"{size} 条: {run['probes_per_sec']} 条/秒, 耗时 p50 {run['latency_p50_ms']}ms "
+                  f"p99 {run['latency_p99_ms']}ms, 峰值内存 {run['peak_rss_mb']}MB, "
+                  f"准确率 {accuracy} (误判可用 {run['false_ok']}, 误判不可用 {run['false_fail']})")
+    finally:
+        origin.terminate()
+        origin.join()
+        workdir.cleanup()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {args.output}")
+    if args.compare:
+        _compare(results, args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""测试共用的模拟源站"""
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TS_PACKET = bytes([0x47, 0x40, 0x00, 0x10]) + b'\xff' * 184
+TS_BODY = TS_PACKET * 40
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    """按 server.routes 返回响应: 路径 -> (状态码, 头部dict, 内容) 或 handler -> 同样的三元组"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        with self.server.lock:
+            self.server.requests.append(path)
+            self.server.connections.add(self.client_address)
+        route = self.server.routes.get(path)
+        if route is None:
+            status, headers, body = 404, {'Content-Type': 'text/plain'}, b'not found'
+        else:
+            status, headers, body = route(self) if callable(route) else route
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Origin:
+    def __init__(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+        self.server.daemon_threads = True
+        self.server.routes = {}
+        self.server.requests = []
+        self.server.connections = set()
+        self.server.lock = threading.Lock()
+        self.routes = self.server.routes
+        self.requests = self.server.requests
+        self.connections = self.server.connections
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def add_stream(self, path, body=TS_BODY, content_type='video/mp2t'):
+        self.routes[path] = (200, {'Content-Type': content_type}, body)
+        return self.url(path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def origin():
+    server = Origin()
+    yield server
+    server.close()
+
+
+def write_playlist(path, items):
+    """items 为 (频道名, URL) 列表"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('#EXTM3U\n')
+        for name, url in items:
+            f.write(f'#EXTINF:-1 group-title="测试",{name}\n{url}\n')
+    return str(path)
+
+
+def run_check(source, tmp_path, monkeypatch, **kwargs):
+    """在临时目录中运行 check_all_streams, 询问是否继续时回答 n, 返回输出目录中的文件名"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('builtins.input', lambda *args: 'n')
+    import iptv
+    iptv.check_all_streams(source, **kwargs)
+    return sorted(os.listdir(tmp_path / 'm3u_check_result'))
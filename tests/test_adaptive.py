@@ -0,0 +1,78 @@
+"""自适应超时和重试预算"""
+import json
+import time
+
+import pytest
+
+import iptv
+from conftest import TS_BODY, run_check, write_playlist
+
+
+def _timings(**phases):
+    timings = {'connect': None, 'tls': None, 'ttfb': None, 'first_byte': None}
+    timings.update(phases)
+    return {'timings': timings}
+
+
+def test_adaptive_timeouts():
+    timeouts = iptv.AdaptiveTimeouts(default=5, minimum=0.1, maximum=15)
+    assert timeouts.timeout_for('a:80') == 5
+    # 首个样本: SRTT = R, RTTVAR = R / 2
+    timeouts.observe('a:80', _timings(connect=0.1, ttfb=0.4))
+    assert timeouts.estimates['a:80'] == pytest.approx([0.4, 0.2, 1])
+    assert timeouts.timeout_for('a:80') == pytest.approx(0.4 + 4 * 0.2)
+    # RTTVAR = 3/4 * 0.2 + 1/4 * |0.4 - 0.8|, SRTT = 7/8 * 0.4 + 1/8 * 0.8
+    timeouts.observe('a:80', _timings(ttfb=0.3, first_byte=0.8))
+    assert timeouts.estimates['a:80'] == pytest.approx([0.45, 0.25, 2])
+    assert timeouts.timeout_for('a:80') == pytest.approx(1.45)
+    # 没有收到HTTP响应的探测不更新估计值
+    timeouts.observe('a:80', _timings(connect=3.0))
+    timeouts.observe('a:80', {'status': 'fail'})
+    assert timeouts.estimates['a:80'][2] == 2
+
+
+def test_adaptive_timeouts_bounds():
+    timeouts = iptv.AdaptiveTimeouts(default=5, minimum=1, maximum=15)
+    timeouts.observe('fast:80', _timings(ttfb=0.01))
+    timeouts.observe('slow:80', _timings(ttfb=30))
+    assert timeouts.timeout_for('fast:80') == 1
+    assert timeouts.timeout_for('slow:80') == 15
+    assert timeouts.retry_timeout(4) == 8
+    assert timeouts.retry_timeout(10) == 15
+
+
+def test_retry_budget():
+    budget = iptv.RetryBudget(ratio=0.5, minimum=1)
+    assert budget.should_retry({'status': 'fail', 'error': '连接超时'})
+    assert not budget.should_retry({'status': 'fail', 'error': '连接错误'})
+    assert not budget.should_retry({'status': 'ok'})
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    for _ in range(4):
+        budget.record_probe()
+    # 上限为 1 + 50% * 4
+    assert budget.try_acquire() and budget.try_acquire()
+    assert not budget.try_acquire()
+    budget.record_retry({'status': 'ok'})
+    budget.record_retry({'status': 'fail'})
+    assert (budget.used, budget.recovered) == (3, 1)
+
+
+def test_check_stream_timeout_per_call(origin):
+    def slow(handler):
+        time.sleep(1)
+        return 200, {'Content-Type': 'video/mp2t'}, TS_BODY
+
+    origin.routes['/slow.ts'] = slow
+    result = iptv.check_stream(origin.url('/slow.ts'), timeout=0.3)
+    assert result['status'] == 'fail' and result['error'] == '连接超时'
+    assert iptv.check_stream(origin.url('/slow.ts'), timeout=3)['status'] == 'ok'
+
+
+def test_scan_report_includes_timeouts(origin, tmp_path, monkeypatch):
+    playlist = write_playlist(tmp_path / 'list.m3u', [('频道1', origin.add_stream('/live/1.ts'))])
+    run_check(playlist, tmp_path, monkeypatch)
+    with open(tmp_path / 'm3u_check_result' / iptv.METRICS_JSON_FILE, encoding='utf-8') as f:
+        report = json.load(f)
+    assert f'127.0.0.1:{origin.port}' in report['timeouts']
+    assert report['retries']['used'] == 0 and report['dns_skipped'] == 0
@@ -0,0 +1,99 @@
+"""按源站的AIMD并发窗口"""
+import pytest
+
+import iptv
+from conftest import TS_BODY, run_check, write_playlist
+
+
+def _ok(ttfb=0.05):
+    return {'status': 'ok', 'status_code': 200, 'timings': {'ttfb': ttfb}}
+
+
+def test_aimd_window_updates(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(iptv.time, 'monotonic', lambda: clock[0])
+    limiter = iptv.AimdLimiter(maximum=8, initial=2)
+    origin = 'h:80'
+
+    assert limiter.try_acquire(origin) and limiter.try_acquire(origin)
+    assert not limiter.try_acquire(origin)      # 窗口为2
+
+    # 慢启动: 每次成功窗口加1
+    assert limiter.release(origin, _ok()) is None
+    assert limiter.release(origin, _ok()) is None
+    state = limiter.states[origin]
+    assert state.window == 4
+    assert state.in_flight == 0
+
+    # 429: 窗口减半, ssthresh 降到减半后的窗口
+    limiter.try_acquire(origin)
+    assert limiter.release(origin, {'status': 'fail', 'status_code': 429, 'timings': {'ttfb': 0.05}}) == 'http_429'
+    assert (state.window, state.ssthresh) == (2, 2)
+
+    # 冷却时间内的同一波限流不再缩小窗口
+    limiter.try_acquire(origin)
+    assert limiter.release(origin, {'status': 'fail', 'status_code': 503, 'timings': {'ttfb': 0.05}}) == 'http_503'
+    assert state.window == 2
+
+    # 拥塞避免: 每次成功只加 1/窗口
+    limiter.try_acquire(origin)
+    limiter.release(origin, _ok())
+    assert state.window == pytest.approx(2.5)
+
+    # 冷却后再次限流
+    clock[0] += iptv.AIMD_COOLDOWN
+    limiter.try_acquire(origin)
+    assert limiter.release(origin, {'status': 'fail', 'reset': True}) == 'reset'
+    assert state.window == pytest.approx(1.25)
+
+    # 连接失败/超时既不增大也不缩小窗口, 异常中止只释放名额
+    limiter.try_acquire(origin)
+    assert limiter.release(origin, {'status': 'fail', 'error': '连接超时', 'timings': {}}) is None
+    limiter.try_acquire(origin)
+    assert limiter.release(origin, None) is None
+    assert state.window == pytest.approx(1.25)
+    assert state.in_flight == 0
+
+
+def test_aimd_window_capped_and_floored(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(iptv.time, 'monotonic', lambda: clock[0])
+    limiter = iptv.AimdLimiter(maximum=3, initial=2)
+    for _ in range(10):
+        limiter.try_acquire('h:80')
+        limiter.release('h:80', _ok())
+    assert limiter.states['h:80'].window == 3
+    for _ in range(5):
+        clock[0] += iptv.AIMD_COOLDOWN
+        limiter.try_acquire('h:80')
+        limiter.release('h:80', {'status': 'fail', 'status_code': 429})
+    assert limiter.states['h:80'].window == 1
+
+
+def test_aimd_latency_spike(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(iptv.time, 'monotonic', lambda: clock[0])
+    limiter = iptv.AimdLimiter(maximum=64, initial=64)
+    for _ in range(iptv.AIMD_SPIKE_MIN_SAMPLES):
+        limiter.try_acquire('h:80')
+        assert limiter.release('h:80', _ok(0.1)) is None
+    limiter.try_acquire('h:80')
+    assert limiter.release('h:80', _ok(0.1 * iptv.AIMD_SPIKE_FACTOR + 0.5)) == 'latency'
+    assert limiter.states['h:80'].window == 32
+
+
+def test_throttled_stream_is_retried(origin, tmp_path, monkeypatch):
+    monkeypatch.setattr(iptv, 'AIMD_BACKOFF', 0.05)
+    calls = []
+
+    def throttled(handler):
+        calls.append(1)
+        if len(calls) == 1:
+            return 429, {'Content-Type': 'text/plain'}, b'slow down'
+        return 200, {'Content-Type': 'video/mp2t'}, TS_BODY
+
+    origin.routes['/live/1.ts'] = throttled
+    playlist = write_playlist(tmp_path / 'list.m3u', [('频道1', origin.url('/live/1.ts'))])
+    # 被限流的链接缩小窗口后重新检测, 不写入不可用列表
+    assert '全部_可用_1个.m3u' in run_check(playlist, tmp_path, monkeypatch)
+    assert len(calls) == 2
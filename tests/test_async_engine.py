@@ -0,0 +1,57 @@
+"""异步检测引擎"""
+import threading
+import time
+
+import iptv
+from conftest import TS_BODY
+
+
+def entries_for(urls):
+    lines = ['#EXTM3U'] + [line for i, url in enumerate(urls) for line in (f'#EXTINF:-1,频道{i}', url)]
+    return list(iptv.iter_m3u_entries(lines))
+
+
+def run(entries, **kwargs):
+    results = {}
+    iptv.run_async_checks(entries, lambda entry, result: results.__setitem__(entry.url, result), **kwargs)
+    return results
+
+
+def test_async_engine_results(origin):
+    good = [origin.add_stream(f'/live/{i}.ts') for i in range(3)]
+    html = origin.add_stream('/page.ts', b'<html>' + b'x' * 2000, 'text/html')
+    missing = origin.url('/missing.ts')
+    results = run(entries_for(good + [html, missing]), max_in_flight=8, per_host=4)
+    assert [results[url]['status'] for url in good] == ['ok'] * 3
+    assert results[html]['status'] == 'fail'
+    assert results[missing]['status'] == 'fail'
+    assert '404' in results[missing]['error']
+
+
+def test_async_engine_per_host_limit(origin):
+    lock = threading.Lock()
+    active = [0, 0]     # 当前并发数, 最大并发数
+
+    def slow(handler):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+        return 200, {'Content-Type': 'video/mp2t'}, TS_BODY
+
+    urls = []
+    for i in range(6):
+        origin.routes[f'/slow/{i}.ts'] = slow
+        urls.append(origin.url(f'/slow/{i}.ts'))
+    results = run(entries_for(urls), max_in_flight=50, per_host=2)
+    assert all(result['status'] == 'ok' for result in results.values())
+    assert len(results) == 6
+    assert active[1] <= 2
+
+
+def test_async_engine_unreachable_host():
+    url = 'http://127.0.0.1:1/live.ts'
+    results = run(entries_for([url]), max_in_flight=4, per_host=2)
+    assert results[url]['status'] == 'fail'
@@ -0,0 +1,54 @@
+"""基准测试工具"""
+import json
+import random
+import socket
+
+import iptv_bench
+
+
+def free_port_range(count):
+    """找一段连续的空闲端口"""
+    for _ in range(50):
+        base = random.randint(30000, 60000)
+        sockets = []
+        try:
+            for port in range(base, base + count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(('127.0.0.1', port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError('没有空闲端口')
+
+
+def test_generate_playlist_encodes_kind(tmp_path):
+    config = {'seed': 1, 'ports': [1000, 1001], 'dead_ports': [2000], 'error_rate': 0.2, 'garbage_rate': 0.2,
+              'redirect_rate': 0.2, 'hang_rate': 0, 'dead_rate': 0.2}
+    path = tmp_path / 'bench.m3u'
+    iptv_bench.generate_playlist(path, 200, config)
+    urls = [line.strip() for line in path.read_text(encoding='utf-8').splitlines() if line.startswith('http')]
+    assert len(urls) == 200
+    kinds = {url.rsplit('/', 2)[-2] for url in urls}
+    assert kinds <= set(iptv_bench.STREAM_KINDS) and 'dead' in kinds and 'hang' not in kinds
+    assert all((':2000/' in url) == ('/s/dead/' in url) for url in urls)
+
+
+def test_benchmark_run_and_compare(tmp_path, capsys):
+    port = free_port_range(iptv_bench.BENCH_HOSTS + iptv_bench.BENCH_DEAD_HOSTS)
+    output = tmp_path / 'bench.json'
+    args = ['--sizes', '50', '--hosts', '3', '--port', str(port), '--latency', '0', '--jitter', '0',
+            '--bandwidth', '0', '--hang-rate', '0', '--output', str(output)]
+    iptv_bench.main(args)
+    with open(output, encoding='utf-8') as f:
+        results = json.load(f)
+    run = results['runs'][0]
+    assert (run['size'], run['entries']) == (50, 50)
+    assert run['accuracy'] == 1.0
+    assert run['latency_p50_ms'] is not None
+
+    iptv_bench.main(args[:-1] + [str(tmp_path / 'bench2.json'), '--compare', str(output)])
+    assert f'与 {output}' in capsys.readouterr().out
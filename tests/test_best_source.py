@@ -0,0 +1,51 @@
+"""最佳源竞速"""
+import asyncio
+import os
+
+import iptv
+from conftest import write_playlist
+
+
+def test_channel_group_key():
+    lines = ['#EXTM3U',
+             '#EXTINF:-1,CCTV-1 综合', 'http://a/1.ts',
+             '#EXTINF:-1,ｃｃｔｖ１ 综合', 'http://b/1.ts',
+             '#EXTINF:-1 tvg-id="CCTV1",另一个名字', 'http://c/1.ts',
+             '#EXTINF:-1 tvg-id="cctv1",CCTV1', 'http://d/1.ts']
+    keys = [iptv.channel_group_key(entry) for entry in iptv.iter_m3u_entries(lines)]
+    assert keys == ['name:cctv1综合', 'name:cctv1综合', 'id:cctv1', 'id:cctv1']
+
+
+def test_race_stops_after_enough_winners():
+    delays = {'a': 0.5, 'b': 0.5, 'c': 0.01, 'd': 0.01, 'e': 0.01}
+    started = []
+
+    async def probe(name):
+        started.append(name)
+        await asyncio.sleep(delays[name])
+        return {'status': 'fail' if name == 'b' else 'ok'}
+
+    winners, launched = asyncio.run(iptv._race_candidates(list('abcde'), 2, 0.05, probe))
+    # a、b较慢时错峰启动后面的候选源, c结束后立即启动d, 得到2个可用源后不再启动其余的
+    assert [name for name, _ in winners] == ['c', 'd']
+    assert started == ['a', 'b', 'c', 'd']
+    assert launched == 4
+
+
+def test_check_best_sources_writes_fastest(origin, tmp_path, monkeypatch):
+    playlist = write_playlist(tmp_path / 'list.m3u', [
+        ('频道A', origin.url('/missing.ts')),
+        ('频道A', origin.add_stream('/a/1.ts')),
+        ('频道A', origin.add_stream('/a/2.ts')),
+        ('频道B', origin.add_stream('/b/1.ts')),
+        ('频道C', origin.url('/missing2.ts')),
+    ])
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('builtins.input', lambda *args: 'n')
+    iptv.check_best_sources(playlist, per_channel=2, stagger=0.05)
+    output = tmp_path / 'm3u_check_result' / '最佳源_3个.m3u'
+    assert os.path.exists(output)
+    with open(output, encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.startswith('http')]
+    assert sorted(urls[:2]) == [origin.url('/a/1.ts'), origin.url('/a/2.ts')]
+    assert urls[2] == origin.url('/b/1.ts')
@@ -0,0 +1,48 @@
+"""探测结果缓存"""
+import os
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+def test_normalize_url():
+    assert iptv.normalize_url('HTTP://Example.COM:80/live.ts#x') == 'http://example.com/live.ts'
+    assert iptv.normalize_url('https://a.com:443/b?c=1') == 'https://a.com/b?c=1'
+    assert iptv.normalize_url('http://a.com:8080') == 'http://a.com:8080/'
+
+
+def test_cache_round_trip_and_ttl(tmp_path, monkeypatch):
+    cache = iptv.ProbeCache(str(tmp_path / 'cache.db'), ok_ttl=3600, fail_ttl=60)
+    cache.put('http://a.com/ok.ts', {'status': 'ok', 'elapsed': 0.25, 'status_code': 200,
+                                     'content_type': 'video/mp2t'})
+    cache.put('http://a.com/bad.ts', {'status': 'fail', 'error': '连接超时'})
+    ok = cache.get('HTTP://A.COM:80/ok.ts')
+    assert ok['status'] == 'ok' and ok['cached']
+    assert ok['elapsed'] == 0.25 and ok['response_time'] == '0.25秒'
+    assert cache.get('http://a.com/bad.ts')['error'] == '连接超时'
+    assert cache.get('http://a.com/other.ts') is None
+    assert cache.hits == 2
+
+    # 不可用结果先过期, 可用结果保留更久
+    now = iptv.time.time()
+    monkeypatch.setattr(iptv.time, 'time', lambda: now + 120)
+    assert cache.get('http://a.com/bad.ts') is None
+    assert cache.get('http://a.com/ok.ts')['status'] == 'ok'
+    monkeypatch.setattr(iptv.time, 'time', lambda: now + 4000)
+    assert cache.get('http://a.com/ok.ts') is None
+    cache.close()
+
+
+def test_second_scan_uses_cache(origin, tmp_path, monkeypatch):
+    playlist = write_playlist(tmp_path / 'list.m3u', [
+        ('频道1', origin.add_stream('/live/1.ts')),
+        ('频道2', origin.url('/missing.ts')),
+    ])
+    first = run_check(playlist, tmp_path, monkeypatch)
+    probed = len(origin.requests)
+    for name in first:
+        if name.endswith('.m3u'):
+            os.remove(tmp_path / 'm3u_check_result' / name)
+    second = run_check(playlist, tmp_path, monkeypatch)
+    assert len(origin.requests) == probed
+    assert '全部_可用_1个.m3u' in first and '全部_可用_1个.m3u' in second
@@ -0,0 +1,55 @@
+"""守护进程模式的检测调度"""
+import asyncio
+import contextlib
+
+import iptv
+from conftest import write_playlist
+
+
+def test_next_check_interval():
+    assert iptv.next_check_interval(True, 1, False) == iptv.DAEMON_BASE_INTERVAL
+    assert iptv.next_check_interval(True, 3, False) == iptv.DAEMON_BASE_INTERVAL * 4
+    assert iptv.next_check_interval(False, 1, False) == iptv.DAEMON_MIN_INTERVAL
+    assert iptv.next_check_interval(False, 2, False) == iptv.DAEMON_MIN_INTERVAL * 2
+    # 长期稳定的流按上限复查, 状态反复变化的流按最短间隔
+    assert iptv.next_check_interval(True, 100, False) == iptv.DAEMON_MAX_INTERVAL
+    assert iptv.next_check_interval(False, 100, False) == iptv.DAEMON_MAX_INTERVAL
+    assert iptv.next_check_interval(True, 5, True) == iptv.DAEMON_MIN_INTERVAL
+
+
+def test_flapping_detection():
+    stream = iptv._MonitoredStream('http://a/1.ts', 0)
+    assert stream.record(True) and not stream.flapping
+    assert not stream.record(True) and stream.streak == 2
+    assert stream.record(False) and stream.streak == 1
+    assert not stream.flapping
+    stream.record(True)
+    assert stream.flapping
+    # 变化移出最近 DAEMON_HISTORY 次结果后恢复稳定
+    for _ in range(iptv.DAEMON_HISTORY - 1):
+        stream.record(True)
+    assert not stream.flapping
+    assert stream.streak == iptv.DAEMON_HISTORY
+
+
+def test_daemon_writes_working_playlists(origin, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    good = origin.add_stream('/live/1.ts')
+    playlist = write_playlist(tmp_path / 'list.m3u', [
+        ('频道1', good), ('频道1 重复', good), ('频道2', origin.url('/missing.ts'))])
+    output_dir = tmp_path / 'out'
+    daemon = iptv.MonitorDaemon([playlist], output_dir=str(output_dir), rate=50)
+
+    async def main():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(1)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert daemon.probes == 2
+    with open(output_dir / '全部_可用.m3u', encoding='utf-8') as f:
+        assert f.read().count(good) == 2
+    assert (output_dir / iptv.PROBE_CACHE_FILE).exists()
+    assert not (tmp_path / iptv.PROBE_CACHE_FILE).exists()
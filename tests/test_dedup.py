@@ -0,0 +1,43 @@
+"""URL去重和主机熔断"""
+import iptv
+from conftest import run_check, write_playlist
+
+
+def test_breaker_trips_after_consecutive_failures():
+    breaker = iptv.HostCircuitBreaker(threshold=3)
+    timeout = {'status': 'fail', 'error': '连接超时'}
+    for _ in range(2):
+        breaker.record('a:80', timeout)
+    # 收到HTTP响应后计数清零
+    breaker.record('a:80', {'status': 'fail', 'error': 'HTTP状态码错误: 404'})
+    for _ in range(2):
+        breaker.record('a:80', timeout)
+    assert breaker.check('a:80') is None
+    breaker.record('a:80', {'status': 'fail', 'error': '连接错误'})
+    skipped = breaker.check('a:80')
+    assert skipped['status'] == 'fail' and skipped['skipped']
+    assert breaker.check('b:80') is None
+    assert breaker.open_hosts == {'a:80'}
+    assert breaker.skipped == 1
+
+
+def test_duplicate_urls_probed_once(origin, tmp_path, monkeypatch, capsys):
+    url = origin.add_stream('/live/1.ts')
+    playlist = write_playlist(tmp_path / 'list.m3u', [
+        ('频道1', url),
+        ('频道1 备用', url),
+        ('频道1 片段', url + '#x'),
+    ])
+    files = run_check(playlist, tmp_path, monkeypatch)
+    assert '全部_可用_3个.m3u' in files
+    assert origin.requests.count('/live/1.ts') == 1
+    assert '去重: 2 个重复链接共用检测结果' in capsys.readouterr().out
+
+
+def test_dead_host_is_skipped_after_threshold(tmp_path, monkeypatch, capsys):
+    playlist = write_playlist(tmp_path / 'dead.m3u',
+                              [(f'频道{i}', f'http://127.0.0.1:1/live/{i}.ts') for i in range(12)])
+    files = run_check(playlist, tmp_path, monkeypatch, engine='async', per_host=1)
+    assert '全部_不可用_12个.m3u' in files
+    out = capsys.readouterr().out
+    assert '熔断: 1 个主机被熔断, 跳过 7 个链接' in out
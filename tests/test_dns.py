@@ -0,0 +1,66 @@
+"""域名预解析和解析缓存"""
+import socket
+import time
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+def fake_getaddrinfo(monkeypatch, hosts):
+    """hosts: 域名 -> IP, 不在其中的域名解析失败; 返回各域名的解析次数"""
+    calls = {}
+    original = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if host in ('127.0.0.1', '::1'):
+            return original(host, *args, **kwargs)
+        calls[host] = calls.get(host, 0) + 1
+        if host not in hosts:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (hosts[host], 0))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    return calls
+
+
+def test_negative_results_cached_until_expiry(monkeypatch):
+    calls = fake_getaddrinfo(monkeypatch, {'ok.test': '10.0.0.1'})
+    resolver = iptv.DnsResolver(workers=2, ttl=60, negative_ttl=0.2)
+    assert resolver.resolve('ok.test') == [(socket.AF_INET, '10.0.0.1')]
+    assert resolver.resolve('missing.test') == []
+    assert resolver.resolve('missing.test') == []
+    assert resolver.cached_addresses('missing.test') == []
+    assert calls == {'ok.test': 1, 'missing.test': 1}
+    assert (resolver.resolved, resolver.failed) == (1, 1)
+    time.sleep(0.3)
+    # 解析失败的结果先过期, 重新解析
+    assert resolver.cached_addresses('missing.test') is None
+    assert resolver.resolve('missing.test') == []
+    assert resolver.resolve('ok.test') == [(socket.AF_INET, '10.0.0.1')]
+    assert calls == {'ok.test': 1, 'missing.test': 2}
+
+
+def test_cache_capacity_and_ip_literals(monkeypatch):
+    calls = fake_getaddrinfo(monkeypatch, {'a.test': '10.0.0.1', 'b.test': '10.0.0.2', 'c.test': '10.0.0.3'})
+    resolver = iptv.DnsResolver(workers=2, max_size=2)
+    for host in ('a.test', 'b.test', 'c.test'):
+        resolver.resolve(host)
+    # 超过容量时淘汰最久未使用的域名
+    assert resolver.cached_addresses('a.test') is None
+    assert resolver.cached_addresses('c.test') == [(socket.AF_INET, '10.0.0.3')]
+    assert resolver.resolve('2001:db8::1') == [(socket.AF_INET6, '2001:db8::1')]
+    assert '2001:db8::1' not in calls
+    assert iptv.is_ipv6_addresses([(socket.AF_INET6, '2001:db8::1')])
+    assert not iptv.is_ipv6_addresses([])
+
+
+def test_scan_connects_through_resolved_addresses(origin, tmp_path, monkeypatch):
+    calls = fake_getaddrinfo(monkeypatch, {'live.dns-scan.test': '127.0.0.1'})
+    origin.add_stream('/live/1.ts')
+    items = [('频道1', f'http://live.dns-scan.test:{origin.port}/live/1.ts')]
+    items += [(f'频道{i}', f'http://gone.dns-scan.test/live/{i}.ts') for i in range(3)]
+    files = run_check(write_playlist(tmp_path / 'list.m3u', items), tmp_path, monkeypatch)
+    assert '全部_可用_1个.m3u' in files and '全部_不可用_3个.m3u' in files
+    assert calls == {'live.dns-scan.test': 1, 'gone.dns-scan.test': 1}
+    with open(tmp_path / 'm3u_check_result' / '全部_不可用_3个.m3u', encoding='utf-8') as f:
+        assert f.read().count('gone.dns-scan.test') == 3
@@ -0,0 +1,70 @@
+"""EPG源并行获取和流式解析"""
+import gzip
+import json
+import time
+
+import pytest
+
+import iptv
+
+XMLTV = ('<?xml version="1.0" encoding="UTF-8"?>\n<tv>'
+         '<channel id="cctv1"><display-name>CCTV-1</display-name></channel>'
+         '<channel id="hunan"><display-name>湖南卫视</display-name></channel>'
+         '<programme channel="cctv1" start="20240101000000"><title>新闻</title></programme>'
+         '</tv>').encode('utf-8')
+
+
+@pytest.mark.parametrize('head, expected', [
+    (XMLTV, 'xmltv'),
+    (b'\xef\xbb\xbf<tv generator="x">', 'xmltv'),
+    (b'<!DOCTYPE tv SYSTEM "xmltv.dtd">', 'xmltv'),
+    (b'  [{"id": "1", "name": "CCTV1"}]', 'json'),
+    (b'{"channels": []}', 'json'),
+    ('cctv1,CCTV-1\nhunan,湖南卫视\n'.encode('utf-8'), 'text'),
+    (b'<html><head><title>404</title></head></html>', None),
+    (b'<?xml version="1.0"?><rss></rss>', None),
+])
+def test_detect_epg_format(head, expected):
+    assert iptv._detect_epg_format(head) == expected
+
+
+def test_first_source_wins_and_slow_sources_are_aborted(origin, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def slow(handler):
+        time.sleep(3)
+        return 200, {'Content-Type': 'text/xml'}, XMLTV
+
+    origin.routes['/slow.xml'] = slow
+    origin.routes['/page.xml'] = (200, {'Content-Type': 'text/html'}, b'<html>error</html>')
+    origin.routes['/e.xml.gz'] = (200, {'Content-Type': 'application/octet-stream'}, gzip.compress(XMLTV))
+    start = time.monotonic()
+    channels = iptv.load_epg_sources([origin.url('/slow.xml'), origin.url('/page.xml'), origin.url('/e.xml.gz')])
+    assert time.monotonic() - start < 2
+    assert channels == {'CCTV-1': {'id': 'cctv1', 'name': 'CCTV-1'},
+                        '湖南卫视': {'id': 'hunan', 'name': '湖南卫视'}}
+    with open(tmp_path / iptv.EPG_META_FILE, encoding='utf-8') as f:
+        assert json.load(f)['source'] == origin.url('/e.xml.gz')
+
+
+def test_unchanged_source_uses_cache(origin, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    def conditional(handler):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'Content-Type': 'application/json', 'ETag': '"v1"'}, \
+            json.dumps({'data': [{'id': 'cctv1', 'name': 'CCTV-1'}]}).encode('utf-8')
+
+    origin.routes['/api/diyp/'] = conditional
+    url = origin.url('/api/diyp/')
+    assert iptv.load_epg_sources([url]) == {'CCTV-1': {'id': 'cctv1', 'name': 'CCTV-1'}}
+    assert iptv.load_epg_sources([url]) == {'CCTV-1': {'id': 'cctv1', 'name': 'CCTV-1'}}
+    assert 'EPG源未更新' in capsys.readouterr().out
+
+
+def test_unknown_format_is_skipped(origin, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    origin.routes['/page.xml'] = (200, {'Content-Type': 'text/html'}, b'<html>error</html>')
+    assert iptv.load_epg_sources([origin.url('/page.xml')]) is None
+    assert '跳过EPG源' in capsys.readouterr().out
@@ -0,0 +1,62 @@
+"""EPG频道名匹配"""
+import pytest
+
+import iptv
+
+CHANNELS = {name: {'id': channel_id, 'name': name} for name, channel_id in (
+    ('CCTV-1 综合', 'cctv1'), ('CCTV-11 戏曲', 'cctv11'), ('CCTV-5 体育', 'cctv5'),
+    ('CCTV-5+ 体育赛事', 'cctv5plus'), ('湖南卫视', 'hunan'), ('东方卫视', 'dongfang'),
+    ('北京卫视', 'beijing'),
+)}
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('CCTV-1 综合 HD', 'cctv1综合'),
+    ('ＣＣＴＶ－１ 综合', 'cctv1综合'),
+    ('湖南卫视 [高清]', '湖南卫视'),
+    ('CCTV-十一 戏曲 1080P', 'cctv11戏曲'),
+    ('(湖南卫视)', '湖南卫视'),
+])
+def test_normalize_epg_name(name, expected):
+    assert iptv.normalize_epg_name(name) == expected
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('CCTV1综合 高清', 'cctv1'),
+    ('cctv-11戏曲', 'cctv11'),
+    ('CCTV5+ 体育赛事', 'cctv5plus'),
+    ('CCTV5 体育', 'cctv5'),
+    ('湖南卫视HD', 'hunan'),
+    ('湖南卫视 备用', 'hunan'),
+    ('浙江卫视', None),
+    ('', None),
+])
+def test_match(name, expected):
+    assert iptv.EpgIndex.build(CHANNELS).match(name) == expected
+
+
+def test_annotate_fills_missing_tvg_id():
+    index = iptv.EpgIndex.build(CHANNELS)
+    lines = ['#EXTM3U',
+             '#EXTINF:-1 group-title="卫视",湖南卫视', 'http://a/1.ts',
+             '#EXTINF:-1 tvg-id="" group-title="卫视",东方卫视', 'http://a/2.ts',
+             '#EXTINF:-1 tvg-id="own",北京卫视', 'http://a/3.ts',
+             '#EXTINF:-1,未知频道', 'http://a/4.ts']
+    annotated = [index.annotate(entry) for entry in iptv.iter_m3u_entries(lines)]
+    assert annotated == ['#EXTINF:-1 tvg-id="hunan" group-title="卫视",湖南卫视',
+                         '#EXTINF:-1 tvg-id="dongfang" group-title="卫视",东方卫视',
+                         '#EXTINF:-1 tvg-id="own",北京卫视',
+                         '#EXTINF:-1,未知频道']
+    assert index.matched == 2
+
+
+def test_index_saved_and_rebuilt_when_data_changes(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    first = iptv.get_epg_index(CHANNELS)
+    assert '已建立EPG频道索引' in capsys.readouterr().out
+    loaded = iptv.get_epg_index(CHANNELS)
+    assert '已建立EPG频道索引' not in capsys.readouterr().out
+    assert loaded.match('湖南卫视') == first.match('湖南卫视') == 'hunan'
+    changed = dict(CHANNELS, 浙江卫视={'id': 'zhejiang', 'name': '浙江卫视'})
+    assert iptv.get_epg_index(changed).match('浙江卫视 HD') == 'zhejiang'
+    assert '已建立EPG频道索引' in capsys.readouterr().out
@@ -0,0 +1,77 @@
+"""检测历史和可靠性排序"""
+import json
+
+import pytest
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+def entry(url):
+    return next(iptv.iter_m3u_entries(['#EXTM3U', '#EXTINF:-1,频道', url]))
+
+
+def stats(history, url):
+    return history.conn.execute(
+        'SELECT weight, ok_weight, probes FROM stream_stats JOIN urls ON urls.id = stream_stats.url_id '
+        'WHERE urls.url = ?', (iptv.normalize_url(url),)).fetchone()
+
+
+def test_rolling_stats_decay(tmp_path, monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(iptv.time, 'time', lambda: now[0])
+    history = iptv.ProbeHistory(str(tmp_path / 'history.db'))
+    url = 'http://a.com/1.ts'
+    history.record(entry(url), {'status': 'fail', 'error': '连接超时'})
+    history.record(entry(url), {'status': 'fail', 'error': '连接超时'})
+    # 一个半衰期后旧结果的权重减半
+    now[0] += iptv.HISTORY_HALF_LIFE
+    history.record(entry(url), {'status': 'ok', 'elapsed': 0.1})
+    weight, ok_weight, probes = stats(history, url)
+    assert weight == pytest.approx(2.0) and ok_weight == 1 and probes == 3
+    assert history.became_working == [(entry(url).extinf, url)]
+
+    report = history.stream_report(url)
+    assert report['probes'] == 3 and report['uptime'] == pytest.approx(1 / 3)
+    assert history.stream_report(url, since=now[0])['uptime'] == 1
+    assert history.stream_report('http://a.com/other.ts') is None
+    history.close()
+
+
+def test_scores_prefer_reliable_and_fast(tmp_path):
+    history = iptv.ProbeHistory(str(tmp_path / 'history.db'))
+    for _ in range(3):
+        history.record(entry('http://a.com/fast.ts'), {'status': 'ok', 'elapsed': 0.05})
+        history.record(entry('http://a.com/slow.ts'), {'status': 'ok', 'elapsed': 3})
+        history.record(entry('http://b.com/flaky.ts'), {'status': 'fail', 'error': '连接错误'})
+    scores = history.scores()
+    assert scores['http://a.com/fast.ts'] > scores['http://a.com/slow.ts'] > scores['http://b.com/flaky.ts']
+    hosts = history.host_stats()
+    assert [host['host'] for host in hosts] == ['b.com:80', 'a.com:80']
+    assert hosts[0]['uptime'] == 0
+    history.close()
+
+
+def test_writer_orders_by_score(tmp_path):
+    writer = iptv.StreamResultWriter(str(tmp_path))
+    for name in ('a', 'b', 'c'):
+        writer.write(f'#EXTINF:-1,{name}', f'http://x.com/{name}.ts', False, True)
+    writer.finalize({'http://x.com/b.ts': 0.9, 'http://x.com/a.ts': 0.5})
+    with open(tmp_path / '全部_可用_3个.m3u', encoding='utf-8') as f:
+        assert [line.strip() for line in f if line.startswith('http')] == \
+            ['http://x.com/b.ts', 'http://x.com/a.ts', 'http://x.com/c.ts']
+
+
+def test_scan_reports_state_changes(origin, tmp_path, monkeypatch):
+    stable = origin.add_stream('/live/1.ts')
+    flipping = origin.add_stream('/live/2.ts')
+    playlist = write_playlist(tmp_path / 'list.m3u', [('频道1', stable), ('频道2', flipping)])
+    run_check(playlist, tmp_path, monkeypatch, use_cache=False)
+    del origin.routes['/live/2.ts']
+    run_check(playlist, tmp_path, monkeypatch, use_cache=False)
+    output_dir = tmp_path / 'm3u_check_result'
+    with open(output_dir / iptv.HISTORY_DIFF_FILE, encoding='utf-8') as f:
+        diff = json.load(f)
+    assert diff['became_failing'] == [flipping] and diff['became_working'] == []
+    with open(output_dir / iptv.HISTORY_REPORT_FILE, encoding='utf-8') as f:
+        assert json.load(f)['hosts'][0]['streams'] == 2
@@ -0,0 +1,299 @@
+"""从码流中解析视频编码和分辨率"""
+import pytest
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+# ---- 构造测试码流的辅助函数 ----
+
+class BitWriter:
+    """按位写入, 支持指数哥伦布编码, 输出时补齐停止位并插入防竞争字节"""
+
+    def __init__(self):
+        self.bits = []
+
+    def u(self, bits, value):
+        self.bits += [(value >> (bits - 1 - i)) & 1 for i in range(bits)]
+
+    def ue(self, value):
+        value += 1
+        self.u(value.bit_length() - 1, 0)
+        self.u(value.bit_length(), value)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def rbsp(self):
+        bits = self.bits + [1]
+        bits += [0] * (-len(bits) % 8)
+        raw = bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+        out = bytearray()
+        zeros = 0
+        for byte in raw:
+            if zeros >= 2 and byte <= 3:
+                out.append(3)
+                zeros = 0
+            out.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        return bytes(out)
+
+
+def h264_sps(width, height, profile=100, interlaced=False):
+    w = BitWriter()
+    w.u(8, profile)
+    w.u(8, 0)
+    w.u(8, 40)                  # level 4.0
+    w.ue(0)                     # seq_parameter_set_id
+    if profile in (100, 110, 122, 244):
+        w.ue(1)                 # chroma_format_idc
+        w.ue(0)
+        w.ue(0)
+        w.u(1, 0)
+        w.u(1, 0)               # seq_scaling_matrix_present_flag
+    w.ue(0)                     # log2_max_frame_num_minus4
+    w.ue(0)                     # pic_order_cnt_type
+    w.ue(2)
+    w.ue(4)                     # max_num_ref_frames
+    w.u(1, 0)
+    frame_mbs_only = 0 if interlaced else 1
+    mb_width = (width + 15) // 16
+    map_unit = 16 if frame_mbs_only else 32
+    mb_height = (height + map_unit - 1) // map_unit
+    w.ue(mb_width - 1)
+    w.ue(mb_height - 1)
+    w.u(1, frame_mbs_only)
+    if not frame_mbs_only:
+        w.u(1, 0)
+    w.u(1, 1)
+    crop_right = mb_width * 16 - width
+    crop_bottom = mb_height * 16 * (2 - frame_mbs_only) - height
+    if crop_right or crop_bottom:
+        w.u(1, 1)
+        w.ue(0)
+        w.ue(crop_right // 2)
+        w.ue(0)
+        w.ue(crop_bottom // (2 * (2 - frame_mbs_only)))
+    else:
+        w.u(1, 0)
+    w.u(1, 0)                   # vui_parameters_present_flag
+    return b'\x67' + w.rbsp()
+
+
+def hevc_sps(width, height, sub_layers=0):
+    w = BitWriter()
+    w.u(4, 0)
+    w.u(3, sub_layers)
+    w.u(1, 1)
+    w.u(2, 0)
+    w.u(1, 0)
+    w.u(5, 1)                   # Main profile
+    w.u(32, 0x60000000)
+    w.u(48, 0x900000000000)
+    w.u(8, 123)                 # level 4.1
+    for _ in range(sub_layers):
+        w.u(1, 1)
+        w.u(1, 1)
+    if sub_layers:
+        w.u(2 * (8 - sub_layers), 0)
+    for _ in range(sub_layers):
+        w.u(88, 0)
+        w.u(8, 0)
+    w.ue(0)                     # sps_seq_parameter_set_id
+    w.ue(1)                     # chroma_format_idc
+    coded_width = (width + 7) // 8 * 8
+    coded_height = (height + 7) // 8 * 8
+    w.ue(coded_width)
+    w.ue(coded_height)
+    if (coded_width, coded_height) != (width, height):
+        w.u(1, 1)
+        w.ue(0)
+        w.ue((coded_width - width) // 2)
+        w.ue(0)
+        w.ue((coded_height - height) // 2)
+    else:
+        w.u(1, 0)
+    w.ue(0)
+    w.ue(0)
+    w.ue(4)
+    return b'\x42\x01' + w.rbsp()
+
+
+def ts_packets(items):
+    """(PID, 是否为单元起始, 负载) 列表打包成188字节的TS包, 不足部分用适配字段填充"""
+    out = bytearray()
+    counters = {}
+    for pid, unit_start, payload in items:
+        while True:
+            chunk, payload = payload[:184], payload[184:]
+            cc = counters.get(pid, 0) & 15
+            counters[pid] = cc + 1
+            first = (0x40 if unit_start else 0) | (pid >> 8)
+            if len(chunk) < 184:
+                pad = 184 - len(chunk)
+                adaptation = b'\x00' if pad == 1 else bytes([pad - 1, 0]) + b'\xff' * (pad - 2)
+                out += bytes([0x47, first, pid & 0xFF, 0x30 | cc]) + adaptation + chunk
+            else:
+                out += bytes([0x47, first, pid & 0xFF, 0x10 | cc]) + chunk
+            unit_start = False
+            if not payload:
+                break
+    return bytes(out)
+
+
+def psi_section(table_id, body):
+    length = len(body) + 9
+    header = bytes([table_id, 0xB0 | (length >> 8), length & 0xFF, 0, 1, 0xC1, 0, 0])
+    return b'\x00' + header + body + b'\x00' * 4
+
+
+def make_ts(sps, stream_type=0x1B, with_psi=True):
+    """PAT(节目1 -> PMT PID 0x100) + PMT(视频PID 0x101, AAC音频PID 0x102) + 含SPS的视频PES"""
+    pat = psi_section(0x00, b'\x00\x01\xe1\x00')
+    pmt = psi_section(0x02, b'\xe1\x00\xf0\x00' + bytes([stream_type]) + b'\xe1\x01\xf0\x00'
+                      + b'\x0f\xe1\x02\xf0\x00')
+    es = (b'\x00\x00\x00\x01\x09\xf0' + b'\x00\x00\x00\x01' + sps
+          + b'\x00\x00\x00\x01\x68\xee\x3c\x80' + b'\x00\x00\x01\x65' + bytes(range(1, 256)) * 8)
+    pes = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05\x21\x00\x01\x00\x01' + es
+    items = [(0x000, True, pat), (0x100, True, pmt)] if with_psi else []
+    return ts_packets(items + [(0x101, True, pes)])
+
+
+def subset(info, keys):
+    return {key: info.get(key) for key in keys} if info else info
+
+
+# ---- 位读取和SPS解析 ----
+
+@pytest.mark.parametrize('data, reads, expected', [
+    (b'\xa6\x42\x80', ('ue', 'ue', 'ue', 'ue', 'ue'), [0, 1, 2, 3, 4]),
+    (b'\xa6\x42\x80', ('se', 'se', 'se', 'se', 'se'), [0, 1, -1, 2, -2]),
+    (b'\xb5', ('u3', 'u5'), [0b101, 0b10101]),
+    (b'\x00\x10\x00', ('ue',), [2047]),
+])
+def test_bit_reader(data, reads, expected):
+    reader = iptv._BitReader(data)
+    values = [reader.u(int(op[1:])) if op[1:].isdigit() else getattr(reader, op)() for op in reads]
+    assert values == expected
+
+
+def test_bit_reader_truncated():
+    reader = iptv._BitReader(b'\x00\x00')
+    with pytest.raises(ValueError):
+        reader.ue()
+    with pytest.raises(ValueError):
+        iptv._BitReader(b'\xff').u(9)
+
+
+def test_h264_sps_real():
+    # 某IPTV源的1280x720 High@3.1 SPS
+    sps = bytes.fromhex('6764001facd9405005bb011000000300100000030300f1831960')
+    assert subset(iptv._parse_h264_sps(sps), ('width', 'height', 'codec', 'profile', 'level')) == {
+        'width': 1280, 'height': 720, 'codec': 'h264', 'profile': 'High', 'level': '3.1'}
+
+
+@pytest.mark.parametrize('width, height, profile, interlaced', [
+    (1920, 1080, 100, False),
+    (1920, 1080, 100, True),
+    (1280, 720, 77, False),
+    (720, 576, 66, False),
+    (720, 480, 100, True),
+    (3840, 2160, 100, False),
+])
+def test_h264_sps(width, height, profile, interlaced):
+    info = iptv._parse_h264_sps(h264_sps(width, height, profile, interlaced))
+    assert subset(info, ('width', 'height', 'codec', 'profile')) == {
+        'width': width, 'height': height, 'codec': 'h264', 'profile': iptv.H264_PROFILES[profile]}
+
+
+@pytest.mark.parametrize('width, height, sub_layers', [
+    (1920, 1080, 0),
+    (1920, 1080, 2),
+    (3840, 2160, 0),
+    (1280, 720, 1),
+])
+def test_hevc_sps(width, height, sub_layers):
+    info = iptv._parse_hevc_sps(hevc_sps(width, height, sub_layers))
+    assert subset(info, ('width', 'height', 'codec', 'profile', 'level')) == {
+        'width': width, 'height': height, 'codec': 'hevc', 'profile': 'Main', 'level': '4.1'}
+
+
+# ---- TS PAT/PMT ----
+
+@pytest.mark.parametrize('sps, stream_type, width, height, codec', [
+    (h264_sps(1920, 1080), 0x1B, 1920, 1080, 'h264'),
+    (h264_sps(720, 576, 77), 0x1B, 720, 576, 'h264'),
+    (hevc_sps(3840, 2160), 0x24, 3840, 2160, 'hevc'),
+])
+def test_inspect_ts_with_pat_pmt(sps, stream_type, width, height, codec):
+    data = make_ts(sps, stream_type)
+    assert iptv.sniff_container(data) == ('mpegts', False)
+    info = iptv.inspect_stream(data[:4096], 'mpegts')
+    assert subset(info, ('width', 'height', 'codec', 'audio')) == {
+        'width': width, 'height': height, 'codec': codec, 'audio': 'aac'}
+
+
+def test_inspect_ts_without_psi():
+    # 没有PAT/PMT时按PES中的起始码识别视频
+    info = iptv.inspect_stream(make_ts(h264_sps(1280, 720), with_psi=False)[:4096], 'mpegts')
+    assert subset(info, ('width', 'height', 'codec')) == {'width': 1280, 'height': 720, 'codec': 'h264'}
+
+
+def test_inspect_ts_mpeg2_sequence_header():
+    sequence = b'\x00\x00\x01\xb3' + bytes([720 >> 4, ((720 & 15) << 4) | (576 >> 8), 576 & 255]) + b'\x33\xff\xff\xe0'
+    data = ts_packets([
+        (0x000, True, psi_section(0x00, b'\x00\x01\xe1\x00')),
+        (0x100, True, psi_section(0x02, b'\xe1\x00\xf0\x00\x02\xe1\x01\xf0\x00')),
+        (0x101, True, b'\x00\x00\x01\xe0\x00\x00\x80\x00\x00' + sequence),
+    ])
+    assert subset(iptv.inspect_stream(data, 'mpegts'), ('width', 'height', 'codec')) == {
+        'width': 720, 'height': 576, 'codec': 'mpeg2'}
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('CCTV-1 HD', 720),
+    ('CCTVHD', 720),
+    ('湖南卫视HD', 720),
+    ('BTV FHD', 1080),
+    ('CCTV4K', 2160),
+    ('CCTV-1 1080i', 1080),
+    ('CCTV SD', 576),
+    ('HDTV', 0),
+    ('BSD News', 0),
+])
+def test_guess_resolution(name, expected):
+    assert iptv._guess_resolution(name) == expected
+
+
+# ---- 结果标注和按画质分类 ----
+
+def test_annotate_video():
+    extinf = '#EXTINF:-1 tvg-id="1" video-codec="mpeg2",CCTV-1'
+    video = {'codec': 'h264', 'width': 1920, 'height': 1080}
+    assert iptv.annotate_video(extinf, video) == \
+        '#EXTINF:-1 video-codec="h264" video-resolution="1920x1080" tvg-id="1",CCTV-1'
+    assert iptv.annotate_video(extinf, None) == extinf
+    assert iptv.annotate_video(extinf, {'audio': 'aac'}) == extinf
+
+
+def test_writer_orders_by_height(tmp_path):
+    writer = iptv.StreamResultWriter(str(tmp_path))
+    for name in ('a', 'b', 'c'):
+        writer.write(f'#EXTINF:-1,{name}', f'http://x.com/{name}.ts', False, True)
+    writer.finalize({'http://x.com/a.ts': 0.9, 'http://x.com/c.ts': 0.5},
+                    {'http://x.com/b.ts': 1080, 'http://x.com/c.ts': 720, 'http://x.com/a.ts': 720})
+    with open(tmp_path / '全部_可用_3个.m3u', encoding='utf-8') as f:
+        assert [line.strip() for line in f if line.startswith('http')] == \
+            ['http://x.com/b.ts', 'http://x.com/a.ts', 'http://x.com/c.ts']
+
+
+def test_scan_splits_low_quality(origin, tmp_path, monkeypatch, capsys):
+    hd = origin.add_stream('/hd.ts', make_ts(h264_sps(1920, 1080)))
+    sd = origin.add_stream('/sd.ts', make_ts(h264_sps(720, 576)))
+    playlist = write_playlist(tmp_path / 'list.m3u', [('高清', hd), ('标清', sd)])
+    files = run_check(playlist, tmp_path, monkeypatch, min_height=720, history=False)
+    assert '全部_可用_1个.m3u' in files and '全部_低画质_1个.m3u' in files
+    with open(tmp_path / 'm3u_check_result' / '全部_低画质_1个.m3u', encoding='utf-8') as f:
+        text = f.read()
+    assert 'video-codec="h264" video-resolution="720x576"' in text and sd in text
+    assert '低于 720p 的可用流: 全部_低画质_1个.m3u' in capsys.readouterr().out
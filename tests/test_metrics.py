@@ -0,0 +1,62 @@
+"""分阶段耗时统计"""
+import asyncio
+import json
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+def timings(**phases):
+    result = iptv._new_timings()
+    result.update(phases)
+    return result
+
+
+def test_probe_metrics_histograms(tmp_path):
+    metrics = iptv.ProbeMetrics()
+    metrics.record('http://a.com/1.ts', {'status': 'ok', 'timings': timings(ttfb=0.02, total=0.03, bytes=100)})
+    metrics.record('http://a.com/2.ts', {'status': 'fail', 'timings': timings(ttfb=0.4, total=0.6)})
+    metrics.record('http://[2001:db8::1]/3.ts', {'status': 'ok', 'ipv6': True, 'timings': timings(total=3)})
+    metrics.record('http://a.com/4.ts', {'status': 'ok', 'cached': True})   # 没有耗时的结果不计入
+    report = metrics.to_dict()
+    ipv4 = report['families']['ipv4']
+    assert (ipv4['probes'], ipv4['ok'], ipv4['fail'], ipv4['bytes']) == (2, 1, 1, 100)
+    assert ipv4['phases']['ttfb']['p50'] == 0.025
+    assert ipv4['phases']['total']['p99'] == 1
+    assert list(report['hosts']) == ['[2001:db8::1]:80', 'a.com:80']
+    assert 'TCP连接' not in metrics.summary() and '首字节 平均 210ms' in metrics.summary()
+
+    path = str(tmp_path / 'metrics.prom')
+    metrics.write_prometheus(path)
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    assert 'iptv_probe_phase_seconds_bucket{family="ipv4",phase="ttfb",le="0.025"} 1' in text
+    assert 'iptv_probe_phase_seconds_count{family="ipv4",phase="total"} 2' in text
+    assert 'iptv_probes_total{family="ipv6",status="ok"} 1' in text
+
+
+def test_check_stream_records_timings(origin):
+    result = iptv.check_stream(origin.add_stream('/live/1.ts'))
+    phases = result['timings']
+    assert phases['connect'] is not None and phases['ttfb'] is not None
+    assert phases['bytes'] > 0
+    assert phases['total'] >= phases['ttfb']
+
+
+def test_only_connecting_probe_records_connect_time():
+    async def main():
+        prober = iptv.TieredProber(iptv.AsyncConnectionPool(), 10)
+        return await asyncio.gather(*(prober.probe(f'http://127.0.0.1:1/{i}.ts') for i in range(3)))
+
+    results = asyncio.run(main())
+    # 等待同一 主机:端口 连接结果的探测不记录连接耗时
+    assert sum(result['timings']['connect'] is not None for result in results) == 1
+
+
+def test_scan_writes_reports(origin, tmp_path, monkeypatch):
+    playlist = write_playlist(tmp_path / 'list.m3u', [('频道1', origin.add_stream('/live/1.ts'))])
+    files = run_check(playlist, tmp_path, monkeypatch, prometheus=True)
+    assert iptv.METRICS_JSON_FILE in files and iptv.METRICS_PROM_FILE in files
+    with open(tmp_path / 'm3u_check_result' / iptv.METRICS_JSON_FILE, encoding='utf-8') as f:
+        report = json.load(f)
+    assert report['families']['ipv4']['probes'] == 1
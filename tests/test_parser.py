@@ -0,0 +1,39 @@
+"""播放列表单遍解析"""
+import iptv
+
+
+def test_iter_m3u_entries_parses_attributes():
+    lines = [
+        '\ufeff#EXTM3U\n',
+        '#EXTINF:-1 tvg-id="cctv1" tvg-name="CCTV1" tvg-logo="http://logo/1.png" group-title="央视",CCTV-1 综合 1080P\n',
+        'http://a.com/1.ts\n',
+        'http://a.com/1b.ts\n',
+        '\n',
+        '#EXTINF:-1,湖南卫视\n',
+        '#EXTVLCOPT:http-user-agent=x\n',
+        'http://[2001:db8::1]/2.ts\n',
+        'rtmp://a.com/ignored\n',
+    ]
+    entries = list(iptv.iter_m3u_entries(lines))
+    assert [entry.url for entry in entries] == ['http://a.com/1.ts', 'http://a.com/1b.ts', 'http://[2001:db8::1]/2.ts']
+    first = entries[0]
+    assert (first.name, first.tvg_id, first.tvg_name, first.tvg_logo, first.group_title) == \
+        ('CCTV1', 'cctv1', 'CCTV1', 'http://logo/1.png', '央视')
+    assert first.resolution == 1080
+    # 同一EXTINF行下的多个URL共用频道信息
+    assert entries[1].extinf == first.extinf and entries[1].name == 'CCTV1'
+    assert entries[2].name == '湖南卫视' and entries[2].tvg_id == ''
+    assert entries[2].is_ipv6 and not first.is_ipv6
+
+
+def test_title_after_attributes_with_commas():
+    name, tvg_id, _, _, group, _ = iptv._parse_extinf('#EXTINF:-1 group-title="体育,赛事",CCTV5+')
+    assert (name, tvg_id, group) == ('CCTV5+', '', '体育,赛事')
+
+
+def test_open_m3u_source_streams_local_file(tmp_path):
+    path = tmp_path / 'list.m3u'
+    path.write_text('#EXTM3U\n#EXTINF:-1,频道\nhttp://a.com/1.ts\n', encoding='utf-8')
+    lines = iptv.open_m3u_source(str(path))
+    assert [entry.url for entry in iptv.iter_m3u_entries(lines)] == ['http://a.com/1.ts']
+    assert iptv.open_m3u_source(str(tmp_path / 'missing.m3u')) is None
@@ -0,0 +1,74 @@
+"""多源播放列表获取和条件请求缓存"""
+import os
+
+import iptv
+
+PLAYLIST = '#EXTM3U\n#EXTINF:-1,频道1\nhttp://a.com/1.ts\n#EXTINF:-1,频道2\nhttp://a.com/2.ts\n'
+
+
+def drain(source, meta):
+    """读完 fetch_playlist_source, 返回 (全部行, 新的meta, 状态)"""
+    lines = []
+    chunks = iptv.fetch_playlist_source(source, meta)
+    while True:
+        try:
+            lines += next(chunks)
+        except StopIteration as done:
+            return lines, done.value[0], done.value[1]
+
+
+def test_url_source_revalidated_with_etag(origin, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(iptv.PLAYLIST_CACHE_DIR)
+    content = {'etag': '"v1"', 'body': PLAYLIST}
+
+    def playlist(handler):
+        if handler.headers.get('If-None-Match') == content['etag']:
+            return 304, {'ETag': content['etag']}, b''
+        return 200, {'Content-Type': 'audio/x-mpegurl', 'ETag': content['etag']}, content['body'].encode('utf-8')
+
+    origin.routes['/list.m3u'] = playlist
+    url = origin.url('/list.m3u')
+    lines, meta, state = drain(url, {})
+    assert state == 'updated' and meta['etag'] == '"v1"'
+    assert lines == PLAYLIST.splitlines()
+
+    # 刚下载过的副本直接使用, 不发请求
+    assert drain(url, meta)[1:] == (meta, 'fresh')
+    assert len(origin.requests) == 1
+
+    meta['fetched_at'] = 0
+    lines, meta, state = drain(url, meta)
+    assert state == 'not_modified' and lines == PLAYLIST.splitlines()
+    assert len(origin.requests) == 2
+
+    content.update(etag='"v2"', body=PLAYLIST + '#EXTINF:-1,频道3\nhttp://a.com/3.ts\n')
+    meta['fetched_at'] = 0
+    lines, meta, state = drain(url, meta)
+    assert state == 'updated' and meta['etag'] == '"v2"' and len(lines) == 7
+
+
+def test_local_source_hashed_only_when_changed(tmp_path):
+    path = tmp_path / 'list.m3u'
+    path.write_text(PLAYLIST, encoding='utf-8')
+    _, meta, state = drain(str(path), {})
+    assert state == 'updated' and meta['sha256']
+    assert drain(str(path), meta)[2] == 'unchanged'
+    path.write_text(PLAYLIST + '\n', encoding='utf-8')
+    assert drain(str(path), meta)[2] == 'updated'
+
+
+def test_sources_merged_and_failures_reported(origin, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    origin.routes['/a.m3u'] = (200, {}, PLAYLIST.encode('utf-8'))
+    local = tmp_path / 'b.m3u'
+    local.write_text('#EXTM3U\n#EXTINF:-1,频道3\nhttp://b.com/3.ts\n', encoding='utf-8')
+    missing = origin.url('/missing.m3u')
+    entries = iptv.open_m3u_entries([origin.url('/a.m3u'), str(local), missing])
+    urls = sorted(entry.url for entry in entries)
+    assert urls == ['http://a.com/1.ts', 'http://a.com/2.ts', 'http://b.com/3.ts']
+    # 4xx错误不重试
+    assert origin.requests.count('/missing.m3u') == 1
+    out = capsys.readouterr().out
+    assert f'[失败] {missing}' in out and '合并后共 3 个条目 (来自 2/3 个源)' in out
+    assert iptv.open_m3u_entries([missing]) is None
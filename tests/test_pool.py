@@ -0,0 +1,59 @@
+"""探测连接复用"""
+import time
+
+import iptv
+
+
+class FakeReader:
+    def at_eof(self):
+        return False
+
+
+class FakeWriter:
+    def __init__(self):
+        self.closed = False
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def test_thread_probes_reuse_connection(origin):
+    urls = [origin.add_stream(f'/live/{i}.ts') for i in range(5)]
+    iptv.pool_stats.reset()
+    results = [iptv.check_stream(url) for url in urls]
+    assert all(result['status'] == 'ok' for result in results)
+    assert len(origin.connections) == 1
+    assert iptv.pool_stats.hits == 4
+    assert iptv.pool_stats.misses == 1
+
+
+def test_async_probes_reuse_connection(origin):
+    urls = [origin.add_stream(f'/live/{i}.ts') for i in range(5)]
+    lines = ['#EXTM3U'] + [line for i, url in enumerate(urls) for line in (f'#EXTINF:-1,频道{i}', url)]
+    results = {}
+    iptv.run_async_checks(list(iptv.iter_m3u_entries(lines)),
+                          lambda entry, result: results.__setitem__(entry.url, result),
+                          max_in_flight=4, per_host=1)
+    assert [results[url]['status'] for url in urls] == ['ok'] * 5
+    assert len(origin.connections) == 1
+
+
+def test_async_pool_limits_and_expiry():
+    pool = iptv.AsyncConnectionPool(per_host=1, idle_timeout=30)
+    key = ('http', 'a', 80)
+    first, second = FakeWriter(), FakeWriter()
+    pool.release(key, FakeReader(), first)
+    pool.release(key, FakeReader(), second)
+    # 超过单主机上限的连接直接关闭
+    assert second.closed and not first.closed
+    assert pool.acquire(key)[1] is first
+    assert pool.acquire(key) is None
+
+    pool.release(key, FakeReader(), first)
+    pool.idle[key][0] = (pool.idle[key][0][0], first, time.monotonic() - 60)
+    # 空闲太久的连接不再使用
+    assert pool.acquire(key) is None
+    assert first.closed
@@ -0,0 +1,69 @@
+"""按主机分层抽样"""
+import json
+import random
+
+import pytest
+
+import iptv
+
+
+@pytest.mark.parametrize('ok, n, population, expected', [
+    (8, 10, None, (0.490157, 0.943319)),
+    (5, 10, None, (0.236590, 0.763410)),
+    (0, 10, None, (0.0, 0.277540)),
+    (10, 10, None, (0.722460, 1.0)),
+    (5, 10, 20, (0.308902, 0.691098)),      # 有限总体修正后区间变窄
+    (10, 10, 10, (1.0, 1.0)),               # 全部抽到时没有抽样误差
+    (0, 0, None, (0.0, 1.0)),
+])
+def test_wilson_interval(ok, n, population, expected):
+    assert iptv.wilson_interval(ok, n, population) == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize('parts, expected', [
+    # Agresti-Coull: p = (5 + z²/2) / (10 + z²) = 0.5, 方差 0.25 / 13.8416 * 90/99
+    ([(1, 5, 10, 100)], (0.5, 0.248848, 0.751152)),
+    # 第一层全部抽到, 只有第二层贡献方差
+    ([(3, 10, 10, 10), (1, 0, 4, 40)], (0.75, 0.677700, 0.822300)),
+    ([(2, 3, 3, 3), (2, 1, 1, 1)], (1.0, 1.0, 1.0)),
+    ([(1, 0, 0, 5)], (0.0, 0.0, 1.0)),
+    ([], (0.0, 0.0, 1.0)),
+])
+def test_combine_strata(parts, expected):
+    assert iptv.combine_strata(parts) == pytest.approx(expected, abs=1e-6)
+
+
+def test_stratified_order_rotates_groups():
+    urls = [(f'http://a/{group}{i}', group) for group in 'xyz' for i in range(3)]
+    ordered = iptv._stratified_order(urls, random.Random(1))
+    assert sorted(ordered) == sorted(urls)
+    # 前3个抽样覆盖全部3个分组
+    assert {group for _, group in ordered[:3]} == {'x', 'y', 'z'}
+
+
+def test_sampled_health_report(origin, tmp_path, monkeypatch):
+    lines = ['#EXTM3U']
+    for i in range(20):
+        url = origin.add_stream(f'/live/{i}.ts') if i % 2 else origin.url(f'/missing/{i}.ts')
+        lines += [f'#EXTINF:-1 group-title="分组{i % 4}",频道{i}', url]
+    for i in range(5):
+        lines += [f'#EXTINF:-1 group-title="失效",失效{i}', f'http://127.0.0.1:1/live/{i}.ts']
+    playlist = tmp_path / 'list.m3u'
+    playlist.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('builtins.input', lambda *args: 'n')
+    iptv.check_sampled_health(str(playlist), seed=1)
+
+    output_dir = tmp_path / 'm3u_check_result'
+    with open(output_dir / iptv.SAMPLE_REPORT_FILE, encoding='utf-8') as f:
+        report = json.load(f)
+    hosts = {host['origin']: host for host in report['hosts']}
+    live = hosts[f'127.0.0.1:{origin.port}']
+    dead = hosts['127.0.0.1:1']
+    # 能连上但有失败的主机扩大抽样, 完全连不上的主机只抽第一轮
+    assert live['sampled'] == iptv.SAMPLE_MAX_PER_HOST and live['alive']
+    assert 0 < live['ok'] < live['sampled']
+    assert dead['sampled'] == iptv.SAMPLE_MIN_PER_HOST and not dead['alive']
+    assert report['sampled'] == iptv.SAMPLE_MAX_PER_HOST + iptv.SAMPLE_MIN_PER_HOST
+    assert report['overall']['low'] < report['overall']['estimate'] < report['overall']['high']
+    assert (output_dir / '抽样_存活主机_20个.m3u').exists()
@@ -0,0 +1,98 @@
+"""播放列表HTTP服务"""
+import asyncio
+import gzip
+import json
+
+import pytest
+
+import iptv
+
+BODY = '#EXTM3U\n#EXTINF:-1,频道1\nhttp://a/1.ts\n'.encode('utf-8')
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate', True),
+    ('deflate, gzip;q=0.5', True),
+    ('gzip;q=0', False),
+    ('GZIP ; Q=0.0', False),
+    ('x-gzip', True),
+    ('*', True),
+    ('*;q=0', False),
+    ('gzip;q=0, *', False),
+    ('deflate, br', False),
+    ('gzip;q=abc', False),
+    ('', False),
+])
+def test_accepts_gzip(header, expected):
+    assert iptv._accepts_gzip(header) is expected
+
+
+def test_respond_etag_and_gzip():
+    server = iptv.PlaylistServer()
+    server.update({'/all.m3u': BODY})
+    status, headers, body = server._respond('GET', '/', {})
+    headers = dict(headers)
+    assert status == '200 OK' and body == BODY and 'Content-Encoding' not in headers
+    etag = headers['ETag']
+
+    status, headers, body = server._respond('GET', '/all.m3u?x=1', {'accept-encoding': 'gzip'})
+    headers = dict(headers)
+    assert headers['Content-Encoding'] == 'gzip' and gzip.decompress(body) == BODY
+    # 压缩和未压缩的内容使用不同的ETag
+    assert headers['ETag'] != etag
+
+    status, _, body = server._respond('GET', '/all.m3u', {'if-none-match': f'"other", {etag}'})
+    assert status == '304 Not Modified' and body == b''
+    assert server._respond('GET', '/all.m3u', {'if-none-match': etag, 'accept-encoding': 'gzip'})[0] == '200 OK'
+    assert server.not_modified == 1
+    assert server._respond('GET', '/missing.m3u', {})[0] == '404 Not Found'
+    assert server._respond('POST', '/all.m3u', {})[0] == '405 Method Not Allowed'
+
+    index = json.loads(server._respond('GET', '/index.json', {})[2])
+    assert index == [{'path': '/all.m3u', 'entries': 1}]
+    # 内容未变时沿用已渲染的响应, ETag不变
+    rendered = server.responses['/all.m3u']
+    server.update({'/all.m3u': BODY})
+    assert server.responses['/all.m3u'] is rendered
+
+
+def test_keep_alive_and_head():
+    async def main():
+        server = iptv.PlaylistServer()
+        server.update({'/all.m3u': BODY})
+        http_server = await server.start('127.0.0.1', 0)
+        port = http_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'HEAD /all.m3u HTTP/1.1\r\nHost: x\r\n\r\n'
+                     b'GET /all.m3u HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+        data = await reader.read()
+        writer.close()
+        http_server.close()
+        await http_server.wait_closed()
+        return server, data
+
+    server, data = asyncio.run(main())
+    head, rest = data.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 200 OK') and b'Connection: keep-alive' in head
+    # HEAD 没有响应体, 同一连接上的第二个请求紧接着返回
+    second_head, body = rest.split(b'\r\n\r\n', 1)
+    assert second_head.startswith(b'HTTP/1.1 200 OK') and b'Connection: close' in second_head
+    assert body == BODY
+    assert server.requests == 2
+
+
+def test_daemon_renders_group_playlists():
+    daemon = iptv.MonitorDaemon(['unused.m3u'], serve=('127.0.0.1', 0))
+    lines = ['#EXTM3U',
+             '#EXTINF:-1 group-title="央视",CCTV1', 'http://a/1.ts',
+             '#EXTINF:-1,无分组', 'http://[2001:db8::1]/2.ts',
+             '#EXTINF:-1 group-title="央视",CCTV2', 'http://a/3.ts']
+    daemon.load(list(iptv.iter_m3u_entries(lines)), None)
+    for key, stream in daemon.streams.items():
+        stream.record(not key.endswith('/3.ts'))
+        stream.ipv6 = stream.entries[0].is_ipv6
+    playlists = daemon.render_playlists()
+    assert playlists['/all.m3u'].count(b'http') == 2
+    assert b'2001:db8' in playlists['/ipv6.m3u'] and b'2001:db8' not in playlists['/ipv4.m3u']
+    assert playlists['/group/央视.m3u'].count(b'http') == 1
+    assert f'/group/{iptv.SERVE_NO_GROUP}.m3u' in playlists
@@ -0,0 +1,27 @@
+"""多进程分片检测"""
+import iptv
+from conftest import run_check, write_playlist
+
+
+def test_shard_of_is_stable_per_host():
+    urls = [f'http://host{i}.test/live/{j}.ts' for i in range(20) for j in range(3)]
+    shards = {}
+    for url in urls:
+        shards.setdefault(iptv.get_url_host(url), set()).add(iptv.shard_of(url, 4))
+    # 同一主机的链接总在同一个进程
+    assert all(len(values) == 1 for values in shards.values())
+    assert {value for values in shards.values() for value in values} <= {0, 1, 2, 3}
+    assert iptv.shard_of('http://HOST1.test/a', 4) == iptv.shard_of('http://host1.test/b', 4)
+
+
+def test_sharded_scan_matches_other_engines(origin, tmp_path, monkeypatch, capsys):
+    items = [(f'频道{i}', origin.add_stream(f'/live/{i}.ts')) for i in range(3)]
+    items.append(('页面', origin.add_stream('/page.ts', b'<html>' + b'x' * 2000, 'text/html')))
+    items += [(f'失效{i}', f'http://127.0.0.1:1/live/{i}.ts') for i in range(12)]
+    playlist = write_playlist(tmp_path / 'list.m3u', items)
+    files = run_check(playlist, tmp_path, monkeypatch, engine='sharded', workers=2, per_host=1)
+    assert '全部_可用_3个.m3u' in files and '全部_不可用_13个.m3u' in files
+    out = capsys.readouterr().out
+    assert '使用 2 个进程分片检测' in out
+    # 熔断在工作进程中进行, 统计合并回父进程
+    assert '熔断: 1 个主机被熔断, 跳过 7 个链接' in out
@@ -0,0 +1,42 @@
+"""封装格式识别"""
+import asyncio
+
+import pytest
+
+import iptv
+from conftest import TS_BODY, TS_PACKET
+
+ADTS_FRAME = b'\xff\xf1\x50\x80\x02\x1f\xfc' + b'\x00' * 9
+
+
+@pytest.mark.parametrize('data, expected', [
+    (TS_PACKET * 3, ('mpegts', False)),
+    ((b'\x00' * 4 + TS_PACKET) * 3, ('m2ts', False)),
+    (TS_PACKET[:100], (None, True)),
+    (b'', (None, True)),
+    (b'FL', (None, True)),
+    (b'FLV\x01\x05', ('flv', False)),
+    (b'#EXTM3U\n', ('hls', False)),
+    (b'\xef\xbb\xbf#EXTM3U\n', ('hls', False)),
+    (b'ID3\x04\x00', ('id3', False)),
+    (b'\x00\x00\x00\x18ftypisom' + b'\x00' * 12, ('mp4', False)),
+    (ADTS_FRAME * 2, ('adts', False)),
+    (b'\x00\x00\x01\xba\x44', ('mpeg-ps', False)),
+    (b'\x00\x00\x00\x01\x67\x64\x00\x1f', ('h264', False)),
+    (b'\x00\x00\x00\x01\x67', (None, True)),
+    # 64位大小的box与Annex-B起始码相同, 按box类型识别为MP4
+    (b'\x00\x00\x00\x01ftyp' + (24).to_bytes(8, 'big') + b'isom' + b'\x00' * 4, ('mp4', False)),
+    (b'<html><body>' + b'x' * 400, (None, False)),
+])
+def test_sniff_container(data, expected):
+    assert iptv.sniff_container(data) == expected
+    assert iptv.sniff_container(memoryview(bytearray(data))) == expected
+
+
+def test_check_stream_uses_container_not_content_type(origin):
+    mislabeled = origin.add_stream('/live/1.ts', TS_BODY, 'text/html')
+    page = origin.add_stream('/page.ts', b'<html>' + b'x' * 2000, 'text/html')
+    result = iptv.check_stream(mislabeled)
+    assert result['status'] == 'ok' and result['container'] == 'mpegts'
+    assert iptv.check_stream(page)['status'] == 'fail'
+    assert asyncio.run(iptv.check_stream_async(mislabeled))['container'] == 'mpegts'
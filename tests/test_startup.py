@@ -0,0 +1,56 @@
+"""启动阶段: 网络环境检测缓存和延迟导入"""
+import os
+import socket
+import subprocess
+import sys
+
+import iptv
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_network_check_is_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    targets = {'ipv4': ('127.0.0.1', listener.getsockname()[1]), 'ipv6': ('::1', closed_port())}
+    capabilities = iptv.check_network_capabilities(targets, timeout=1)
+    assert capabilities['ipv4']['available'] and not capabilities['ipv6']['available']
+    assert capabilities['preference'] == 'ipv4'
+    assert os.path.exists(iptv.NETWORK_CACHE_FILE)
+
+    # 有效期内即使目标已不可用也直接使用缓存
+    listener.close()
+    assert iptv.check_network_capabilities(targets, timeout=1) == capabilities
+    # 目标不同或缓存过期时重新检测
+    other = {'ipv4': ('127.0.0.1', closed_port())}
+    assert iptv.check_network_capabilities(other, timeout=1)['preference'] is None
+    now = iptv.time.time()
+    monkeypatch.setattr(iptv.time, 'time', lambda: now + iptv.NETWORK_CACHE_TTL + 1)
+    assert iptv.check_network_capabilities(targets, timeout=1)['preference'] is None
+
+
+def test_background_check_report(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    future = iptv.start_network_check(targets={'ipv4': ('127.0.0.1', closed_port())}, timeout=1,
+                                      use_cache=False)
+    network_info = iptv.report_network_check(future)
+    assert network_info['preference'] is None
+    assert '未检测到可用的网络' in capsys.readouterr().out
+    assert not os.path.exists(iptv.NETWORK_CACHE_FILE)
+
+
+def test_requests_imported_lazily():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys, iptv; print('requests' in sys.modules); "
+            "iptv._requests(); print('requests' in sys.modules)")
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True,
+                            text=True, check=True).stdout.split()
+    assert output == ['False', 'True']
@@ -0,0 +1,52 @@
+"""持续速率测量"""
+import asyncio
+import json
+import time
+
+import iptv
+from conftest import TS_BODY
+
+
+def test_parse_hls_playlist():
+    master = ('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow/index.m3u8\n'
+              '#EXT-X-STREAM-INF:BANDWIDTH=3000000\nhttp://cdn/high.m3u8\n')
+    assert iptv._parse_hls_playlist(master, 'http://a.com/live/main.m3u8') == \
+        ('master', ['http://a.com/live/low/index.m3u8', 'http://cdn/high.m3u8'])
+    media = '#EXTM3U\n#EXT-X-TARGETDURATION:4\n#EXTINF:4.0,\nseg1.ts\n\n#EXTINF:4.0,\n/abs/seg2.ts\n#EXT-X-ENDLIST\n'
+    assert iptv._parse_hls_playlist(media, 'http://a.com/live/low/index.m3u8') == \
+        ('media', ['http://a.com/live/low/seg1.ts', 'http://a.com/abs/seg2.ts'])
+    assert iptv._parse_hls_playlist('#EXTM3U\n', 'http://a.com/') == ('media', [])
+
+
+def test_bandwidth_limiter_waits_when_over_rate():
+    async def main():
+        limiter = iptv.BandwidthLimiter(100000)
+        assert await limiter.consume(50000) == 0
+        start = time.monotonic()
+        waited = await limiter.consume(70000)
+        return waited, time.monotonic() - start
+
+    waited, elapsed = asyncio.run(main())
+    assert 0.15 < waited < 0.3
+    assert elapsed >= waited * 0.9
+    assert asyncio.run(iptv.BandwidthLimiter(0).consume(10 ** 9)) == 0
+
+
+def test_measure_throughput_ranks_streams(origin, tmp_path):
+    ts = origin.add_stream('/live/1.ts', TS_BODY * 100)
+    hls_type = {'Content-Type': 'application/vnd.apple.mpegurl'}
+    origin.routes['/hls/main.m3u8'] = (200, hls_type, b'#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n')
+    origin.routes['/hls/low.m3u8'] = (200, hls_type, b'#EXTM3U\n#EXTINF:4,\nseg1.ts\n#EXTINF:4,\nseg2.ts\n')
+    origin.add_stream('/hls/seg1.ts')
+    origin.add_stream('/hls/seg2.ts')
+    hls = origin.url('/hls/main.m3u8')
+    missing = origin.url('/missing.ts')
+    iptv.measure_throughput([('#EXTINF:-1,直播', ts), ('#EXTINF:-1,HLS', hls), ('#EXTINF:-1,失效', missing)],
+                            str(tmp_path), window=0.5, bandwidth_cap=0)
+    with open(tmp_path / iptv.MEASURE_REPORT_FILE, encoding='utf-8') as f:
+        report = {item['url']: item for item in json.load(f)}
+    assert report[ts]['bytes'] == len(TS_BODY) * 100 and not report[ts]['hls']
+    assert report[hls]['hls'] and report[hls]['bytes'] == len(TS_BODY) * 2
+    assert report[missing]['error'] == 'HTTP状态码错误: 404' and report[missing]['bytes'] == 0
+    with open(tmp_path / '测速排序_3个.m3u', encoding='utf-8') as f:
+        assert [line.strip() for line in f if line.startswith('http')][-1] == missing
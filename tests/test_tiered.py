@@ -0,0 +1,62 @@
+"""异步分级探测"""
+import asyncio
+
+import iptv
+
+
+class CountingProber(iptv.TieredProber):
+    """记录实际发起的TCP连接探测次数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connects = 0
+
+    async def _tcp_connect(self, *args):
+        self.connects += 1
+        return await super()._tcp_connect(*args)
+
+
+def run_probes(urls, sequential=True):
+    async def main():
+        pool = iptv.AsyncConnectionPool()
+        prober = CountingProber(pool, 10)
+        try:
+            if sequential:
+                results = [await prober.probe(url) for url in urls]
+            else:
+                results = await asyncio.gather(*(prober.probe(url) for url in urls))
+        finally:
+            pool.close()
+        return prober, results
+    return asyncio.run(main())
+
+
+def test_each_tier_eliminates(origin):
+    good = origin.add_stream('/live/1.ts')
+    page = origin.add_stream('/page.ts', b'<html>' + b'x' * 2000, 'text/html')
+    missing = origin.url('/missing.ts')
+    dead = 'http://127.0.0.1:1/live.ts'
+    prober, results = run_probes([good, page, missing, dead, dead + '?b'])
+    assert [result['status'] for result in results] == ['ok'] + ['fail'] * 4
+    assert prober.eliminated == {'connect': 2, 'header': 1, 'payload': 1}
+    assert prober.passed == 1
+    # 每个 主机:端口 只做一次TCP连接探测, 探测时建立的连接交给第2级复用
+    assert prober.connects == 2
+    assert len(origin.connections) == 1
+    assert 'TCP连接阶段淘汰 2 个' in prober.summary()
+
+
+def test_connect_failures_expire(monkeypatch):
+    monkeypatch.setattr(iptv, 'TIER_CONNECT_FAIL_TTL', 0)
+    prober, results = run_probes(['http://127.0.0.1:1/a.ts', 'http://127.0.0.1:1/b.ts'])
+    assert all(result['status'] == 'fail' for result in results)
+    # 失败的结论过期后重新探测连接
+    assert prober.connects == 2
+    assert prober.eliminated['connect'] == 2
+
+
+def test_concurrent_probes_share_connect_check(origin):
+    urls = [origin.add_stream(f'/live/{i}.ts') for i in range(4)]
+    prober, results = run_probes(urls, sequential=False)
+    assert all(result['status'] == 'ok' for result in results)
+    assert prober.connects == 1
@@ -0,0 +1,48 @@
+"""检测结果边检测边写入"""
+import os
+
+import iptv
+from conftest import run_check, write_playlist
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_writer_flushes_part_files(tmp_path):
+    writer = iptv.StreamResultWriter(str(tmp_path))
+    writer.write('#EXTINF:-1,频道A', 'http://a/1.ts', False, True)
+    writer.write('#EXTINF:-1,频道B', 'http://[2001:db8::1]/2.ts', True, False)
+    # 未关闭文件时内容已经落盘
+    assert read(tmp_path / '全部_可用.m3u.part') == '#EXTM3U\n#EXTINF:-1,频道A\nhttp://a/1.ts\n'
+    assert 'http://[2001:db8::1]/2.ts' in read(tmp_path / 'IPv6_不可用.m3u.part')
+    assert writer.counts[('全部', '可用')] == 1
+    assert writer.counts[('IPv4', '可用')] == 1
+    assert writer.counts[('IPv6', '不可用')] == 1
+    assert writer.total('全部') == 2
+    writer.finalize()
+
+
+def test_writer_finalize_renames_and_drops_empty(tmp_path):
+    writer = iptv.StreamResultWriter(str(tmp_path))
+    writer.write('#EXTINF:-1,频道A', 'http://a/1.ts', False, True)
+    writer.write(None, 'http://a/2.ts', False, True)
+    writer.write('#EXTINF:-1,频道C', 'http://a/3.ts', False, False)
+    writer.finalize()
+    assert sorted(os.listdir(tmp_path)) == ['IPv4_不可用_1个.m3u', 'IPv4_可用_2个.m3u',
+                                            '全部_不可用_1个.m3u', '全部_可用_2个.m3u']
+    assert read(tmp_path / '全部_可用_2个.m3u') == '#EXTM3U\n#EXTINF:-1,频道A\nhttp://a/1.ts\nhttp://a/2.ts\n'
+
+
+def test_check_all_streams_writes_results(origin, tmp_path, monkeypatch):
+    playlist = write_playlist(tmp_path / 'list.m3u', [
+        ('频道1', origin.add_stream('/live/1.ts')),
+        ('频道2', origin.add_stream('/live/2.ts')),
+        ('频道3', origin.url('/missing.ts')),
+    ])
+    files = run_check(playlist, tmp_path, monkeypatch)
+    assert '全部_可用_2个.m3u' in files
+    assert '全部_不可用_1个.m3u' in files
+    assert not any(name.startswith('IPv6_') for name in files)
+    assert not any(name.endswith('.part') for name in files)